@@ -0,0 +1,305 @@
+import os
+import csv
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from misc.synthetic import write_synthetic_scene, WALL_HEIGHT
+from misc.scene_cache import load_annotation_3d, load_bbox_arrays
+from misc.topology import get_topology
+from misc.polygon import convert_lines_to_vertices, convert_planes_to_vertices, triangulate_polygon
+from misc.plane_mesh import clip_polygon
+from misc.panorama import lineIdxFromCors, cor_id_2_cor_all, draw_boundary_from_cor_id
+from misc.utils import parse_camera_info, get_corners_of_bb3d_batch, project_struct_bdb_to_2d
+from misc.detection import project_boxes_2d
+from misc.manifest import list_rooms, list_positions
+from misc.storage import imread, loadtxt
+
+
+def load_scene(root, scene):
+    """inputs of the benchmarks, loaded once per scene
+    """
+    import cv2
+
+    scene_path = os.path.join(root, f"scene_{scene:05d}")
+    annos = load_annotation_3d(scene_path)
+    topology = get_topology(annos)
+
+    rooms, cameras = [], []
+    for room in list_rooms(root, scene):
+        room_path = os.path.join(scene_path, "2D_rendering", room)
+        image = cv2.cvtColor(imread(os.path.join(room_path, "panorama", "full", "rgb_rawlight.png")),
+                             cv2.COLOR_BGR2RGB)
+        rooms.append({
+            'room': room,
+            'image': image,
+            'camera': loadtxt(os.path.join(room_path, "panorama", "camera_xyz.txt")),
+            'cor_id': loadtxt(os.path.join(room_path, "panorama", "layout.txt")),
+        })
+        for position in list_positions(root, scene, room):
+            camera_info = loadtxt(os.path.join(room_path, "perspective", "full", position, "camera_pose.txt"))
+            cameras.append(parse_camera_info(camera_info, 720, 1280))
+
+    planeIDs = [planeID for semantic in annos['semantics'] for planeID in semantic['planeID']]
+    return {
+        'annos': annos,
+        'junctions': np.array([junc['coordinate'] for junc in annos['junctions']]),
+        'junction_pairs': [topology.plane_junction_pairs(planeID) for planeID in planeIDs],
+        'planes': [annos['planes'][planeID] for planeID in planeIDs],
+        'plane_polygons': convert_planes_to_vertices(topology, planeIDs),
+        'rooms': rooms,
+        'cameras': cameras,
+        'boxes': load_bbox_arrays(scene_path)[1:],
+    }
+
+
+def room_walls(annos, room):
+    """floor corners (i, j) of the walls of a room
+    """
+    topology = get_topology(annos)
+    junctions = np.array([junc['coordinate'] for junc in annos['junctions']])
+    for semantic in annos['semantics']:
+        if semantic['ID'] == int(room):
+            for planeID in semantic['planeID']:
+                if annos['planes'][planeID]['type'] == 'floor':
+                    floor = convert_lines_to_vertices(topology.plane_junction_pairs(planeID))[0]
+                    return [(junctions[i], junctions[j]) for i, j in zip(floor, np.roll(floor, -1))]
+    return []
+
+
+def bench_convert_lines_to_vertices(scene):
+    return lambda: [convert_lines_to_vertices(pairs) for pairs in scene['junction_pairs']], \
+        len(scene['junction_pairs'])
+
+
+def bench_clip_polygon(scene):
+    return lambda: [clip_polygon(polygon, scene['junctions'], plane)
+                    for polygon, plane in zip(scene['plane_polygons'], scene['planes'])], len(scene['planes'])
+
+
+def wall_with_holes(num_holes, seed=0):
+    """points, outer loop and hole loops of a wall pierced by a grid of square holes
+    """
+    rng = np.random.default_rng(seed)
+    grid = int(np.ceil(np.sqrt(num_holes)))
+    points = [[0, 0], [2 * grid, 0], [2 * grid, 2 * grid], [0, 2 * grid]]
+    holes = []
+    for k in range(num_holes):
+        x, y = 2 * (k % grid) + 0.5, 2 * (k // grid) + 0.5
+        size = rng.uniform(0.5, 0.9)
+        holes.append(list(range(len(points), len(points) + 4)))
+        points += [[x, y], [x + size, y], [x + size, y + size], [x, y + size]]
+    return np.array(points, dtype=np.float64), [0, 1, 2, 3], holes
+
+
+def bench_triangulate_holes(scene):
+    import shapely
+
+    # 10 holes per room, the scaling column shows the growth of the time with the holes
+    points, outer, holes = wall_with_holes(10 * len(scene['rooms']))
+    expected = shapely.Polygon(points[outer], [points[hole] for hole in holes]).area
+
+    def run():
+        triangles = triangulate_polygon(points, outer, holes)
+        a, b, c = points[triangles[:, 0]], points[triangles[:, 1]], points[triangles[:, 2]]
+        area = np.sum((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (b[:, 1] - a[:, 1]) * (c[:, 0] - a[:, 0])) / 2
+        if not np.isclose(area, expected):
+            raise RuntimeError(f"triangulated area {area} of {len(holes)} holes, expected {expected}")
+    return run, len(holes)
+
+
+def bench_lineIdxFromCors(scene):
+    def run():
+        for room in scene['rooms']:
+            height, width = room['image'].shape[:2]
+            lineIdxFromCors(cor_id_2_cor_all(room['cor_id']), width, height)
+    return run, len(scene['rooms'])
+
+
+def bench_draw_boundary_from_cor_id(scene):
+    return lambda: [draw_boundary_from_cor_id(room['cor_id'], room['image']) for room in scene['rooms']], \
+        len(scene['rooms'])
+
+
+def bench_E2P(scene):
+    from visualize_mesh import E2P, E2P_CACHE
+
+    walls = [(room, corner_i, corner_j) for room in scene['rooms']
+             for corner_i, corner_j in room_walls(scene['annos'], room['room'])]
+
+    def run():
+        # the remap maps are cached, measure them cold
+        E2P_CACHE.clear()
+        for room, corner_i, corner_j in walls:
+            E2P(room['image'], corner_i, corner_j, WALL_HEIGHT, room['camera'])
+    return run, len(walls)
+
+
+def bench_room_mesh_arrays(scene):
+    import panda3d.core  # noqa: F401, the floors and ceilings are triangulated with panda3d
+    from visualize_mesh import room_mesh_arrays, E2P_CACHE
+
+    def run():
+        E2P_CACHE.clear()
+        for room in scene['rooms']:
+            room_mesh_arrays(scene['annos'], room['image'], room['camera'], room['room'])
+    return run, len(scene['rooms'])
+
+
+def bench_create_plane_mesh(scene):
+    import panda3d.core  # noqa: F401
+    import open3d  # noqa: F401, only the open3d conversion is added to room_mesh_arrays
+    from visualize_mesh import room_mesh_arrays, create_open3d_mesh, E2P_CACHE
+
+    def run():
+        E2P_CACHE.clear()
+        for room in scene['rooms']:
+            vertices, triangles, uvs, atlases, material_ids = room_mesh_arrays(
+                scene['annos'], room['image'], room['camera'], room['room'])
+            create_open3d_mesh(vertices, triangles, uvs, atlases, material_ids)
+    return run, len(scene['rooms'])
+
+
+def bench_project_struct_bdb_to_2d(scene):
+    basis, coeffs, centroid = scene['boxes']
+
+    def run():
+        for rot, trans, K in scene['cameras']:
+            for i in range(len(basis)):
+                project_struct_bdb_to_2d(basis[i], coeffs[i], centroid[i] - trans, rot, K)
+    return run, len(basis) * len(scene['cameras'])
+
+
+def bench_project_boxes_2d(scene):
+    basis, coeffs, centroid = scene['boxes']
+
+    def run():
+        corners = get_corners_of_bb3d_batch(basis, coeffs, centroid)
+        for rot, trans, K in scene['cameras']:
+            project_boxes_2d(corners, rot, trans, K, 1280, 720)
+    return run, len(basis) * len(scene['cameras'])
+
+
+BENCHMARKS = {
+    'convert_lines_to_vertices': bench_convert_lines_to_vertices,
+    'clip_polygon': bench_clip_polygon,
+    'triangulate_holes': bench_triangulate_holes,
+    'lineIdxFromCors': bench_lineIdxFromCors,
+    'draw_boundary_from_cor_id': bench_draw_boundary_from_cor_id,
+    'E2P': bench_E2P,
+    'room_mesh_arrays': bench_room_mesh_arrays,
+    'create_plane_mesh': bench_create_plane_mesh,
+    'project_struct_bdb_to_2d': bench_project_struct_bdb_to_2d,
+    'project_boxes_2d': bench_project_boxes_2d,
+}
+
+
+def measure(run, repeat):
+    """best and median wall time of repeat runs, and the peak memory allocated by one run
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+
+def run_benchmarks(root, sizes, names, repeat=5, corners=4, holes=2, objects=8, seed=0):
+    """benchmark results for every scene size (number of rooms), one row per benchmark and size
+    """
+    results = []
+    previous = dict()
+    for scene, num_rooms in enumerate(sizes):
+        write_synthetic_scene(root, scene, seed + scene, num_rooms, corners, holes, objects)
+        inputs = load_scene(root, scene)
+
+        for name in names:
+            try:
+                run, items = BENCHMARKS[name](inputs)
+            except ImportError as e:
+                print(f"{name}: skipped ({e})")
+                continue
+
+            best, median, peak = measure(run, repeat)
+            row = {'benchmark': name, 'rooms': num_rooms, 'items': items, 'best_s': best, 'median_s': median,
+                   'items_per_s': items / best if best > 0 else float('inf'), 'peak_bytes': peak}
+
+            # exponent of the time growth against the number of items, 1 is linear
+            if name in previous and items != previous[name][0] and best > 0 and previous[name][1] > 0:
+                row['scaling'] = np.log(best / previous[name][1]) / np.log(items / previous[name][0])
+            else:
+                row['scaling'] = None
+            previous[name] = (items, best)
+            results.append(row)
+
+            scaling = '' if row['scaling'] is None else f"{row['scaling']:.2f}"
+            print(f"{name:28s} rooms={num_rooms:<4d} items={items:<6d} best={best * 1e3:9.2f} ms "
+                  f"{row['items_per_s']:10.1f} items/s peak={peak / 2 ** 20:8.2f} MiB scaling={scaling}")
+    return results
+
+
+def save_results(path, results):
+    if path.endswith('.csv'):
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) if results else [])
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Geometry Benchmarks on Synthetic Scenes")
+    parser.add_argument("--rooms", default=[1, 4, 16],
+                        help="scene sizes as numbers of rooms, e.g. 1,4,16,64",
+                        type=lambda text: [int(size) for size in text.split(',')])
+    parser.add_argument("--corners", default=4,
+                        help="corners of every room (even)", type=int)
+    parser.add_argument("--holes", default=2,
+                        help="doors and windows per room", type=int)
+    parser.add_argument("--objects", default=8,
+                        help="objects per room", type=int)
+    parser.add_argument("--repeat", default=5,
+                        help="runs of every benchmark", type=int)
+    parser.add_argument("--benchmarks", default=list(BENCHMARKS),
+                        help="comma separated benchmarks, all if not given",
+                        type=lambda text: text.split(','))
+    parser.add_argument("--path", default=None,
+                        help="keep the synthetic scenes in this directory", metavar="DIR")
+    parser.add_argument("--output", default=None,
+                        help="save the results as json, or csv if it ends with .csv", metavar="FILE")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        raise SystemExit(f"unknown benchmarks: {sorted(unknown)}")
+
+    if args.path is None:
+        with tempfile.TemporaryDirectory() as root:
+            results = run_benchmarks(root, args.rooms, args.benchmarks, args.repeat,
+                                     args.corners, args.holes, args.objects)
+    else:
+        results = run_benchmarks(args.path, args.rooms, args.benchmarks, args.repeat,
+                                 args.corners, args.holes, args.objects)
+
+    if args.output is not None:
+        save_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
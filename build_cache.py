@@ -0,0 +1,43 @@
+import os
+import argparse
+
+from misc.scene_cache import convert_scene
+from misc.manifest import open_manifest
+from misc.plane_mesh import load_plane_meshes
+from misc.spatial import load_scene_index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Binary Annotation Cache")
+    parser.add_argument("--path", required=True,
+                        help="dataset path", metavar="DIR")
+    parser.add_argument("--scene", default=None,
+                        help="scene id, all scenes if not given", type=int)
+    parser.add_argument("--plane_meshes", action='store_true',
+                        help="also cache the triangulated plane meshes")
+    parser.add_argument("--spatial_index", action='store_true',
+                        help="also cache the room and object spatial index")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    manifest = open_manifest(args.path)
+    if args.scene is not None:
+        scenes = [f"scene_{args.scene:05d}"]
+    elif manifest is not None:
+        scenes = [f"scene_{scene:05d}" for scene in manifest.scenes()]
+    else:
+        scenes = sorted(name for name in os.listdir(args.path) if name.startswith("scene_"))
+
+    for scene in scenes:
+        convert_scene(os.path.join(args.path, scene))
+        if args.plane_meshes:
+            load_plane_meshes(os.path.join(args.path, scene))
+        if args.spatial_index:
+            load_scene_index(os.path.join(args.path, scene))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import argparse
+import sys
+
+from misc.batch import parse_scenes
+from misc.manifest import open_manifest
+from misc.floorplan import build_floorplan_maps
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Floorplan Maps")
+    parser.add_argument("--path", required=True,
+                        help="dataset path", metavar="DIR")
+    parser.add_argument("--output", required=True,
+                        help="output container", metavar="FILE")
+    parser.add_argument("--scenes", default=None,
+                        help="scene ids and ranges, e.g. 0-2999, all scenes if not given", type=parse_scenes)
+    parser.add_argument("--size", default=256,
+                        help="width and height of the maps in pixels", type=int)
+    parser.add_argument("--workers", default=8,
+                        help="number of worker processes", type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    scenes = args.scenes
+    if scenes is None:
+        manifest = open_manifest(args.path)
+        if manifest is None:
+            raise SystemExit("--scenes is required without a dataset manifest")
+        scenes = manifest.scenes(include_errata=False)
+
+    failed = build_floorplan_maps(args.path, scenes, args.output, args.size, args.workers)
+    print(f"{len(scenes) - len(failed)} scenes rasterized")
+    if failed:
+        print(f"{len(failed)} of {len(scenes)} scenes failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
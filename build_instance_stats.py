@@ -0,0 +1,43 @@
+import sys
+import argparse
+
+from misc.batch import parse_scenes
+from misc.manifest import open_manifest
+from misc.instances import list_instance_views, build_instance_table
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Per-Instance Statistics")
+    parser.add_argument("--path", required=True,
+                        help="dataset path", metavar="DIR")
+    parser.add_argument("--output", required=True,
+                        help="output table", metavar="FILE")
+    parser.add_argument("--scenes", default=None,
+                        help="scene ids and ranges, e.g. 0-2999, all scenes if not given", type=parse_scenes)
+    parser.add_argument("--config", choices=["full", "empty"], default="full",
+                        help="furniture configuration", type=str)
+    parser.add_argument("--workers", default=8,
+                        help="number of worker processes", type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    scenes = args.scenes
+    if scenes is None:
+        manifest = open_manifest(args.path)
+        if manifest is None:
+            raise SystemExit("--scenes is required without a dataset manifest")
+        scenes = manifest.scenes(include_errata=False)
+
+    views = list_instance_views(args.path, scenes, args.config)
+    arrays, failed = build_instance_table(views, args.output, args.workers)
+    print(f"{len(arrays['instance'])} instances in {len(views) - len(failed)} views")
+    if failed:
+        print(f"{len(failed)} of {len(views)} views failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
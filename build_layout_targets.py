@@ -0,0 +1,45 @@
+import argparse
+import sys
+
+from misc.batch import parse_scenes
+from misc.manifest import open_manifest
+from misc.layout_targets import list_panoramas, build_layout_targets
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Layout Boundary and Corner Targets")
+    parser.add_argument("--path", required=True,
+                        help="dataset path", metavar="DIR")
+    parser.add_argument("--output", required=True,
+                        help="output container", metavar="FILE")
+    parser.add_argument("--scenes", default=None,
+                        help="scene ids and ranges, e.g. 0-2999, all scenes if not given", type=parse_scenes)
+    parser.add_argument("--height", default=512,
+                        help="panorama height of the layout coordinates", type=int)
+    parser.add_argument("--width", default=1024,
+                        help="panorama width of the layout coordinates", type=int)
+    parser.add_argument("--workers", default=8,
+                        help="number of worker processes", type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    scenes = args.scenes
+    if scenes is None:
+        manifest = open_manifest(args.path)
+        if manifest is None:
+            raise SystemExit("--scenes is required without a dataset manifest")
+        scenes = manifest.scenes(include_errata=False)
+
+    panoramas = list_panoramas(args.path, scenes)
+    _, failed = build_layout_targets(panoramas, args.output, args.height, args.width, args.workers)
+    print(f"{len(panoramas) - len(failed)} panoramas")
+    if failed:
+        print(f"{len(failed)} of {len(panoramas)} panoramas failed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import argparse
+
+from misc.manifest import build_manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Dataset Manifest")
+    parser.add_argument("--path", required=True,
+                        help="dataset path", metavar="DIR")
+    parser.add_argument("--output", default=None,
+                        help="manifest file, <path>/manifest.sqlite by default", metavar="FILE")
+    parser.add_argument("--workers", default=16,
+                        help="number of threads walking the scenes", type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    build_manifest(args.path, args.output, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+import os
+import sys
+import argparse
+
+from misc.batch import parse_scenes
+from misc.manifest import open_manifest
+from misc.detection import export_scenes, merge_detections
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Detection Labels Export")
+    parser.add_argument("--path", required=True,
+                        help="dataset path", metavar="DIR")
+    parser.add_argument("--out", required=True,
+                        help="directory of the per-scene labels", metavar="DIR")
+    parser.add_argument("--output", default=None,
+                        help="merged labels, COCO json or columnar container if it ends with .bin, "
+                             "<out>/detection.json if not given", metavar="FILE")
+    parser.add_argument("--scenes", default=None,
+                        help="scene ids and ranges, e.g. 0-2999, all scenes if not given", type=parse_scenes)
+    parser.add_argument("--config", choices=["full", "empty"], default="full",
+                        help="furniture configuration", type=str)
+    parser.add_argument("--workers", default=8,
+                        help="number of worker processes", type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    scenes = args.scenes
+    if scenes is None:
+        manifest = open_manifest(args.path)
+        if manifest is None:
+            raise SystemExit("--scenes is required without a dataset manifest")
+        scenes = manifest.scenes(include_errata=False)
+
+    regenerated, failed = export_scenes(args.path, scenes, args.out, args.config, args.workers)
+    print(f"{len(regenerated)} of {len(scenes)} scenes regenerated")
+    if failed:
+        print(f"{len(failed)} of {len(scenes)} scenes failed: {failed}")
+
+    # the failed scenes are left out of the merged labels
+    scenes = sorted(set(scenes) - set(failed))
+    merge_detections(args.out, scenes, args.output or os.path.join(args.out, 'detection.json'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Rectangle packing of the plane textures into texture atlases
+"""
+import numpy as np
+
+
+def pack_rectangles(sizes, max_size=4096, padding=2):
+    """shelf packing of (width, height) rectangles into atlases of at most max_size pixels
+
+    Returns the placement (atlas, x, y) of every rectangle and the (width, height)
+    of every atlas. The rectangles are separated by padding pixels, a new
+    atlas is started when one does not fit into the existing ones.
+    """
+    sizes = np.asarray(sizes, dtype=np.int64).reshape(-1, 2)
+    if np.any(sizes + padding > max_size):
+        raise ValueError(f"rectangle larger than the maximum atlas size {max_size}")
+
+    placements = np.zeros((len(sizes), 3), dtype=np.int64)
+    atlases = []    # per atlas: used height and shelves as [y, height, x]
+
+    # tallest first, so that the shelves are filled with similar heights
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i, 1], -sizes[i, 0])):
+        width, height = sizes[i] + padding
+
+        placed = False
+        for index, atlas in enumerate(atlases):
+            for shelf in atlas['shelves']:
+                if height <= shelf[1] and shelf[2] + width <= max_size:
+                    placements[i] = index, shelf[2], shelf[0]
+                    shelf[2] += width
+                    placed = True
+                    break
+            if placed:
+                break
+            if atlas['height'] + height <= max_size:
+                atlas['shelves'].append([atlas['height'], height, width])
+                placements[i] = index, 0, atlas['height']
+                atlas['height'] += height
+                placed = True
+                break
+
+        if not placed:
+            atlases.append({'height': height, 'shelves': [[0, height, width]]})
+            placements[i] = len(atlases) - 1, 0, 0
+
+    atlas_sizes = [(max(shelf[2] for shelf in atlas['shelves']), atlas['height']) for atlas in atlases]
+    return placements, atlas_sizes
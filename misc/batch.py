@@ -0,0 +1,178 @@
+"""
+Headless batch mode shared by the visualization scripts
+"""
+import os
+import copy
+import argparse
+import traceback
+from multiprocessing import Pool
+
+import matplotlib.pyplot as plt
+
+from misc import profiling
+
+
+def parse_scenes(text):
+    """parse a list of scene ids and ranges, e.g. '0-99,120,200-210'
+    """
+    scenes = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if '-' in item:
+            start, end = item.split('-', 1)
+            if int(end) < int(start):
+                raise argparse.ArgumentTypeError(f"invalid scene range {item}")
+            scenes.extend(range(int(start), int(end) + 1))
+        else:
+            scenes.append(int(item))
+    if not scenes:
+        raise argparse.ArgumentTypeError("empty scene list")
+    return sorted(set(scenes))
+
+
+def add_batch_args(parser):
+    """add --scene/--scenes, --out and --workers to a script parser
+    """
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--scene",
+                       help="scene id", type=int)
+    group.add_argument("--scenes",
+                       help="scene ids and ranges, e.g. 0-99,120", type=parse_scenes)
+    parser.add_argument("--out", default=None,
+                        help="write images to this directory instead of showing them", metavar="DIR")
+    parser.add_argument("--workers", default=1,
+                        help="number of worker processes", type=int)
+    parser.add_argument("--profile", action='store_true',
+                        help="time the stages of every scene, also enabled by S3D_PROFILE=1")
+    return parser
+
+
+def scene_dir(args):
+    return os.path.join(args.out, f"scene_{args.scene:05d}")
+
+
+def output_path(args, name):
+    """path of an output file of the current scene, its directory is created
+    """
+    os.makedirs(scene_dir(args), exist_ok=True)
+    return os.path.join(scene_dir(args), name)
+
+
+def show_figure(args, name, fig=None):
+    """show the figure, or save it as <out>/scene_<id>/<name>.png in batch mode
+    """
+    if args.out is None:
+        plt.show()
+        return
+
+    fig = fig or plt.gcf()
+    with profiling.stage('draw'):
+        fig.savefig(output_path(args, name + '.png'), bbox_inches='tight', pad_inches=0)
+    plt.close(fig)
+
+
+def show_geometries(args, name, geometries, back_face=False):
+    """show open3d geometries, or render them offscreen as <out>/scene_<id>/<name>.png
+    """
+    import open3d
+
+    if args.out is None and not back_face:
+        open3d.visualization.draw_geometries(geometries)
+        return
+
+    vis = open3d.visualization.Visualizer()
+    vis.create_window(visible=args.out is None)
+    render_option = vis.get_render_option()
+    render_option.mesh_show_back_face = back_face
+    for geometry in geometries:
+        vis.add_geometry(geometry)
+
+    if args.out is None:
+        vis.run()
+    else:
+        with profiling.stage('draw'):
+            vis.poll_events()
+            vis.update_renderer()
+            vis.capture_screen_image(output_path(args, name + '.png'), do_render=True)
+    vis.destroy_window()
+
+
+def _marker(args, task):
+    return os.path.join(scene_dir(args), f".{task}.done")
+
+
+def _run_scene(job):
+    """run one scene, returns whether it succeeded, its profile (None when profiling
+    is off) and the peak RSS of the process so far
+    """
+    func, args, task = job
+
+    if args.out is not None:
+        plt.switch_backend('Agg')
+
+    if args.profile:
+        profiling.enable()
+    profiling.reset()
+
+    try:
+        with profiling.stage(task):
+            func(args)
+    except Exception:
+        # a single --scene shows the error as is
+        if args.scenes is None:
+            raise
+        print(f"scene_{args.scene:05d}: {task} failed")
+        traceback.print_exc()
+        return False, None, None
+
+    profile = profiling.report(args.scene) if profiling.enabled() else None
+
+    if args.out is not None:
+        os.makedirs(scene_dir(args), exist_ok=True)
+        if profile is not None:
+            profiling.write_report(output_path(args, f"{task}_profile.json"), profile)
+        open(_marker(args, task), 'w').close()
+    return True, profile, profiling.peak_rss() if profile is not None else None
+
+
+def run_batch(func, args, task):
+    """run func(args) for every requested scene
+
+    With --out the scenes whose outputs are complete are skipped, so an
+    interrupted run can be resumed, and --workers spreads the scenes over a
+    process pool. With --profile the stages of every scene are summarized in
+    <out>/<task>_profile.json and .csv, or printed. The error of a single
+    --scene is raised, in batch mode the failed scenes are returned.
+    """
+    scenes = [args.scene] if args.scene is not None else args.scenes
+
+    jobs = []
+    for scene in scenes:
+        scene_args = copy.copy(args)
+        scene_args.scene = scene
+        if args.out is not None and os.path.exists(_marker(scene_args, task)):
+            continue
+        jobs.append((func, scene_args, task))
+
+    if args.workers > 1 and len(jobs) > 1:
+        with Pool(args.workers) as pool:
+            results = pool.map(_run_scene, jobs, chunksize=1)
+    else:
+        results = [_run_scene(job) for job in jobs]
+
+    failed = [job[1].scene for job, (ok, _, _) in zip(jobs, results) if not ok]
+    if failed:
+        print(f"{len(failed)} of {len(jobs)} scenes failed: {failed}")
+
+    profiles = [profile for _, profile, _ in results if profile is not None]
+    if profiles:
+        summary = profiling.aggregate(profiles, [peak for _, _, peak in results])
+        if args.out is not None:
+            os.makedirs(args.out, exist_ok=True)
+            for extension in ['json', 'csv']:
+                profiling.write_report(os.path.join(args.out, f"{task}_profile.{extension}"), summary)
+        else:
+            profiling.print_summary(summary)
+    return failed
@@ -0,0 +1,148 @@
+"""
+Binary container of named arrays
+
+The container is a small json header followed by 64-byte aligned raw arrays,
+so that it can be memory-mapped and read without parsing or copying.
+"""
+import os
+import json
+import mmap
+import tempfile
+import contextlib
+
+import numpy as np
+
+
+MAGIC = b'S3DCACHE'
+VERSION = 1
+ALIGNMENT = 64
+
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(specs, meta, reserve=0):
+    """header and offsets of arrays given as {name: (shape, dtype)}, the header
+    is padded by reserve bytes for metadata added later
+    """
+    # the offsets depend on the header length, so iterate until it is stable
+    header_len = 0
+    while True:
+        offset = _align(len(MAGIC) + 16 + header_len)
+        entries = dict()
+        for name, (shape, dtype) in specs.items():
+            entries[name] = {'dtype': np.dtype(dtype).str, 'shape': list(shape), 'offset': offset}
+            offset = _align(offset + int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize)
+        header = json.dumps({'meta': meta or dict(), 'arrays': entries}).encode('utf-8')
+        if len(header) + reserve == header_len:
+            return header, header_len, entries, offset
+        header_len = len(header) + reserve
+
+
+def _write_header(f, header, header_len):
+    f.write(MAGIC)
+    f.write(np.array([VERSION, 0], dtype='<u4').tobytes())
+    f.write(np.array([header_len], dtype='<u8').tobytes())
+    # json ignores the trailing spaces of the reserved space
+    f.write(header.ljust(header_len))
+
+
+@contextlib.contextmanager
+def _temporary(path):
+    """unique temporary file next to path, moved onto path at the end of the block
+    and removed if the block fails
+    """
+    # a unique temporary file, so that concurrent writers of the same path do not collide
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'r+b') as f:
+            yield f
+        # mkstemp creates the file readable by the owner only
+        os.chmod(tmp_path, 0o666 & ~_UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_container(path, arrays, meta=None):
+    """write named arrays and json metadata into one binary container
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    header, header_len, entries, size = _layout(
+        {name: (array.shape, array.dtype) for name, array in arrays.items()}, meta)
+
+    with _temporary(path) as f:
+        _write_header(f, header, header_len)
+        for name, array in arrays.items():
+            f.seek(entries[name]['offset'])
+            # the buffer is written as is, memory-mapped arrays are not copied into memory
+            f.write(array.data if array.size else b'')
+        f.truncate(size)
+
+
+@contextlib.contextmanager
+def create_container(path, specs, meta=None, reserve=1 << 16):
+    """create a container of zero-filled arrays given as {name: (shape, dtype)}, for
+    outputs too large for memory
+
+    Yields the arrays, writable memory maps of the file, and the metadata dict,
+    which can be updated in the block within reserve bytes. The container is
+    moved onto path at the end of the block, and removed if the block fails.
+    """
+    meta = dict(meta or dict())
+    header, header_len, entries, size = _layout(specs, meta, reserve)
+
+    with _temporary(path) as f:
+        f.truncate(size)
+        arrays = {name: np.memmap(f, dtype=entry['dtype'], mode='r+', offset=entry['offset'],
+                                  shape=tuple(entry['shape']))
+                  for name, entry in entries.items() if np.prod(entry['shape'], dtype=np.int64) > 0}
+        arrays.update({name: np.zeros(entry['shape'], dtype=entry['dtype'])
+                       for name, entry in entries.items() if name not in arrays})
+        yield arrays, meta
+
+        for array in arrays.values():
+            if isinstance(array, np.memmap):
+                array.flush()
+        arrays.clear()
+
+        header = json.dumps({'meta': meta, 'arrays': entries}).encode('utf-8')
+        if len(header) > header_len:
+            raise ValueError(f"metadata of {path} exceeds the reserved {reserve} bytes")
+        f.seek(0)
+        _write_header(f, header, header_len)
+
+
+def read_container(path):
+    """memory-map a binary container, arrays are read-only views of the file
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a Structured3D cache file")
+    version, _ = np.frombuffer(buffer, dtype='<u4', count=2, offset=len(MAGIC))
+    if version != VERSION:
+        raise ValueError(f"{path} has unsupported version {version}")
+    header_len = int(np.frombuffer(buffer, dtype='<u8', count=1, offset=len(MAGIC) + 8)[0])
+    start = len(MAGIC) + 16
+    header = json.loads(bytes(buffer[start:start + header_len]).decode('utf-8'))
+
+    arrays = dict()
+    for name, entry in header['arrays'].items():
+        dtype = np.dtype(entry['dtype'])
+        count = int(np.prod(entry['shape'], dtype=np.int64))
+        if count == 0:
+            arrays[name] = np.zeros(entry['shape'], dtype=dtype)
+        else:
+            arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                         offset=entry['offset']).reshape(entry['shape'])
+    return arrays, header['meta']
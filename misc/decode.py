@@ -0,0 +1,107 @@
+"""
+Threaded decoding of the image modalities of many views into reusable buffers
+
+cv2 releases the GIL while decoding, so the PNGs of a batch of views are
+decoded concurrently on a thread pool, straight into preallocated arrays.
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from misc.storage import read_bytes
+
+
+# file name, imread flag, raw dtype and number of channels of each modality
+MODALITIES = {
+    'rgb': ('rgb_rawlight.png', cv2.IMREAD_COLOR, np.uint8, 3),
+    'albedo': ('albedo.png', cv2.IMREAD_COLOR, np.uint8, 3),
+    'semantic': ('semantic.png', cv2.IMREAD_UNCHANGED, np.uint8, 1),
+    'instance': ('instance.png', cv2.IMREAD_UNCHANGED, np.uint16, 1),
+    'depth': ('depth.png', cv2.IMREAD_UNCHANGED, np.uint16, 1),
+    'normal': ('normal.png', cv2.IMREAD_COLOR, np.uint8, 3),
+}
+
+
+class ViewDecoder:
+    """decode the requested modalities of a batch of views
+
+    The returned arrays are views of buffers that are reused by the next call
+    of decode, copy them if they have to be kept. Depth is returned in metres
+    as float32 and normals are decoded from 128 * (1 + n) into [-1, 1].
+    """
+
+    def __init__(self, modalities=('rgb', 'depth', 'normal'), height=720, width=1280,
+                 batch_size=8, workers=8):
+        for modality in modalities:
+            if modality not in MODALITIES:
+                raise ValueError(f"unknown modality {modality}")
+
+        self.modalities = list(modalities)
+        self.height = height
+        self.width = width
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(workers)
+
+        self.raw = dict()
+        self.typed = dict()
+        for modality in self.modalities:
+            _, _, dtype, channels = MODALITIES[modality]
+            shape = (batch_size, height, width) + ((channels,) if channels > 1 else ())
+            self.raw[modality] = np.empty(shape, dtype=dtype)
+            if modality in ['depth', 'normal']:
+                self.typed[modality] = np.empty(shape, dtype=np.float32)
+
+        self._lock = threading.Lock()
+        self.timings = dict()
+
+    def _decode(self, index, view_path, modality):
+        start = time.perf_counter()
+        name, flags, _, channels = MODALITIES[modality]
+
+        buffer = np.frombuffer(read_bytes(os.path.join(view_path, name)), dtype=np.uint8)
+        image = cv2.imdecode(buffer, flags)
+        raw = self.raw[modality][index]
+        if image is None or image.shape != raw.shape:
+            raise ValueError(f"unexpected {name} in {view_path}")
+
+        if channels == 3:
+            cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=raw)
+        else:
+            np.copyto(raw, image)
+
+        if modality == 'depth':
+            np.divide(raw, np.float32(1000), out=self.typed[modality][index])
+        elif modality == 'normal':
+            typed = self.typed[modality][index]
+            np.multiply(raw, np.float32(1 / 128), out=typed)
+            np.subtract(typed, np.float32(1), out=typed)
+
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.timings[modality] += elapsed
+
+    def decode(self, view_paths):
+        """decode the views (directories holding the PNG files) of one batch
+        """
+        if len(view_paths) > self.batch_size:
+            raise ValueError(f"at most {self.batch_size} views per batch")
+
+        self.timings = {modality: 0.0 for modality in self.modalities}
+        futures = [self.executor.submit(self._decode, index, view_path, modality)
+                   for index, view_path in enumerate(view_paths) for modality in self.modalities]
+        for future in futures:
+            future.result()
+
+        num_views = len(view_paths)
+        outputs = dict()
+        for modality in self.modalities:
+            source = self.typed if modality in self.typed else self.raw
+            outputs[modality] = source[modality][:num_views]
+        return outputs
+
+    def close(self):
+        self.executor.shutdown()
@@ -0,0 +1,249 @@
+"""
+Detection labels of the perspective views: 2D boxes projected from bbox_3d.json
+
+The labels of each scene are written to <out>/scene_<id>/detection.json with
+a signature of their sources, so that only the scenes whose annotations or
+cameras changed are regenerated, then merged into one COCO-style file.
+"""
+import os
+import json
+import hashlib
+import traceback
+from multiprocessing import Pool
+
+import numpy as np
+
+from misc.instances import instance_stats
+from misc.manifest import list_rooms, list_positions
+from misc.scene_cache import load_bbox_arrays
+from misc.storage import imread, loadtxt, read_bytes, stat
+from misc.utils import get_corners_of_bb3d_batch, project_3d_points_to_2d_batch, parse_camera_info
+
+
+LABELIDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metadata', 'labelids.txt')
+DETECTION_NAME = 'detection.json'
+# bump when the labels change, so that older scene files are regenerated
+DETECTION_VERSION = 2
+
+# the 12 edges of the boxes, with the corner order of get_corners_of_bb3d_batch
+BOX_EDGES = np.array([[0, 1], [1, 2], [2, 3], [3, 0], [4, 5], [5, 6], [6, 7], [7, 4],
+                      [0, 4], [1, 5], [2, 6], [3, 7]])
+
+
+def load_categories(path=LABELIDS_PATH):
+    """COCO categories of the NYUv2 40-label set
+    """
+    categories = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                label_id, name = line.strip().split('\t')
+                categories.append({'id': int(label_id), 'name': name})
+    return categories
+
+
+def project_boxes_2d(corners, rot, trans, K, width, height, near=1.0):
+    """2D boxes (x0, y0, x1, y1) of 3D boxes given by their (N, 8, 3) world corners,
+    clipped to the near plane and to the image, and whether they are in view
+    """
+    camera = (corners - trans) @ rot.T
+    depth = camera[..., 2]
+
+    # the box edges crossing the near plane are cut there
+    start, end = corners[:, BOX_EDGES[:, 0]], corners[:, BOX_EDGES[:, 1]]
+    depth_start, depth_end = depth[:, BOX_EDGES[:, 0]], depth[:, BOX_EDGES[:, 1]]
+    crossing = (depth_start > near) != (depth_end > near)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (near - depth_start) / (depth_end - depth_start)
+    cuts = start + np.clip(np.nan_to_num(t), 0, 1)[..., None] * (end - start)
+
+    points = np.concatenate([corners, cuts], axis=1)
+    valid = np.concatenate([depth > near, crossing], axis=1)
+
+    points2d = project_3d_points_to_2d_batch(points - trans, rot, K)
+    lower = np.where(valid[..., None], points2d, np.inf).min(axis=1)
+    upper = np.where(valid[..., None], points2d, -np.inf).max(axis=1)
+    boxes = np.clip(np.concatenate([lower, upper], axis=1), 0, [width, height, width, height])
+    in_view = valid.any(axis=1) & (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+    boxes[~in_view] = 0
+    return boxes, in_view
+
+
+def list_scene_views(root, scene, config='full'):
+    """(room, position, directory) of the perspective views of a scene
+    """
+    views = []
+    for room_id in list_rooms(root, scene):
+        for position_id in list_positions(root, scene, room_id, config):
+            views.append((int(room_id), int(position_id), os.path.join(
+                root, f"scene_{scene:05d}", "2D_rendering", str(room_id), "perspective", config, str(position_id))))
+    return views
+
+
+def scene_signature(root, scene, config='full'):
+    """sha1 of the boxes, the list of views, their cameras and the size and
+    modification time of their instance and semantic images
+    """
+    scene_path = os.path.join(root, f"scene_{scene:05d}")
+    digest = hashlib.sha1(f"{DETECTION_VERSION}".encode())
+    digest.update(read_bytes(os.path.join(scene_path, 'bbox_3d.json')))
+    for room, position, path in list_scene_views(root, scene, config):
+        digest.update(f"{room}/{position}".encode())
+        digest.update(read_bytes(os.path.join(path, 'camera_pose.txt')))
+        # the images are not hashed, rewriting one changes its time
+        for name in ['instance.png', 'semantic.png']:
+            digest.update(f"{name}:{stat(os.path.join(path, name))}".encode())
+    return digest.hexdigest()
+
+
+def scene_detections(root, scene, config='full'):
+    """images and annotations (with per-scene ids) of the perspective views of a scene
+    """
+    import cv2
+
+    scene_path = os.path.join(root, f"scene_{scene:05d}")
+    ids, basis, coeffs, centroid = load_bbox_arrays(scene_path)
+    corners_scene = get_corners_of_bb3d_batch(basis, coeffs, centroid)
+
+    id2index = np.full(ids.max() + 2 if len(ids) else 1, -1, dtype=np.int64)
+    id2index[ids] = np.arange(len(ids))
+
+    images, annotations = [], []
+    for room, position, path in list_scene_views(root, scene, config):
+        instance = imread(os.path.join(path, 'instance.png'), cv2.IMREAD_UNCHANGED)
+        semantic = imread(os.path.join(path, 'semantic.png'), cv2.IMREAD_UNCHANGED)
+        height, width = instance.shape
+
+        camera_info = loadtxt(os.path.join(path, 'camera_pose.txt'))
+        rot, trans, K = parse_camera_info(camera_info, height, width)
+
+        image_id = len(images)
+        images.append({
+            'id': image_id,
+            'file_name': os.path.relpath(os.path.join(path, 'rgb_rawlight.png'), root).replace(os.sep, '/'),
+            'width': width, 'height': height,
+            'scene': scene, 'room': room, 'position': position,
+            'K': K.tolist(), 'R': rot.tolist(), 't': trans.tolist(),
+        })
+
+        # visible instances with a 3D box
+        stats = instance_stats(instance, semantic)
+        index = id2index[np.minimum(stats['instance'], len(id2index) - 1)]
+        visible = np.flatnonzero(index >= 0)
+        index = index[visible]
+
+        boxes, in_view = project_boxes_2d(corners_scene[index], rot, trans, K, width, height)
+        for i, box, keep in zip(visible, boxes, in_view):
+            if not keep:
+                continue
+            j = id2index[stats['instance'][i]]
+            x0, y0, x1, y1 = box.tolist()
+            annotations.append({
+                'id': len(annotations),
+                'image_id': image_id,
+                'category_id': int(stats['semantic'][i]),
+                'instance_id': int(stats['instance'][i]),
+                'bbox': [x0, y0, x1 - x0, y1 - y0],
+                'area': int(stats['pixels'][i]),
+                'visible_bbox': [int(stats['x0'][i]), int(stats['y0'][i]),
+                                 int(stats['x1'][i] - stats['x0'][i] + 1), int(stats['y1'][i] - stats['y0'][i] + 1)],
+                'bbox_3d': {'basis': basis[j].tolist(), 'coeffs': coeffs[j].tolist(),
+                            'centroid': centroid[j].tolist()},
+                'iscrowd': 0,
+            })
+
+    return images, annotations
+
+
+def export_scene(root, scene, out, config='full'):
+    """write the labels of a scene unless they are up to date, returns whether they were regenerated
+    """
+    path = os.path.join(out, f"scene_{scene:05d}", DETECTION_NAME)
+    signature = scene_signature(root, scene, config)
+    if os.path.exists(path):
+        with open(path) as f:
+            if json.load(f).get('signature') == signature:
+                return False
+
+    images, annotations = scene_detections(root, scene, config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'signature': signature, 'images': images, 'annotations': annotations}, f)
+    os.replace(path + '.tmp', path)
+    return True
+
+
+def _export_scene(task):
+    try:
+        return task[1], export_scene(*task), None
+    except Exception:
+        return task[1], False, traceback.format_exc()
+
+
+def export_scenes(root, scenes, out, config='full', workers=8):
+    """export the labels of the scenes on a process pool, returns the ids of the
+    regenerated scenes and of the failed scenes, whose errors are printed
+    """
+    tasks = [(root, scene, out, config) for scene in scenes]
+    regenerated, failed = [], []
+    with Pool(workers) as pool:
+        for scene, done, error in pool.imap_unordered(_export_scene, tasks):
+            if error is not None:
+                print(f"scene_{scene:05d}: detection export failed")
+                print(error, end='')
+                failed.append(scene)
+            elif done:
+                regenerated.append(scene)
+    return sorted(regenerated), sorted(failed)
+
+
+def merge_detections(out, scenes, output):
+    """merge the scene labels into one COCO-style json, or a columnar container if output ends with .bin
+    """
+    images, annotations = [], []
+    for scene in scenes:
+        with open(os.path.join(out, f"scene_{scene:05d}", DETECTION_NAME)) as f:
+            labels = json.load(f)
+        # renumber the per-scene ids
+        image_offset, annotation_offset = len(images), len(annotations)
+        for image in labels['images']:
+            image['id'] += image_offset
+            images.append(image)
+        for annotation in labels['annotations']:
+            annotation['id'] += annotation_offset
+            annotation['image_id'] += image_offset
+            annotations.append(annotation)
+
+    if output.endswith('.bin'):
+        write_columnar(output, images, annotations)
+        return
+
+    with open(output, 'w') as f:
+        json.dump({'images': images, 'annotations': annotations, 'categories': load_categories()}, f)
+
+
+def write_columnar(output, images, annotations):
+    """write the labels as columns of the binary container
+    """
+    from misc.container import write_container
+
+    arrays = {
+        'image_scene': np.array([image['scene'] for image in images], dtype=np.int32),
+        'image_room': np.array([image['room'] for image in images], dtype=np.int32),
+        'image_position': np.array([image['position'] for image in images], dtype=np.int32),
+        'image_size': np.array([[image['width'], image['height']] for image in images], dtype=np.int32).reshape(-1, 2),
+        'image_K': np.array([image['K'] for image in images], dtype=np.float32).reshape(-1, 3, 3),
+        'image_R': np.array([image['R'] for image in images], dtype=np.float32).reshape(-1, 3, 3),
+        'image_t': np.array([image['t'] for image in images], dtype=np.float32).reshape(-1, 3),
+        'image_id': np.array([annotation['image_id'] for annotation in annotations], dtype=np.int64),
+        'category_id': np.array([annotation['category_id'] for annotation in annotations], dtype=np.uint8),
+        'instance_id': np.array([annotation['instance_id'] for annotation in annotations], dtype=np.uint16),
+        'bbox': np.array([annotation['bbox'] for annotation in annotations], dtype=np.float32).reshape(-1, 4),
+        'visible_bbox': np.array([annotation['visible_bbox'] for annotation in annotations], dtype=np.int32).reshape(-1, 4),
+        'area': np.array([annotation['area'] for annotation in annotations], dtype=np.int64),
+        'basis': np.array([annotation['bbox_3d']['basis'] for annotation in annotations], dtype=np.float32).reshape(-1, 3, 3),
+        'coeffs': np.array([annotation['bbox_3d']['coeffs'] for annotation in annotations], dtype=np.float32).reshape(-1, 3),
+        'centroid': np.array([annotation['bbox_3d']['centroid'] for annotation in annotations], dtype=np.float32).reshape(-1, 3),
+    }
+    meta = {'file_names': [image['file_name'] for image in images], 'categories': load_categories()}
+    write_container(output, arrays, meta)
@@ -0,0 +1,213 @@
+"""
+Floorplan polygons of a scene and their rasterization into fixed-size maps
+
+The maps are drawn with the cv2 scanline rasterizer (fillPoly/polylines with
+sub-pixel precision), with one image per channel:
+
+    room      uint8, 1 + index of the room type in metadata/room_types.txt, 0 outside
+    wall      uint8, 1 on the floor lines of the walls, without the doors and windows
+    door      uint8, 1 on the lines of the doors projected onto the floor
+    window    uint8, 1 on the lines of the windows projected onto the floor
+    objects   uint8, number of object footprints (bbox_3d.json) covering the pixel
+"""
+import os
+
+import numpy as np
+
+from misc.topology import get_topology
+from misc.polygon import convert_lines_to_vertices
+from misc.utils import get_corners_of_bb3d_batch
+
+
+ROOM_TYPES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metadata', 'room_types.txt')
+CHANNELS = ('room', 'wall', 'door', 'window', 'objects')
+# fractional bits of the fixed-point vertices given to cv2
+SHIFT = 4
+
+
+def load_room_types(path=ROOM_TYPES_PATH):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+ROOM_TYPES = load_room_types()
+
+
+def floorplan_polygons(annos):
+    """floor polygons of the rooms as [(junction ids, room type, room ID)] and the
+    floor polygon of the outer wall as junction ids, the room ID is the ID of the
+    semantic, i.e. the room of 2D_rendering/<room ID>
+    """
+    topology = get_topology(annos)
+
+    # lines of the doors and windows are not part of the outlines
+    lines_holes = topology.hole_lines()
+
+    junctions = np.array([junc['coordinate'] for junc in annos['junctions']])
+    on_floor = np.isclose(junctions[:, -1], 0)
+
+    rooms, outerwall_planes = [], []
+    for semantic in annos['semantics']:
+        if semantic['type'] == 'outwall':
+            outerwall_planes = semantic['planeID']
+            continue
+        for planeID in semantic['planeID']:
+            if annos['planes'][planeID]['type'] == 'floor':
+                polygon = convert_lines_to_vertices(topology.plane_junction_pairs(planeID))
+                rooms.append((polygon[0], semantic['type'], semantic['ID']))
+
+    outerwall_floor = []
+    for planeID in outerwall_planes:
+        for start, end in topology.plane_junction_pairs(planeID, exclude_lines=lines_holes):
+            if on_floor[start] and on_floor[end]:
+                outerwall_floor.append([start, end])
+
+    outerwall = convert_lines_to_vertices(outerwall_floor)[0] if outerwall_floor else []
+    return rooms, outerwall
+
+
+def plane_segments(annos, types):
+    """(N, 2, 2) xy segments of the lines of the planes of the given semantic
+    (e.g. door, window) or plane (e.g. wall) types
+    """
+    topology = get_topology(annos)
+    planeIDs = set(topology.planes_of_types(types).tolist())
+    planeIDs.update(plane['ID'] for plane in annos['planes'] if plane['type'] in types)
+
+    junctions = np.array([junc['coordinate'][:2] for junc in annos['junctions']])
+    if not planeIDs:
+        return np.zeros((0, 2, 2))
+    pairs = topology.junction_pairs(topology.lines_of_planes(sorted(planeIDs)))
+    return junctions[pairs]
+
+
+def wall_segments(annos):
+    """(N, 2, 2) xy segments of the floor lines of the walls, the planes and
+    lines of the doors and windows are left out
+    """
+    topology = get_topology(annos)
+    planeIDs = np.setdiff1d([plane['ID'] for plane in annos['planes'] if plane['type'] == 'wall'],
+                            topology.planes_of_types(['door', 'window']))
+
+    junctions = np.array([junc['coordinate'] for junc in annos['junctions']])
+    if len(planeIDs) == 0:
+        return np.zeros((0, 2, 2))
+    lineIDs = np.setdiff1d(topology.lines_of_planes(planeIDs), topology.hole_lines())
+    pairs = topology.junction_pairs(lineIDs)
+
+    # only the lines with both junctions on the floor, as the outer wall of floorplan_polygons
+    on_floor = np.isclose(junctions[:, -1], 0)
+    pairs = pairs[on_floor[pairs].all(axis=1)]
+    return junctions[pairs][..., :2]
+
+
+def floorplan_transform(annos, size=256, margin=0.05):
+    """scale and offset of the similarity that fits the scene into size x size
+    pixels, pixel = xy * scale + offset
+    """
+    junctions = np.array([junc['coordinate'][:2] for junc in annos['junctions']])
+    lower, upper = junctions.min(axis=0), junctions.max(axis=0)
+    scale = size * (1 - 2 * margin) / max(np.max(upper - lower), 1e-6)
+    offset = size / 2 - (lower + upper) / 2 * scale
+    return scale, offset
+
+
+def _fixed(points, scale, offset):
+    return np.round((np.asarray(points)[..., :2] * scale + offset) * (1 << SHIFT)).astype(np.int32)
+
+
+def rasterize_floorplan(annos, boxes=None, size=256, scale=None, offset=None, line_width=2):
+    """rasterize the floorplan (and the object footprints of bbox_3d.json) into
+    size x size maps, see the module docstring for the channels
+    """
+    import cv2
+
+    if scale is None:
+        scale, offset = floorplan_transform(annos, size)
+    maps = {name: np.zeros((size, size), dtype=np.uint8) for name in CHANNELS}
+    junctions = np.array([junc['coordinate'][:2] for junc in annos['junctions']])
+
+    rooms, _ = floorplan_polygons(annos)
+    for polygon, room_type, _ in rooms:
+        label = ROOM_TYPES.index(room_type) + 1 if room_type in ROOM_TYPES else len(ROOM_TYPES)
+        cv2.fillPoly(maps['room'], [_fixed(junctions[polygon], scale, offset)], label,
+                     lineType=cv2.LINE_8, shift=SHIFT)
+
+    for name, segments in [('wall', wall_segments(annos)), ('door', plane_segments(annos, ['door'])),
+                           ('window', plane_segments(annos, ['window']))]:
+        segments = _fixed(segments, scale, offset)
+        if len(segments):
+            cv2.polylines(maps[name], list(segments), False, 1, thickness=line_width, shift=SHIFT)
+    # the floor lines of the walls run under the doors, the openings are cut out of the walls
+    maps['wall'][(maps['door'] > 0) | (maps['window'] > 0)] = 0
+
+    if boxes:
+        corners = get_corners_of_bb3d_batch(np.array([bbox['basis'] for bbox in boxes]),
+                                            np.array([bbox['coeffs'] for bbox in boxes]),
+                                            np.array([bbox['centroid'] for bbox in boxes]))
+        footprints = _fixed(corners[:, :4], scale, offset)
+
+        # every footprint is filled in its own window, so that the overlaps are counted
+        lower = np.clip(footprints.min(axis=1) >> SHIFT, 0, size)
+        upper = np.clip((footprints.max(axis=1) >> SHIFT) + 2, 0, size)
+        for footprint, (x0, y0), (x1, y1) in zip(footprints, lower, upper):
+            if x1 <= x0 or y1 <= y0:
+                continue
+            window = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+            cv2.fillPoly(window, [footprint - (np.array([x0, y0]) << SHIFT)], 1, shift=SHIFT)
+            maps['objects'][y0:y1, x0:x1] += window
+
+    return maps, scale, offset
+
+
+def scene_maps(task):
+    """maps of one scene of the dataset, as rasterized by rasterize_floorplan
+    """
+    from misc.scene_cache import load_annotation_3d, load_bbox_3d
+
+    root, scene, size = task
+    scene_path = os.path.join(root, f"scene_{scene:05d}")
+    return rasterize_floorplan(load_annotation_3d(scene_path), load_bbox_3d(scene_path), size)
+
+
+def _scene_maps(task):
+    try:
+        return scene_maps(task), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def build_floorplan_maps(root, scenes, output, size=256, workers=8):
+    """rasterize the scenes on a process pool and write the maps as (num_scenes, size, size)
+    arrays of one binary container, with the scale and offset of every scene
+
+    The maps are written into the memory-mapped container as they arrive. A
+    scene that cannot be rasterized is reported and its maps are left empty,
+    the failed scenes are listed in the metadata. Returns the (scene, error)
+    of the failed scenes.
+    """
+    from multiprocessing import Pool
+
+    from misc.container import create_container
+
+    specs = {name: ((len(scenes), size, size), np.uint8) for name in CHANNELS}
+    specs['scene'] = ((len(scenes),), np.int32)
+    specs['scale'] = ((len(scenes),), np.float64)
+    specs['offset'] = ((len(scenes), 2), np.float64)
+
+    failed = []
+    tasks = [(root, scene, size) for scene in scenes]
+    with create_container(output, specs, {'size': size, 'room_types': ROOM_TYPES}) as (arrays, meta):
+        arrays['scene'][:] = scenes
+        with Pool(workers) as pool:
+            for i, (result, error) in enumerate(pool.imap(_scene_maps, tasks, chunksize=8)):
+                if error is not None:
+                    print(f"scene_{scenes[i]:05d}: {error}")
+                    failed.append([scenes[i], error])
+                    continue
+                maps, scale, offset = result
+                for name in CHANNELS:
+                    arrays[name][i] = maps[name]
+                arrays['scale'][i], arrays['offset'][i] = scale, offset
+        meta['failed_scenes'] = failed
+    return failed
@@ -0,0 +1,140 @@
+"""
+Per-instance statistics of the rendered views from instance.png and semantic.png
+
+All statistics of a view are computed in a single pass over its pixels with
+bincount-style reductions, instead of one mask comparison per instance.
+"""
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from misc.container import write_container, read_container
+from misc.manifest import list_rooms, list_positions
+from misc.storage import imread
+
+
+BACKGROUND = 65535
+NUM_SEMANTICS = 256
+
+COLUMNS = (('scene', np.int32), ('room', np.int32), ('position', np.int32), ('instance', np.uint16),
+           ('pixels', np.int32), ('x0', np.int16), ('y0', np.int16), ('x1', np.int16), ('y1', np.int16),
+           ('semantic', np.uint8), ('semantic_fraction', np.float32))
+
+
+def instance_ids(instance):
+    """ids of the instances visible in an instance map, without the background
+    """
+    counts = np.bincount(instance.ravel(), minlength=BACKGROUND + 1)
+    return np.flatnonzero(counts[:BACKGROUND])
+
+
+def instance_stats(instance, semantic=None):
+    """pixel count, tight 2D box (x0, y0, x1, y1 inclusive) and majority semantic
+    label with its pixel fraction of every instance of a view
+    """
+    if semantic is not None and semantic.shape != instance.shape:
+        raise ValueError(f"semantic map of shape {semantic.shape} does not match the instance map "
+                         f"of shape {instance.shape}")
+    height, width = instance.shape
+    flat = instance.ravel()
+
+    counts = np.bincount(flat, minlength=BACKGROUND + 1)[:BACKGROUND]
+    ids = np.flatnonzero(counts)
+
+    # dense labels of the instances, the background is dropped
+    lookup = np.full(BACKGROUND + 1, -1, dtype=np.int64)
+    lookup[ids] = np.arange(len(ids))
+    labels = lookup[flat]
+    foreground = np.flatnonzero(labels >= 0)
+    labels = labels[foreground]
+    rows, cols = np.divmod(foreground, width)
+
+    x0 = np.full(len(ids), width, dtype=np.int64)
+    y0 = np.full(len(ids), height, dtype=np.int64)
+    x1 = np.full(len(ids), -1, dtype=np.int64)
+    y1 = np.full(len(ids), -1, dtype=np.int64)
+    np.minimum.at(x0, labels, cols)
+    np.minimum.at(y0, labels, rows)
+    np.maximum.at(x1, labels, cols)
+    np.maximum.at(y1, labels, rows)
+
+    stats = {'instance': ids, 'pixels': counts[ids], 'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1}
+
+    if semantic is not None:
+        # joint histogram of (instance, semantic label)
+        joint = np.bincount(labels * NUM_SEMANTICS + semantic.ravel()[foreground],
+                            minlength=len(ids) * NUM_SEMANTICS).reshape(len(ids), NUM_SEMANTICS)
+        stats['semantic'] = joint.argmax(axis=1)
+        stats['semantic_fraction'] = joint.max(axis=1) / np.maximum(stats['pixels'], 1)
+
+    return stats
+
+
+def list_instance_views(root, scenes, config='full'):
+    """(scene, room, position, directory) of every perspective view of the scenes
+    """
+    views = []
+    for scene in scenes:
+        for room_id in list_rooms(root, scene):
+            for position_id in list_positions(root, scene, room_id, config):
+                path = os.path.join(root, f"scene_{scene:05d}", "2D_rendering", str(room_id),
+                                    "perspective", config, str(position_id))
+                views.append((scene, int(room_id), int(position_id), path))
+    return views
+
+
+def view_stats(view):
+    """statistics of one view, as columns of the table
+    """
+    import cv2
+
+    scene, room, position, path = view
+    instance = imread(os.path.join(path, 'instance.png'), cv2.IMREAD_UNCHANGED)
+    semantic = imread(os.path.join(path, 'semantic.png'), cv2.IMREAD_UNCHANGED)
+    stats = instance_stats(instance, semantic)
+
+    num_instances = len(stats['instance'])
+    stats.update({'scene': np.full(num_instances, scene), 'room': np.full(num_instances, room),
+                  'position': np.full(num_instances, position)})
+    return {name: stats[name].astype(dtype) for name, dtype in COLUMNS}
+
+
+def _view_stats(view):
+    try:
+        return view_stats(view), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def build_instance_table(views, output, workers=8):
+    """compute the statistics of all views on a process pool and write them as one columnar table
+
+    A view that cannot be read is reported and left out of the table, the
+    failed views are listed in the metadata. Returns the columns and the
+    (scene, room, position, error) of the failed views.
+    """
+    columns = {name: [] for name, _ in COLUMNS}
+    failed = []
+    with Pool(workers) as pool:
+        for view, (stats, error) in zip(views, pool.imap(_view_stats, views, chunksize=16)):
+            if error is not None:
+                scene, room, position, _ = view
+                print(f"scene_{scene:05d}/{room}/{position}: {error}")
+                failed.append([scene, room, position, error])
+                continue
+            for name, values in stats.items():
+                columns[name].append(values)
+
+    arrays = {name: np.concatenate(values) if values else np.zeros(0, dtype=dtype)
+              for (name, dtype), values in zip(COLUMNS, columns.values())}
+    write_container(output, arrays, {'num_views': len(views) - len(failed), 'failed_views': failed,
+                                     'background': BACKGROUND})
+    return arrays, failed
+
+
+def load_instance_table(path):
+    """memory-mapped columns of a table written by build_instance_table
+    """
+    arrays, _ = read_container(path)
+    return arrays
@@ -0,0 +1,173 @@
+"""
+HorizonNet-style 1D targets of the panorama layouts (layout.txt)
+
+For every column of a panorama, the ceiling-wall and floor-wall boundaries
+are given as latitudes in radians, and the corner target is 0.96 ** the
+column distance to the nearest corner (with wrap-around). The targets of all
+panoramas are written as flat arrays of columns with per-panorama offsets in
+one binary container, which is memory-mapped by the data loaders.
+"""
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from misc.container import write_container, read_container
+from misc.manifest import list_rooms
+from misc.panorama import layout_boundaries
+from misc.storage import exists, loadtxt
+
+
+def sort_cor_id(cor_id):
+    """(ceiling, floor) pairs of the corners, ceiling above floor, starting at the leftmost corner
+    """
+    cor_id = np.asarray(cor_id, dtype=np.float64)[:, :2].reshape(-1, 2, 2)
+    # the ceiling corner is the one with the smaller y
+    swap = cor_id[:, 0, 1] > cor_id[:, 1, 1]
+    cor_id[swap] = cor_id[swap, ::-1]
+    cor_id = np.roll(cor_id, -int(np.argmin(cor_id[:, 0, 0])), axis=0)
+    return cor_id.reshape(-1, 2)
+
+
+def _unique_columns(xs, ys, y_small_first):
+    # the column shared by two walls keeps its upper (ceiling) or lower (floor) point
+    order = np.argsort(xs + ys / ys.max() * (1 if y_small_first else -1))
+    xs, ys = xs[order], ys[order]
+    _, unique = np.unique(xs, return_index=True)
+    return xs[unique], ys[unique]
+
+
+def cor_ids_to_1d(cor_ids, height=512, width=1024):
+    """(N, 2, width) ceiling and floor boundary latitudes (radians) and (N, width)
+    corner targets of the corners of many layout.txt, the boundary points of
+    all walls are computed in one call
+    """
+    cor_ids = [sort_cor_id(cor_id) for cor_id in cor_ids]
+    ceiling, ceiling_offsets, floor, floor_offsets, wall_offsets = layout_boundaries(cor_ids, width, height)
+    columns = np.arange(width)
+
+    boundary = np.zeros((len(cor_ids), 2, width), dtype=np.float64)
+    corner = np.zeros((len(cor_ids), width), dtype=np.float64)
+    for k, cor_id in enumerate(cor_ids):
+        walls = slice(wall_offsets[k], wall_offsets[k + 1] + 1)
+        for row, (points, offsets, y_small_first) in enumerate([(ceiling, ceiling_offsets, True),
+                                                                 (floor, floor_offsets, False)]):
+            start, end = offsets[walls][[0, -1]]
+            xs, ys = _unique_columns(points[start:end, 0], points[start:end, 1], y_small_first)
+            boundary[k, row] = np.interp(columns, xs, ys, period=width)
+
+        distance = np.abs(cor_id[::2, 0][:, None] - columns[None, :])
+        distance = np.minimum(distance, width - distance)
+        corner[k] = (0.96 ** distance).max(axis=0)
+
+    boundary = ((boundary + 0.5) / height - 0.5) * np.pi
+    return boundary.astype(np.float32), corner.astype(np.float32)
+
+
+def cor_id_to_1d(cor_id, height=512, width=1024):
+    """(2, width) ceiling and floor boundary latitudes (radians) and (width,) corner
+    target of the corners of a layout.txt
+    """
+    boundary, corner = cor_ids_to_1d([cor_id], height, width)
+    return boundary[0], corner[0]
+
+
+def list_panoramas(root, scenes):
+    """(scene, room, path of layout.txt) of every panorama with a layout
+    """
+    panoramas = []
+    for scene in scenes:
+        for room_id in list_rooms(root, scene):
+            path = os.path.join(root, f"scene_{scene:05d}", "2D_rendering", str(room_id), "panorama", "layout.txt")
+            if exists(path):
+                panoramas.append((scene, int(room_id), path))
+    return panoramas
+
+
+def _panorama_targets(task):
+    paths, height, width = task
+    try:
+        return cor_ids_to_1d([loadtxt(path) for path in paths], height, width), []
+    except Exception:
+        pass
+
+    # a malformed layout fails the whole batch, convert the panoramas one by one to find it
+    boundary, corner, errors = [], [], []
+    for i, path in enumerate(paths):
+        try:
+            bon, cor = cor_ids_to_1d([loadtxt(path)], height, width)
+        except Exception as e:
+            errors.append((i, f"{type(e).__name__}: {e}"))
+            continue
+        boundary.append(bon)
+        corner.append(cor)
+    if not boundary:
+        return (np.zeros((0, 2, width), dtype=np.float32), np.zeros((0, width), dtype=np.float32)), errors
+    return (np.concatenate(boundary), np.concatenate(corner)), errors
+
+
+def build_layout_targets(panoramas, output, height=512, width=1024, workers=8, chunk_size=256):
+    """compute the targets of the panoramas on a process pool and write them into one container:
+
+        boundary  (num_columns, 2) float32, ceiling and floor latitudes of every column
+        corner    (num_columns,) float32, corner target of every column
+        offsets   (num_panoramas + 1,) int64, columns of panorama i are offsets[i]:offsets[i + 1]
+        scene, room  (num_panoramas,) int32
+
+    A panorama whose layout cannot be read is reported and left out, the failed
+    panoramas are listed in the metadata. Returns the arrays and the (scene,
+    room, error) of the failed panoramas.
+    """
+    boundary = np.zeros((len(panoramas) * width, 2), dtype=np.float32)
+    corner = np.zeros(len(panoramas) * width, dtype=np.float32)
+
+    # the panoramas of a task are converted in one batch
+    starts = range(0, len(panoramas), chunk_size)
+    tasks = [([path for _, _, path in panoramas[start:start + chunk_size]], height, width) for start in starts]
+    done, failed = [], []
+    with Pool(workers) as pool:
+        for start, ((bon, cor), errors) in zip(starts, pool.imap(_panorama_targets, tasks)):
+            errors = dict(errors)
+            for i in range(start, min(start + chunk_size, len(panoramas))):
+                scene, room, _ = panoramas[i]
+                if i - start in errors:
+                    print(f"scene_{scene:05d}/{room}: {errors[i - start]}")
+                    failed.append([scene, room, errors[i - start]])
+                else:
+                    done.append(panoramas[i])
+            # the targets are packed, the columns of the failed panoramas are left out
+            first = (len(done) - len(bon)) * width
+            boundary[first:first + len(bon) * width] = bon.transpose(0, 2, 1).reshape(-1, 2)
+            corner[first:first + len(bon) * width] = cor.reshape(-1)
+
+    arrays = {
+        'boundary': boundary[:len(done) * width],
+        'corner': corner[:len(done) * width],
+        'offsets': np.arange(len(done) + 1, dtype=np.int64) * width,
+        'scene': np.array([scene for scene, _, _ in done], dtype=np.int32),
+        'room': np.array([room for _, room, _ in done], dtype=np.int32),
+    }
+    write_container(output, arrays, {'height': height, 'width': width, 'failed_panoramas': failed})
+    return arrays, failed
+
+
+class LayoutTargets:
+    """memory-mapped targets written by build_layout_targets, indexed by panorama
+    """
+
+    def __init__(self, path):
+        arrays, self.meta = read_container(path)
+        self.boundary = arrays['boundary']
+        self.corner = arrays['corner']
+        self.offsets = arrays['offsets']
+        self.scene = arrays['scene']
+        self.room = arrays['room']
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        """(2, width) boundary and (width,) corner target of a panorama, as views of the file
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.boundary[start:end].T, self.corner[start:end]
@@ -0,0 +1,240 @@
+"""
+SQLite manifest of the dataset tree, so that the tools never list directories
+"""
+import os
+import sqlite3
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from misc.storage import find_store, exists, listdir
+
+
+MANIFEST_NAME = 'manifest.sqlite'
+ERRATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'metadata', 'errata.txt')
+
+SCHEMA = """
+CREATE TABLE files (
+    scene INTEGER NOT NULL,
+    room TEXT NOT NULL,
+    camera TEXT NOT NULL,
+    config TEXT NOT NULL,
+    position TEXT NOT NULL,
+    name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    errata INTEGER NOT NULL
+);
+CREATE TABLE errata (
+    scene INTEGER NOT NULL,
+    room TEXT NOT NULL,
+    reason TEXT NOT NULL
+);
+CREATE INDEX files_view ON files (scene, room, camera, config, position);
+CREATE INDEX files_path ON files (path);
+"""
+
+
+def parse_errata(path=ERRATA_PATH):
+    """parse metadata/errata.txt into (scene, room, reason), room is '' for a whole scene
+    """
+    entries = []
+    reason = ''
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('#'):
+                reason = line.lstrip('# ')
+                continue
+            parts = line.split('_')
+            room = parts[3] if len(parts) > 3 else ''
+            entries.append((int(parts[1]), room, reason))
+    return entries
+
+
+def parse_relpath(relpath):
+    """split a path relative to the dataset root into (scene, room, camera, config, position, name)
+    """
+    parts = relpath.replace(os.sep, '/').split('/')
+    scene = int(parts[0].split('_')[1])
+    room, camera, config, position = '', '', '', ''
+    if len(parts) > 2 and parts[1] == '2D_rendering':
+        room = parts[2]
+        if len(parts) > 4:
+            camera = parts[3]
+            if camera == 'panorama' and len(parts) > 5:
+                config = parts[4]
+            elif camera == 'perspective' and len(parts) > 6:
+                config, position = parts[4], parts[5]
+    return scene, room, camera, config, position, parts[-1]
+
+
+def scan_scene(root, scene_name):
+    """list every file of one scene with its size
+    """
+    files = []
+    stack = [scene_name]
+    while stack:
+        relative = stack.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                path = relative + '/' + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                elif entry.is_file():
+                    files.append((path, entry.stat().st_size))
+    return files
+
+
+def write_manifest(output, records, errata):
+    """write (relpath, size) records and errata entries into a new manifest
+    """
+    invalid_scenes = {scene for scene, room, _ in errata if room == ''}
+    invalid_rooms = {(scene, room) for scene, room, _ in errata if room != ''}
+
+    tmp_path = output + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    connection = sqlite3.connect(tmp_path)
+    connection.executescript(SCHEMA)
+    connection.executemany("INSERT INTO errata VALUES (?, ?, ?)", errata)
+
+    rows = []
+    for relpath, size in records:
+        scene, room, camera, config, position, name = parse_relpath(relpath)
+        flag = int(scene in invalid_scenes or (scene, room) in invalid_rooms)
+        rows.append((scene, room, camera, config, position, name, relpath, size, flag))
+        if len(rows) >= 100000:
+            connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            rows = []
+    connection.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    connection.commit()
+    connection.close()
+    os.replace(tmp_path, output)
+
+
+def build_manifest(root, output=None, workers=16, errata_path=ERRATA_PATH):
+    """walk the dataset tree once, in parallel over scenes, and write the manifest
+    """
+    output = output or os.path.join(root, MANIFEST_NAME)
+
+    # the archives are indexed from their central directories instead
+    store = find_store(root)
+    if store is not None:
+        write_manifest(output, sorted(store.records()), parse_errata(errata_path))
+        return output
+
+    scenes = sorted(name for name in os.listdir(root) if name.startswith('scene_'))
+
+    def records():
+        with ThreadPoolExecutor(workers) as executor:
+            for files in executor.map(functools.partial(scan_scene, root), scenes):
+                yield from files
+
+    write_manifest(output, records(), parse_errata(errata_path))
+    return output
+
+
+class Manifest:
+    """query interface of the manifest
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def _column(self, query, params=()):
+        return [row[0] for row in self.connection.execute(query, params)]
+
+    def scenes(self, include_errata=True):
+        query = "SELECT DISTINCT scene FROM files"
+        if not include_errata:
+            query += " WHERE errata = 0"
+        return self._column(query + " ORDER BY scene")
+
+    def rooms(self, scene, camera=None, config=None):
+        """room ids of a scene (in the same order as np.sort(os.listdir(...))),
+        optionally only those with the given camera type and configuration
+        """
+        query = "SELECT DISTINCT room FROM files WHERE scene = ? AND room != ''"
+        params = [scene]
+        if camera is not None:
+            query += " AND camera = ?"
+            params.append(camera)
+        if config is not None:
+            query += " AND config = ?"
+            params.append(config)
+        return self._column(query + " ORDER BY room", params)
+
+    def positions(self, scene, room, config='full'):
+        """perspective position ids of a room
+        """
+        return self._column(
+            "SELECT DISTINCT position FROM files WHERE scene = ? AND room = ? AND camera = 'perspective' "
+            "AND config = ? ORDER BY position", (scene, str(room), config))
+
+    def files(self, scene, room=None, camera=None, config=None, position=None):
+        """(path, size) of the files matching the given keys
+        """
+        query = "SELECT path, size FROM files WHERE scene = ?"
+        params = [scene]
+        for column, value in [('room', room), ('camera', camera), ('config', config), ('position', position)]:
+            if value is not None:
+                query += f" AND {column} = ?"
+                params.append(str(value))
+        return self.connection.execute(query + " ORDER BY path", params).fetchall()
+
+    def exists(self, relpath):
+        return self.connection.execute("SELECT 1 FROM files WHERE path = ? LIMIT 1", (relpath,)).fetchone() is not None
+
+    def size(self, relpath):
+        row = self.connection.execute("SELECT size FROM files WHERE path = ?", (relpath,)).fetchone()
+        return None if row is None else row[0]
+
+    def errata(self, scene=None):
+        """(scene, room, reason) entries of metadata/errata.txt
+        """
+        if scene is None:
+            return self.connection.execute("SELECT scene, room, reason FROM errata").fetchall()
+        return self.connection.execute("SELECT scene, room, reason FROM errata WHERE scene = ?", (scene,)).fetchall()
+
+
+@functools.lru_cache(maxsize=None)
+def _open_manifest(root, pid):
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    return Manifest(path)
+
+
+def open_manifest(root):
+    """manifest of the dataset root, None if it has not been built
+    """
+    # a sqlite connection must not be used across fork, so the forked workers open their own
+    return _open_manifest(root, os.getpid())
+
+
+def list_rooms(root, scene):
+    """room ids of a scene, from the manifest when available
+    """
+    manifest = open_manifest(root)
+    if manifest is not None:
+        return manifest.rooms(scene)
+    return np.sort(listdir(os.path.join(root, f"scene_{scene:05d}", "2D_rendering"))).tolist()
+
+
+def list_positions(root, scene, room, config='full'):
+    """perspective position ids of a room, from the manifest when available
+    """
+    manifest = open_manifest(root)
+    if manifest is not None:
+        return manifest.positions(scene, room, config)
+
+    room_path = os.path.join(root, f"scene_{scene:05d}", "2D_rendering", str(room), "perspective", config)
+    if not exists(room_path):
+        return []
+    return np.sort(listdir(room_path)).tolist()
@@ -0,0 +1,261 @@
+"""
+Streaming writers of textured triangle meshes (binary PLY, OBJ+MTL, glTF)
+
+The meshes of a scene are added one by one, e.g. one per room, and their
+vertices, faces and uvs are written out immediately, so the whole scene is
+never held in memory. Every mesh has its own texture, written as a separate
+compressed image next to the mesh file, or several textures (e.g. atlases)
+selected per triangle by material ids.
+
+The uvs follow the image convention of open3d (v grows downwards), they are
+flipped for PLY and OBJ.
+"""
+import os
+import json
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+
+FORMATS = ('ply', 'obj', 'gltf')
+
+
+class MeshWriter:
+    """base class of the writers, add(name, vertices, triangles, uvs, textures, material_ids) then close()
+    """
+
+    def __init__(self, path, texture_format='jpg'):
+        self.path = path
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.stem = os.path.splitext(os.path.basename(path))[0]
+        self.texture_format = texture_format
+        self.textures = []
+        self.num_vertices = 0
+        self.num_triangles = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def write_texture(self, name, texture):
+        """write the RGB texture as <stem>_<name>.<format>, returns its file name
+        """
+        filename = f"{self.stem}_{name}.{self.texture_format}"
+        params = [cv2.IMWRITE_JPEG_QUALITY, 90] if self.texture_format == 'jpg' else [cv2.IMWRITE_PNG_COMPRESSION, 9]
+        cv2.imwrite(os.path.join(self.directory, filename), cv2.cvtColor(texture, cv2.COLOR_RGB2BGR), params)
+        self.textures.append(filename)
+        return filename
+
+    def write_textures(self, name, textures):
+        """write the textures of a mesh, a single one or a list, returns their file names
+        """
+        if isinstance(textures, np.ndarray):
+            return [self.write_texture(name, textures)]
+        if len(textures) == 1:
+            return [self.write_texture(name, textures[0])]
+        return [self.write_texture(f"{name}_{i}", texture) for i, texture in enumerate(textures)]
+
+    def add(self, name, vertices, triangles, uvs, textures, material_ids=None):
+        """add a mesh with per-vertex uvs, its textures and the texture index of each triangle
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PLYWriter(MeshWriter):
+    """binary little-endian PLY, vertices with (s, t) and faces with a texture number
+
+    The vertex and face records are streamed to temporary files, the header
+    (which needs the counts) is written when closing.
+    """
+
+    VERTEX = np.dtype([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('s', '<f4'), ('t', '<f4')])
+    FACE = np.dtype([('n', 'u1'), ('indices', '<i4', 3), ('texnumber', '<i4')])
+
+    def __init__(self, path, texture_format='jpg'):
+        super().__init__(path, texture_format)
+        self._vertices = tempfile.TemporaryFile(dir=self.directory)
+        self._faces = tempfile.TemporaryFile(dir=self.directory)
+
+    def add(self, name, vertices, triangles, uvs, textures, material_ids=None):
+        first = len(self.textures)
+        self.write_textures(name, textures)
+
+        records = np.empty(len(vertices), dtype=self.VERTEX)
+        records['x'], records['y'], records['z'] = vertices.T
+        records['s'], records['t'] = uvs[:, 0], 1 - uvs[:, 1]
+        self._vertices.write(records.tobytes())
+
+        records = np.empty(len(triangles), dtype=self.FACE)
+        records['n'] = 3
+        records['indices'] = triangles + self.num_vertices
+        records['texnumber'] = first + (0 if material_ids is None else material_ids)
+        self._faces.write(records.tobytes())
+
+        self.num_vertices += len(vertices)
+        self.num_triangles += len(triangles)
+
+    def close(self):
+        header = ["ply", "format binary_little_endian 1.0"]
+        header += [f"comment TextureFile {filename}" for filename in self.textures]
+        header += [f"element vertex {self.num_vertices}",
+                   "property float x", "property float y", "property float z",
+                   "property float s", "property float t",
+                   f"element face {self.num_triangles}",
+                   "property list uchar int vertex_indices",
+                   "property int texnumber",
+                   "end_header"]
+
+        with open(self.path, 'wb') as f:
+            f.write(('\n'.join(header) + '\n').encode('ascii'))
+            for part in [self._vertices, self._faces]:
+                part.seek(0)
+                shutil.copyfileobj(part, f)
+                part.close()
+
+
+class OBJWriter(MeshWriter):
+    """OBJ with one group and material per mesh, the materials are written into <stem>.mtl
+    """
+
+    def __init__(self, path, texture_format='jpg'):
+        super().__init__(path, texture_format)
+        self._file = open(path, 'w')
+        self._file.write(f"mtllib {self.stem}.mtl\n")
+        self._materials = []
+
+    def add(self, name, vertices, triangles, uvs, textures, material_ids=None):
+        filenames = self.write_textures(name, textures)
+        materials = [f"{name}_{i}" for i in range(len(filenames))]
+        self._materials += list(zip(materials, filenames))
+
+        f = self._file
+        f.write(f"g {name}\n")
+        np.savetxt(f, vertices, fmt='v %.6g %.6g %.6g')
+        np.savetxt(f, np.stack([uvs[:, 0], 1 - uvs[:, 1]], axis=1), fmt='vt %.6f %.6f')
+
+        # obj indices start at 1, vertices and uvs share the same index
+        indices = np.repeat(triangles + self.num_vertices + 1, 2, axis=1)
+        for i, material in enumerate(materials):
+            f.write(f"usemtl {material}\n")
+            np.savetxt(f, indices if material_ids is None else indices[material_ids == i],
+                       fmt='f %d/%d %d/%d %d/%d')
+
+        self.num_vertices += len(vertices)
+        self.num_triangles += len(triangles)
+
+    def close(self):
+        self._file.close()
+        with open(os.path.join(self.directory, f"{self.stem}.mtl"), 'w') as f:
+            for name, filename in self._materials:
+                f.write(f"newmtl {name}\nKa 1 1 1\nKd 1 1 1\nKs 0 0 0\nillum 1\nmap_Kd {filename}\n\n")
+
+
+class GLTFWriter(MeshWriter):
+    """glTF 2.0 with one node and mesh per added mesh, and one primitive per texture
+
+    Positions, uvs and indices are streamed into <stem>.bin, the json is
+    written when closing.
+    """
+
+    ARRAY_BUFFER = 34962
+    ELEMENT_ARRAY_BUFFER = 34963
+    FLOAT = 5126
+    UNSIGNED_INT = 5125
+
+    def __init__(self, path, texture_format='jpg'):
+        super().__init__(path, texture_format)
+        self._buffer = open(os.path.join(self.directory, f"{self.stem}.bin"), 'wb')
+        self._offset = 0
+        self.gltf = {
+            'asset': {'version': '2.0', 'generator': 'Structured3D'},
+            'scene': 0,
+            'scenes': [{'nodes': []}],
+            'nodes': [], 'meshes': [], 'materials': [], 'textures': [], 'images': [],
+            'samplers': [{}], 'accessors': [], 'bufferViews': [],
+            'buffers': [{'uri': f"{self.stem}.bin", 'byteLength': 0}],
+        }
+
+    def _write_view(self, array, target):
+        data = np.ascontiguousarray(array).tobytes()
+        self._buffer.write(data)
+        self.gltf['bufferViews'].append({'buffer': 0, 'byteOffset': self._offset,
+                                         'byteLength': len(data), 'target': target})
+        self._offset += len(data)
+        # keep every view 4-byte aligned
+        padding = -self._offset % 4
+        self._buffer.write(b'\x00' * padding)
+        self._offset += padding
+        return len(self.gltf['bufferViews']) - 1
+
+    def _add_accessor(self, view, component, count, kind, array=None):
+        accessor = {'bufferView': view, 'componentType': component, 'count': count, 'type': kind}
+        if array is not None:
+            accessor['min'] = array.min(axis=0).tolist()
+            accessor['max'] = array.max(axis=0).tolist()
+        self.gltf['accessors'].append(accessor)
+        return len(self.gltf['accessors']) - 1
+
+    def add(self, name, vertices, triangles, uvs, textures, material_ids=None):
+        gltf = self.gltf
+        filenames = self.write_textures(name, textures)
+
+        vertices = vertices.astype(np.float32)
+        uvs = uvs.astype(np.float32)
+        triangles = triangles.astype(np.uint32)
+
+        position = self._add_accessor(self._write_view(vertices, self.ARRAY_BUFFER),
+                                      self.FLOAT, len(vertices), 'VEC3', vertices)
+        texcoord = self._add_accessor(self._write_view(uvs, self.ARRAY_BUFFER),
+                                      self.FLOAT, len(uvs), 'VEC2')
+
+        primitives = []
+        for i, filename in enumerate(filenames):
+            selected = triangles if material_ids is None else triangles[material_ids == i]
+            if len(selected) == 0:
+                continue
+            indices = self._add_accessor(self._write_view(selected, self.ELEMENT_ARRAY_BUFFER),
+                                         self.UNSIGNED_INT, selected.size, 'SCALAR')
+
+            gltf['images'].append({'uri': filename})
+            gltf['textures'].append({'sampler': 0, 'source': len(gltf['images']) - 1})
+            gltf['materials'].append({
+                'name': f"{name}_{i}",
+                'pbrMetallicRoughness': {'baseColorTexture': {'index': len(gltf['textures']) - 1},
+                                         'metallicFactor': 0.0},
+                'doubleSided': True,
+            })
+            primitives.append({
+                'attributes': {'POSITION': position, 'TEXCOORD_0': texcoord},
+                'indices': indices,
+                'material': len(gltf['materials']) - 1,
+            })
+        gltf['meshes'].append({'name': name, 'primitives': primitives})
+        gltf['nodes'].append({'name': name, 'mesh': len(gltf['meshes']) - 1})
+        gltf['scenes'][0]['nodes'].append(len(gltf['nodes']) - 1)
+
+        self.num_vertices += len(vertices)
+        self.num_triangles += len(triangles)
+
+    def close(self):
+        self._buffer.close()
+        self.gltf['buffers'][0]['byteLength'] = self._offset
+        with open(self.path, 'w') as f:
+            json.dump(self.gltf, f)
+
+
+def open_writer(path, texture_format='jpg'):
+    """mesh writer for the format given by the extension of the path
+    """
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    writers = {'ply': PLYWriter, 'obj': OBJWriter, 'gltf': GLTFWriter}
+    if extension not in writers:
+        raise ValueError(f"unsupported mesh format {extension}, expected one of {FORMATS}")
+    return writers[extension](path, texture_format)
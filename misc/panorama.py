@@ -73,6 +73,35 @@ def xyz2uvN(xyz, planeID=1):
     return uv
 
 
+def xyz2uvN_vec(xyz, planeID):
+    """
+    vectorization version of xyz2uvN
+    @xyz      N x 3
+    @planeID  N
+    """
+    assert (planeID.astype(int) != planeID).sum() == 0
+    planeID = planeID.astype(int)
+    ID1 = (planeID - 1 + 0) % 3
+    ID2 = (planeID - 1 + 1) % 3
+    ID3 = (planeID - 1 + 2) % 3
+    ID = np.arange(len(xyz))
+    x1 = xyz[ID, ID1][:, None]
+    x2 = xyz[ID, ID2][:, None]
+    x3 = xyz[ID, ID3][:, None]
+    normXY = np.sqrt(x1 ** 2 + x2 ** 2)
+    normXY[normXY < 0.000001] = 0.000001
+    normXYZ = np.sqrt(x1 ** 2 + x2 ** 2 + x3 ** 2)
+    v = np.arcsin(x3 / normXYZ)
+    u = np.arcsin(x1 / normXY)
+    valid = (x2 < 0) & (u >= 0)
+    u[valid] = np.pi - u[valid]
+    valid = (x2 < 0) & (u <= 0)
+    u[valid] = -np.pi - u[valid]
+    uv = np.hstack([u, v])
+    uv[np.isnan(uv[:, 0]), 0] = 0
+    return uv
+
+
 def computeUVN(n, in_, planeID):
     """
     compute v given u and normal.
@@ -128,61 +157,78 @@ def lineFromTwoPoint(pt1, pt2):
     planeIDs = np.argmax(np.hstack([areaXY, areaYZ, areaZX]), axis=1) + 1
     lines[:, 3] = planeIDs
 
-    for i in range(numLine):
-        uv = xyz2uvN(np.vstack([pt1[i, :], pt2[i, :]]), lines[i, 3])
-        umax = uv[:, 0].max() + np.pi
-        umin = uv[:, 0].min() + np.pi
-        if umax - umin > np.pi:
-            lines[i, 4:6] = np.array([umax, umin]) / 2 / np.pi
-        else:
-            lines[i, 4:6] = np.array([umin, umax]) / 2 / np.pi
+    uv1 = xyz2uvN_vec(pt1, planeIDs)
+    uv2 = xyz2uvN_vec(pt2, planeIDs)
+    umax = np.maximum(uv1[:, 0], uv2[:, 0]) + np.pi
+    umin = np.minimum(uv1[:, 0], uv2[:, 0]) + np.pi
+    wrap = umax - umin > np.pi
+    lines[:, 4] = np.where(wrap, umax, umin) / 2 / np.pi
+    lines[:, 5] = np.where(wrap, umin, umax) / 2 / np.pi
 
     return lines
 
 
+def lineIdxFromLines(lines, im_w, im_h):
+    """
+    Rasterize all lines at once as a (lines x samples) computation,
+    the pixel indices are ordered line by line
+    """
+    num_sample = max(im_h, im_w)
+    if len(lines) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+
+    sid = lines[:, 4] * 2 * np.pi
+    eid = lines[:, 5] * 2 * np.pi
+    wrap = eid < sid
+    x = np.linspace(sid, np.where(wrap, eid + 2 * np.pi, eid), num_sample, axis=1)
+    x[wrap] = x[wrap] % (2 * np.pi)
+
+    u = -np.pi + x.reshape(-1, 1)
+    v = computeUVN_vec(lines[:, 0:3], u, lines[:, 3])
+    xyz = uv2xyzN_vec(np.hstack([u, v]), np.repeat(lines[:, 3], num_sample))
+    uv = xyz2uvN(xyz, 1)
+
+    r = np.minimum(np.floor((uv[:, 0] + np.pi) / (2 * np.pi) * im_w) + 1,
+                   im_w).astype(np.int32)
+    c = np.minimum(np.floor((np.pi / 2 - uv[:, 1]) / np.pi * im_h) + 1,
+                   im_h).astype(np.int32)
+    return c - 1, r - 1
+
+
 def lineIdxFromCors(cor_all, im_w, im_h):
     assert len(cor_all) % 2 == 0
     uv = coords2uv(cor_all, im_w, im_h)
     xyz = uv2xyzN(uv)
     lines = lineFromTwoPoint(xyz[0::2], xyz[1::2])
-    num_sample = max(im_h, im_w)
+    return lineIdxFromLines(lines, im_w, im_h)
 
-    cs, rs = [], []
-    for i in range(lines.shape[0]):
-        n = lines[i, 0:3]
-        sid = lines[i, 4] * 2 * np.pi
-        eid = lines[i, 5] * 2 * np.pi
-        if eid < sid:
-            x = np.linspace(sid, eid + 2 * np.pi, num_sample)
-            x = x % (2 * np.pi)
-        else:
-            x = np.linspace(sid, eid, num_sample)
-
-        u = -np.pi + x.reshape(-1, 1)
-        v = computeUVN(n, u, lines[i, 3])
-        xyz = uv2xyzN(np.hstack([u, v]), lines[i, 3])
-        uv = xyz2uvN(xyz, 1)
-
-        r = np.minimum(np.floor((uv[:, 0] + np.pi) / (2 * np.pi) * im_w) + 1,
-                       im_w).astype(np.int32)
-        c = np.minimum(np.floor((np.pi / 2 - uv[:, 1]) / np.pi * im_h) + 1,
-                       im_h).astype(np.int32)
-        cs.extend(r - 1)
-        rs.extend(c - 1)
-    return rs, cs
 
+def lineIdxFromCors_batch(cor_alls, im_w, im_h):
+    """
+    lineIdxFromCors for many panoramas of the same size in one computation
+    @cor_alls  list of (2 x num_lines) x 2 endpoints, one per panorama
+    """
+    num_lines = [len(cor_all) // 2 for cor_all in cor_alls]
+    rs, cs = lineIdxFromCors(np.vstack(cor_alls), im_w, im_h)
+    splits = np.cumsum(num_lines)[:-1] * max(im_h, im_w)
+    return list(zip(np.split(rs, splits), np.split(cs, splits)))
 
-def draw_boundary_from_cor_id(cor_id, img_src):
-    im_h, im_w = img_src.shape[:2]
+
+def cor_id_2_cor_all(cor_id):
+    """
+    Endpoints of the layout boundary lines, pairing each corner with the
+    next corner of the same (ceiling or floor) boundary
+    """
     cor_all = [cor_id]
     for i in range(len(cor_id)):
         cor_all.append(cor_id[i, :])
         cor_all.append(cor_id[(i+2) % len(cor_id), :])
-    cor_all = np.vstack(cor_all)
+    return np.vstack(cor_all)
 
-    rs, cs = lineIdxFromCors(cor_all, im_w, im_h)
-    rs = np.array(rs)
-    cs = np.array(cs)
+
+def draw_boundary_from_cor_id(cor_id, img_src):
+    im_h, im_w = img_src.shape[:2]
+    rs, cs = lineIdxFromCors(cor_id_2_cor_all(cor_id), im_w, im_h)
 
     panoEdgeC = img_src.astype(np.uint8)
     for dx, dy in [[-1, 0], [1, 0], [0, 0], [0, 1], [0, -1]]:
@@ -217,27 +263,71 @@ def uv2xy(u, v, z=-50):
 
 
 def pano_connect_points(p1, p2, z=-50, w=1024, h=512):
-    u1 = coorx2u(p1[0], w)
-    v1 = coory2v(p1[1], h)
-    u2 = coorx2u(p2[0], w)
-    v2 = coory2v(p2[1], h)
-
-    x1, y1 = uv2xy(u1, v1, z)
-    x2, y2 = uv2xy(u2, v2, z)
-
-    if abs(p1[0] - p2[0]) < w / 2:
-        pstart = np.ceil(min(p1[0], p2[0]))
-        pend = np.floor(max(p1[0], p2[0]))
-    else:
-        pstart = np.ceil(max(p1[0], p2[0]))
-        pend = np.floor(min(p1[0], p2[0]) + w)
-    coorxs = (np.arange(pstart, pend + 1) % w).astype(np.float64)
-    vx = x2 - x1
-    vy = y2 - y1
+    points, _ = pano_connect_points_batch([p1], [p2], z, w, h)
+    return points
+
+
+def pano_connect_points_batch(p1s, p2s, z=-50, w=1024, h=512):
+    """
+    pano_connect_points for many pairs of corners in one computation
+    @p1s, p2s  N x 2 corners (coorx, coory), z a scalar or one value per pair
+    Returns the M x 2 points of all pairs and the N + 1 offsets of the points
+    of each pair, the points of pair i are points[offsets[i]:offsets[i + 1]]
+    """
+    p1s = np.asarray(p1s, dtype=np.float64).reshape(-1, 2)
+    p2s = np.asarray(p2s, dtype=np.float64).reshape(-1, 2)
+    zs = np.broadcast_to(np.asarray(z, dtype=np.float64), len(p1s))
+
+    x1, y1 = uv2xy(coorx2u(p1s[:, 0], w), coory2v(p1s[:, 1], h), zs)
+    x2, y2 = uv2xy(coorx2u(p2s[:, 0], w), coory2v(p2s[:, 1], h), zs)
+
+    # columns between the corners, across the seam if the wall is wrapped around
+    lower = np.minimum(p1s[:, 0], p2s[:, 0])
+    upper = np.maximum(p1s[:, 0], p2s[:, 0])
+    wrapped = np.abs(p1s[:, 0] - p2s[:, 0]) >= w / 2
+    pstart = np.where(wrapped, np.ceil(upper), np.ceil(lower))
+    pend = np.where(wrapped, np.floor(lower + w), np.floor(upper))
+    counts = np.maximum(pend - pstart + 1, 0).astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+
+    # flat columns of all pairs, with the index of their pair
+    pair = np.repeat(np.arange(len(p1s)), counts)
+    coorxs = ((np.arange(offsets[-1]) - offsets[pair] + pstart[pair]) % w).astype(np.float64)
+
+    x1, y1, zs = x1[pair], y1[pair], zs[pair]
+    vx, vy = x2[pair] - x1, y2[pair] - y1
     us = coorx2u(coorxs, w)
     ps = (np.tan(us) * x1 - y1) / (vy - np.tan(us) * vx)
     cs = np.sqrt((x1 + ps * vx) ** 2 + (y1 + ps * vy) ** 2)
-    vs = np.arctan2(z, cs)
-    coorys = v2coory(vs)
+    vs = np.arctan2(zs, cs)
+    coorys = v2coory(vs, h)
+
+    return np.stack([coorxs, coorys], axis=-1), offsets
+
 
-    return np.stack([coorxs, coorys], axis=-1)
+def layout_boundaries(cor_ids, w=1024, h=512):
+    """
+    Ceiling (z=-50) and floor (z=50) boundary points of the walls of one or
+    many layouts in one computation
+    @cor_ids  a (2 x num_corners) x 2 cor_id of (ceiling, floor) pairs, or a list of them
+    Returns the ceiling points, their offsets per wall, the floor points,
+    their offsets per wall, and the wall offsets of each layout, the walls of
+    layout k are walls[wall_offsets[k]:wall_offsets[k + 1]]
+    """
+    if isinstance(cor_ids, np.ndarray) and cor_ids.ndim == 2:
+        cor_ids = [cor_ids]
+    cor_ids = [np.asarray(cor_id, dtype=np.float64)[:, :2] for cor_id in cor_ids]
+
+    # every corner is connected to the next corner of the same boundary
+    ceiling = np.concatenate([cor_id[0::2] for cor_id in cor_ids])
+    floor = np.concatenate([cor_id[1::2] for cor_id in cor_ids])
+    ceiling_next = np.concatenate([np.roll(cor_id[0::2], -1, axis=0) for cor_id in cor_ids])
+    floor_next = np.concatenate([np.roll(cor_id[1::2], -1, axis=0) for cor_id in cor_ids])
+    wall_offsets = np.concatenate([[0], np.cumsum([len(cor_id) // 2 for cor_id in cor_ids])])
+
+    points, offsets = pano_connect_points_batch(np.concatenate([ceiling, floor]),
+                                                np.concatenate([ceiling_next, floor_next]),
+                                                np.repeat([-50, 50], len(ceiling)), w, h)
+    split = offsets[len(ceiling)]
+    return (points[:split], offsets[:len(ceiling) + 1],
+            points[split:], offsets[len(ceiling):] - split, wall_offsets)
@@ -0,0 +1,146 @@
+"""
+Triangulated plane meshes of a scene, cached on disk
+
+The meshes only depend on annotation_3d.json, so they are computed once and
+stored in plane_mesh_cache.bin next to it, keyed by the sha1 of the json
+content (see misc.storage.load_cache). The cache is memory-mapped by later runs and by any other consumer.
+"""
+import os
+
+import numpy as np
+
+from misc import profiling
+from misc.polygon import convert_planes_to_vertices, nest_polygons, triangulate_polygon
+from misc.scene_cache import load_annotation_3d
+from misc.storage import load_cache, save_cache
+from misc.topology import get_topology
+
+
+MESH_CACHE_NAME = 'plane_mesh_cache.bin'
+# bump when the triangulation changes, so that older caches are rebuilt
+MESH_VERSION = 2
+
+
+def project(x, meta):
+    """ project 3D to 2D for polygon clipping
+    """
+    proj_axis = int(np.argmax(np.abs(meta['normal'])))
+
+    return np.delete(np.asarray(x, dtype=np.float64), proj_axis, axis=-1)
+
+
+def project_inv(x, meta):
+    """ recover 3D points from 2D
+    """
+    # Returns the points w in the walls' plane such that project(w) equals x.
+    normal = np.asarray(meta['normal'], dtype=np.float64)
+    proj_axis = int(np.argmax(np.abs(normal)))
+
+    x = np.asarray(x, dtype=np.float64)
+    c = -(meta['offset'] + x @ np.delete(normal, proj_axis)) / normal[proj_axis]
+    return np.insert(x, proj_axis, c, axis=-1)
+
+
+def clip_polygon(polygons, junctions, meta):
+    """ triangulate the plane, cutting out the holes
+    """
+    if len(polygons) == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64)
+
+    # local indices of the vertices of all loops
+    vertex_ids, loops = np.unique(np.concatenate(polygons), return_inverse=True)
+    loops = np.split(loops, np.cumsum([len(polygon) for polygon in polygons])[:-1])
+    loops = [loop.tolist() for loop in loops]
+
+    vertices = np.asarray(junctions, dtype=np.float64)[vertex_ids]
+    points = project(vertices, meta)
+
+    # the loops inside others are holes, all holes of a loop are triangulated in one pass
+    with profiling.stage('holes'):
+        nested = nest_polygons(points, loops)
+    with profiling.stage('triangulation'):
+        faces = [triangulate_polygon(points, outer, holes) for outer, holes in nested]
+    faces = np.concatenate(faces, axis=0)
+
+    # counter-clockwise in 2D is around +normal only for some projection axes
+    proj_axis = int(np.argmax(np.abs(meta['normal'])))
+    if meta['normal'][proj_axis] * (-1 if proj_axis == 1 else 1) < 0:
+        faces = faces[:, ::-1]
+
+    return vertices, faces
+
+
+def triangulate_planes(annos):
+    """(vertices, faces, planeID, plane type, semantic type) of every plane of every semantic
+    """
+    with profiling.stage('topology'):
+        topology = get_topology(annos)
+    junctions = np.array([item['coordinate'] for item in annos['junctions']])
+
+    planes = [(planeID, semantic['type']) for semantic in annos['semantics'] for planeID in semantic['planeID']]
+    with profiling.stage('polygons'):
+        plane_polygons = convert_planes_to_vertices(topology, [planeID for planeID, _ in planes])
+
+    meshes = []
+    for (planeID, semantic_type), polygon in zip(planes, plane_polygons):
+        plane_anno = annos['planes'][planeID]
+        vertices, faces = clip_polygon(polygon, junctions, plane_anno)
+        meshes.append((vertices, faces, planeID, plane_anno['type'], semantic_type))
+    return meshes
+
+
+def encode_meshes(meshes):
+    """concatenate the meshes into flat arrays with offsets
+    """
+    plane_types = sorted({mesh[3] for mesh in meshes})
+    semantic_types = sorted({mesh[4] for mesh in meshes})
+
+    arrays = {
+        'vertices': np.concatenate([mesh[0] for mesh in meshes] or [np.zeros((0, 3))]).astype(np.float64),
+        'vertex_indptr': np.cumsum([0] + [len(mesh[0]) for mesh in meshes]).astype(np.int64),
+        'faces': np.concatenate([mesh[1] for mesh in meshes] or [np.zeros((0, 3))]).astype(np.int32),
+        'face_indptr': np.cumsum([0] + [len(mesh[1]) for mesh in meshes]).astype(np.int64),
+        'plane_id': np.array([mesh[2] for mesh in meshes], dtype=np.int64),
+        'plane_type': np.array([plane_types.index(mesh[3]) for mesh in meshes], dtype=np.uint16),
+        'semantic_type': np.array([semantic_types.index(mesh[4]) for mesh in meshes], dtype=np.uint16),
+    }
+    return arrays, {'plane_types': plane_types, 'semantic_types': semantic_types}
+
+
+def decode_meshes(arrays, meta):
+    """split the flat arrays back into meshes, the vertices and faces are views
+    """
+    vertex_indptr, face_indptr = arrays['vertex_indptr'], arrays['face_indptr']
+    meshes = []
+    for i, planeID in enumerate(arrays['plane_id'].tolist()):
+        meshes.append((arrays['vertices'][vertex_indptr[i]:vertex_indptr[i + 1]],
+                       arrays['faces'][face_indptr[i]:face_indptr[i + 1]],
+                       planeID,
+                       meta['plane_types'][arrays['plane_type'][i]],
+                       meta['semantic_types'][arrays['semantic_type'][i]]))
+    return meshes
+
+
+def load_plane_meshes(scene_path, annos=None):
+    """triangulated planes of a scene (see triangulate_planes), from the cache when
+    it matches annotation_3d.json, otherwise computed and cached
+    """
+    sources = [os.path.join(scene_path, 'annotation_3d.json')]
+    path = os.path.join(scene_path, MESH_CACHE_NAME)
+
+    cache = load_cache(path, sources, MESH_VERSION)
+    if cache is not None:
+        return decode_meshes(*cache)
+
+    if annos is None:
+        annos = load_annotation_3d(scene_path)
+    with profiling.stage('plane_meshes'):
+        meshes = triangulate_planes(annos)
+
+    try:
+        os.makedirs(scene_path, exist_ok=True)
+        save_cache(path, sources, MESH_VERSION, *encode_meshes(meshes))
+    except OSError:
+        # read-only dataset, use the meshes without caching them
+        pass
+    return meshes
@@ -0,0 +1,334 @@
+"""
+Back-projection of the depth maps into world-space point clouds
+
+Depth maps are uint16 millimeters (0 where invalid). Panorama depth is the
+distance to the camera center along the viewing ray, perspective depth is
+the z-depth in camera coordinates unless range_depth is set. The viewing
+rays are computed once per resolution (and camera intrinsics) and reused,
+and the points are produced in chunks of image rows, so that the memory used
+does not depend on the image size.
+"""
+import os
+import functools
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from misc.panorama import coorx2u, coory2v
+from misc.utils import parse_camera_info
+from misc.storage import imread, loadtxt
+
+
+# file name and imread flag of the point attributes
+ATTRIBUTES = {
+    'rgb': ('rgb_rawlight.png', 1),
+    'albedo': ('albedo.png', 1),
+    'semantic': ('semantic.png', -1),
+    'instance': ('instance.png', -1),
+}
+
+
+@functools.lru_cache(maxsize=8)
+def panorama_rays(height, width):
+    """(height * width, 3) float32 unit rays of the panorama pixels
+    """
+    u = coorx2u(np.arange(width, dtype=np.float64), width)
+    v = coory2v(np.arange(height, dtype=np.float64), height)[:, None]
+
+    rays = np.empty((height, width, 3), dtype=np.float32)
+    rays[..., 0] = np.cos(v) * np.sin(u)
+    rays[..., 1] = np.cos(v) * np.cos(u)
+    rays[..., 2] = np.broadcast_to(-np.sin(v), (height, width))
+    rays = rays.reshape(-1, 3)
+    rays.flags.writeable = False
+    return rays
+
+
+@functools.lru_cache(maxsize=32)
+def _perspective_rays(height, width, fx, fy, cx, cy, range_depth):
+    x = (np.arange(width, dtype=np.float64) - cx) / fx
+    y = -(np.arange(height, dtype=np.float64)[:, None] - cy) / fy
+
+    rays = np.empty((height, width, 3), dtype=np.float32)
+    rays[..., 0] = x
+    rays[..., 1] = y
+    rays[..., 2] = 1
+    if range_depth:
+        rays /= np.linalg.norm(rays, axis=-1, keepdims=True)
+    rays = rays.reshape(-1, 3)
+    rays.flags.writeable = False
+    return rays
+
+
+def perspective_rays(height, width, K, range_depth=False):
+    """(height * width, 3) float32 rays in camera coordinates (the inverse of
+    misc.utils.project_3d_points_to_2d), scaled to unit z or to unit length
+    """
+    return _perspective_rays(height, width, float(K[0, 0]), float(K[1, 1]),
+                             float(K[0, 2]), float(K[1, 2]), bool(range_depth))
+
+
+def _chunks(depth, rays, rotation, origin, attributes, chunk_rows):
+    """points (rays * depth) @ rotation + origin of the valid pixels of a depth map,
+    chunk_rows image rows at a time
+    """
+    height, width = depth.shape
+    rotation = np.asarray(rotation, dtype=np.float32)
+    origin = np.asarray(origin, dtype=np.float32)
+    attributes = attributes or dict()
+
+    for start in range(0, height, chunk_rows):
+        stop = min(start + chunk_rows, height)
+        chunk_depth = depth[start:stop].reshape(-1)
+        valid = np.flatnonzero(chunk_depth)
+        if len(valid) == 0:
+            continue
+
+        distance = chunk_depth[valid].astype(np.float32)
+        points = rays[start * width:stop * width][valid] * distance[:, None]
+        points = points @ rotation + origin
+
+        chunk = {'points': points}
+        for name, attribute in attributes.items():
+            attribute = attribute[start:stop]
+            chunk[name] = attribute.reshape((-1,) + attribute.shape[2:])[valid]
+        yield chunk
+
+
+def backproject_panorama(depth, camera_xyz, attributes=None, chunk_rows=64):
+    """world-space points of a panorama depth map, as chunks of {'points': (N, 3) float32, <attribute>: ...}
+
+    attributes are optional images of the same size (e.g. rgb, semantic,
+    instance), sampled at the valid pixels.
+    """
+    rays = panorama_rays(*depth.shape)
+    return _chunks(depth, rays, np.eye(3), camera_xyz, attributes, chunk_rows)
+
+
+def backproject_perspective(depth, camera_info, attributes=None, chunk_rows=64, range_depth=False):
+    """world-space points of a perspective depth map and its camera_pose.txt, see backproject_panorama
+    """
+    rot, trans, K = parse_camera_info(camera_info, *depth.shape)
+    rays = perspective_rays(*depth.shape, K, range_depth)
+    # camera coordinates are rot @ (p - trans), rot is not orthonormal if up is not orthogonal to lookat
+    return _chunks(depth, rays, np.linalg.inv(rot).T, trans, attributes, chunk_rows)
+
+
+def _load_attributes(view_path, attributes):
+    import cv2
+
+    images = dict()
+    for name in attributes:
+        filename, flags = ATTRIBUTES[name]
+        image = imread(os.path.join(view_path, filename), flags)
+        if image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        images[name] = image
+    return images
+
+
+def panorama_points(room_path, config='full', attributes=('rgb',), chunk_rows=64):
+    """chunks of world-space points of the panorama of a room (2D_rendering/<room>)
+    """
+    view_path = os.path.join(room_path, 'panorama', config)
+    depth = imread(os.path.join(view_path, 'depth.png'), -1)
+    camera_xyz = loadtxt(os.path.join(room_path, 'panorama', 'camera_xyz.txt'))
+    return backproject_panorama(depth, camera_xyz, _load_attributes(view_path, attributes), chunk_rows)
+
+
+def perspective_points(view_path, attributes=('rgb',), chunk_rows=64, range_depth=False):
+    """chunks of world-space points of a perspective view (perspective/<config>/<position>)
+    """
+    depth = imread(os.path.join(view_path, 'depth.png'), -1)
+    camera_info = loadtxt(os.path.join(view_path, 'camera_pose.txt'))
+    return backproject_perspective(depth, camera_info, _load_attributes(view_path, attributes),
+                                   chunk_rows, range_depth)
+
+
+def concatenate_chunks(chunks):
+    """merge streamed chunks into a single one
+    """
+    merged = dict()
+    for chunk in chunks:
+        for name, values in chunk.items():
+            merged.setdefault(name, []).append(values)
+    return {name: np.concatenate(values, axis=0) for name, values in merged.items()}
+
+
+class VoxelGrid:
+    """incremental voxel-hash downsampling of point chunks
+
+    Every occupied voxel keeps the sum of its points (and of the rgb/albedo
+    colors) and their count, labels (semantic, instance) are those of the
+    first point. Memory is proportional to the number of occupied voxels.
+    """
+
+    AVERAGED = ('points', 'rgb', 'albedo')
+
+    def __init__(self, voxel_size=20):
+        self.voxel_size = voxel_size
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.values = dict()
+        # reduced chunks not merged into the grid yet
+        self._pending = []
+        self._pending_size = 0
+
+    def __len__(self):
+        self._flush()
+        return len(self.keys)
+
+    def _keys(self, points):
+        # 21 bits per axis, i.e. +-2^20 voxels around the origin
+        index = np.floor(points / self.voxel_size).astype(np.int64) + (1 << 20)
+        return (index[:, 0] << 42) | (index[:, 1] << 21) | index[:, 2]
+
+    def _reduce(self, keys, counts, values):
+        """sum the counts and averaged values of the same keys, keep the first labels
+        """
+        keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        counts = np.bincount(inverse, counts, len(keys)).astype(np.int64)
+
+        reduced = dict()
+        for name, value in values.items():
+            if name in self.AVERAGED:
+                columns = value.reshape(len(value), -1)
+                summed = np.stack([np.bincount(inverse, columns[:, i], len(keys))
+                                   for i in range(columns.shape[1])], axis=1)
+                reduced[name] = summed.reshape((len(keys),) + value.shape[1:])
+            else:
+                reduced[name] = value[first]
+        return keys, counts, reduced
+
+    def _merge(self, keys, counts, values):
+        self._pending.append(self._reduce(keys, counts, values))
+        self._pending_size += len(self._pending[-1][0])
+        # the chunks are merged once they outnumber the voxels of the grid, so that
+        # the grid is not sorted again for every chunk
+        if self._pending_size >= len(self.keys):
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        chunks = self._pending
+        if len(self.keys) or self.values:
+            chunks = [(self.keys, self.counts, self.values)] + chunks
+        # the grid comes first, so that it keeps the labels of its voxels
+        self.keys, self.counts, self.values = self._reduce(
+            np.concatenate([keys for keys, _, _ in chunks]),
+            np.concatenate([counts for _, counts, _ in chunks]),
+            {name: np.concatenate([values[name] for _, _, values in chunks]) for name in chunks[0][2]})
+        self._pending, self._pending_size = [], 0
+
+    def add(self, chunk):
+        """add a chunk of points with their attributes, as yielded by the back-projection
+        """
+        values = {name: (value.astype(np.float64) if name in self.AVERAGED else value)
+                  for name, value in chunk.items()}
+        self._merge(self._keys(chunk['points']), np.ones(len(chunk['points']), dtype=np.int64), values)
+
+    def merge(self, other):
+        """merge another grid of the same voxel size into this one
+        """
+        if len(other):
+            self._pending.append((other.keys, other.counts, other.values))
+            self._pending_size += len(other.keys)
+            if self._pending_size >= len(self.keys):
+                self._flush()
+
+    def cloud(self):
+        """downsampled points (voxel centroids, float32) and averaged or first attributes
+        """
+        self._flush()
+        cloud = dict()
+        for name, value in self.values.items():
+            if name in self.AVERAGED:
+                value = value / self.counts.reshape((-1,) + (1,) * (value.ndim - 1))
+                value = value.astype(np.float32) if name == 'points' else np.round(value).astype(np.uint8)
+            cloud[name] = value
+        return cloud
+
+
+def scene_views(root, scene, config='full', perspective=False):
+    """(kind, path) of the panorama of every room of a scene, and optionally of every perspective view
+    """
+    from misc.manifest import list_rooms, list_positions
+    from misc.storage import exists
+
+    views = []
+    for room_id in list_rooms(root, scene):
+        room_path = os.path.join(root, f"scene_{scene:05d}", "2D_rendering", str(room_id))
+        if exists(os.path.join(room_path, 'panorama', config, 'depth.png')):
+            views.append(('panorama', room_path))
+        if perspective:
+            for position_id in list_positions(root, scene, room_id, config):
+                views.append(('perspective', os.path.join(room_path, 'perspective', config, position_id)))
+    return views
+
+
+def fuse_scene(root, scene, voxel_size=20, config='full', perspective=False, attributes=('rgb',), workers=4):
+    """fuse the views of a scene into one voxel-downsampled world-space point cloud
+
+    The views are back-projected into their own grid on a thread pool, each
+    grid is merged into the scene grid as soon as it is done.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    def fuse_view(view):
+        kind, path = view
+        grid = VoxelGrid(voxel_size)
+        chunks = panorama_points(path, config, attributes) if kind == 'panorama' else \
+            perspective_points(path, attributes)
+        for chunk in chunks:
+            grid.add(chunk)
+        return grid
+
+    scene_grid = VoxelGrid(voxel_size)
+    views = iter(scene_views(root, scene, config, perspective))
+    with ThreadPoolExecutor(workers) as executor:
+        # at most one view per worker is in flight, the finished grids are not held at once
+        pending = deque(executor.submit(fuse_view, view) for view in islice(views, workers))
+        try:
+            while pending:
+                grid = pending.popleft().result()
+                for view in islice(views, 1):
+                    pending.append(executor.submit(fuse_view, view))
+                scene_grid.merge(grid)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return scene_grid
+
+
+def save_cloud(path, cloud):
+    """save a point cloud as npz, or as binary ply
+    """
+    if path.endswith('.npz'):
+        np.savez_compressed(path, **cloud)
+        return
+
+    names = [('x', 'f4'), ('y', 'f4'), ('z', 'f4')]
+    if 'rgb' in cloud:
+        names += [('red', 'u1'), ('green', 'u1'), ('blue', 'u1')]
+    for name in ['semantic', 'instance']:
+        if name in cloud:
+            names.append((name, cloud[name].dtype.str.lstrip('<>|=')))
+
+    records = np.empty(len(cloud['points']), dtype=[(name, '<' + kind) for name, kind in names])
+    records['x'], records['y'], records['z'] = cloud['points'].T
+    if 'rgb' in cloud:
+        records['red'], records['green'], records['blue'] = cloud['rgb'].T
+    for name in ['semantic', 'instance']:
+        if name in cloud:
+            records[name] = cloud[name]
+
+    ply_types = {'f4': 'float', 'u1': 'uchar', 'u2': 'ushort', 'i4': 'int'}
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {len(records)}"]
+    header += [f"property {ply_types[kind]} {name}" for name, kind in names]
+    header.append("end_header")
+    with open(path, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode('ascii'))
+        f.write(records.tobytes())
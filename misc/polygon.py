@@ -0,0 +1,287 @@
+"""
+Polygon recovery from the line representation of the structure annotation
+"""
+from collections import defaultdict
+
+import numpy as np
+
+
+def polygon_area(polygon, junctions, normal=(0, 0, 1)):
+    """signed area of a polygon around the normal (Newell's method)
+    """
+    points = np.asarray(junctions)[np.asarray(polygon)]
+    if points.shape[1] == 2:
+        points = np.hstack((points, np.zeros((len(points), 1))))
+    cross = np.cross(points, np.roll(points, -1, axis=0)).sum(axis=0)
+    return 0.5 * np.dot(cross, normal)
+
+
+def orient_polygon(polygon, junctions, normal=(0, 0, 1)):
+    """order polygon vertices counter-clockwise around the normal, keeping the first vertex
+    """
+    if polygon_area(polygon, junctions, normal) < 0:
+        return polygon[:1] + polygon[:0:-1]
+    return polygon
+
+
+def convert_lines_to_vertices(lines, junctions=None, normal=(0, 0, 1)):
+    """convert line representation to polygon vertices
+
+    Every closed loop is recovered in O(E) by walking a junction -> lines map.
+    If the junction coordinates are given, each loop is ordered
+    counter-clockwise around the normal.
+    """
+    lines = np.asarray(lines, dtype=np.int64).reshape(-1, 2).tolist()
+
+    adjacency = defaultdict(list)
+    for lineID, (start, end) in enumerate(lines):
+        adjacency[start].append(lineID)
+        if end != start:
+            adjacency[end].append(lineID)
+
+    # lines are consumed in order, so a cursor per junction skips the used ones
+    cursor = defaultdict(int)
+    used = [False] * len(lines)
+
+    polygons = []
+    for first in range(len(lines)):
+        if used[first]:
+            continue
+        used[first] = True
+        polygon = list(lines[first])
+        visited = set(polygon)
+
+        while True:
+            vertex = polygon[-1]
+            candidates = adjacency[vertex]
+            index = cursor[vertex]
+            while index < len(candidates) and used[candidates[index]]:
+                index += 1
+            cursor[vertex] = index
+
+            # open chain, not a polygon
+            if index == len(candidates):
+                break
+
+            lineID = candidates[index]
+            used[lineID] = True
+            start, end = lines[lineID]
+            vertex = end if start == vertex else start
+
+            if vertex in visited:
+                polygons.append(polygon)
+                break
+            polygon.append(vertex)
+            visited.add(vertex)
+
+    if junctions is not None:
+        polygons = [orient_polygon(polygon, junctions, normal) for polygon in polygons]
+
+    return polygons
+
+
+def convert_planes_to_vertices(topology, planeIDs, exclude_lines=None, junctions=None, normals=None):
+    """convert the lines of many planes of a scene to polygon vertices in one call
+
+    Returns the list of loops of each plane. If the junction coordinates and
+    the plane normals are given, the loops are oriented around the normals.
+    """
+    polygons = []
+    for i, planeID in enumerate(planeIDs):
+        junction_pairs = topology.plane_junction_pairs(planeID, exclude_lines=exclude_lines)
+        if junctions is not None and normals is not None:
+            polygons.append(convert_lines_to_vertices(junction_pairs, junctions, normals[i]))
+        else:
+            polygons.append(convert_lines_to_vertices(junction_pairs))
+    return polygons
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def point_in_polygon(point, polygon):
+    """even-odd test of a 2D point against a 2D polygon
+    """
+    polygon = np.asarray(polygon, dtype=np.float64)
+    x, y = point
+    xs, ys = polygon[:, 0], polygon[:, 1]
+    xs_next, ys_next = np.roll(xs, -1), np.roll(ys, -1)
+    straddle = (ys > y) != (ys_next > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = xs + (y - ys) * (xs_next - xs) / (ys_next - ys)
+    return bool(np.count_nonzero(straddle & (x < x_cross)) % 2)
+
+
+def _locally_inside(a, v, b, m):
+    """whether m lies inside the angle of a counter-clockwise ring at v, between a -> v -> b
+    """
+    if _cross(a, v, b) >= 0:
+        return _cross(a, v, m) >= 0 and _cross(v, b, m) >= 0
+    return _cross(a, v, m) >= 0 or _cross(v, b, m) >= 0
+
+
+def _crossing_edges(M, V, starts, ends, eps=1e-9):
+    """which of the edges starts[k] -> ends[k] properly cross the segment M -> V
+    """
+    def cross(o, a, b):
+        return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+    d1, d2 = cross(starts, ends, M), cross(starts, ends, V)
+    d3, d4 = cross(M, V, starts), cross(M, V, ends)
+    return (((d1 > eps) & (d2 < -eps)) | ((d1 < -eps) & (d2 > eps))) & \
+           (((d3 > eps) & (d4 < -eps)) | ((d3 < -eps) & (d4 > eps)))
+
+
+def _bridge(points, ring, hole, obstacles):
+    """merge a hole (clockwise) into the ring through the nearest visible ring vertex,
+    obstacles are the (start, end) point indices of the edges of the hole and the
+    holes that are not bridged yet
+    """
+    start = max(range(len(hole)), key=lambda i: (points[hole[i], 0], points[hole[i], 1]))
+    M = points[hole[start]]
+
+    edge_starts = points[np.concatenate([ring, obstacles[0]])]
+    edge_ends = points[np.concatenate([ring[1:] + ring[:1], obstacles[1]])]
+
+    # the nearest vertex that sees M wins, candidates are tested by increasing distance
+    dists = np.sum((points[ring] - M) ** 2, axis=1)
+    best = None
+    for k in np.argsort(dists, kind='stable').tolist():
+        V = points[ring[k]]
+        # a vertex repeated by an earlier bridge is only valid from the copy facing M
+        if not _locally_inside(points[ring[k - 1]], V, points[ring[(k + 1) % len(ring)]], M):
+            continue
+        if _crossing_edges(M, V, edge_starts, edge_ends).any():
+            continue
+        best = k
+        break
+
+    if best is None:
+        # no visible vertex due to degenerate input, bridge to the nearest one anyway
+        best = int(np.argmin(dists))
+
+    hole = hole[start:] + hole[:start]
+    return ring[:best + 1] + hole + [hole[0], ring[best]] + ring[best + 1:]
+
+
+def _is_ear(coords, ring, prev, nxt, reflex, i, eps):
+    """whether the convex vertex i of the linked ring is an ear, only the reflex
+    vertices can lie inside its triangle
+    """
+    a, b, c = prev[i], i, nxt[i]
+    if not reflex:
+        return True
+
+    candidates = np.fromiter(reflex, dtype=np.int64, count=len(reflex))
+    # the copies of the corners repeated by the bridges share their point indices
+    indices = ring[candidates]
+    candidates = candidates[(indices != ring[a]) & (indices != ring[b]) & (indices != ring[c])]
+    p = coords[candidates]
+
+    A, B, C = coords[a], coords[b], coords[c]
+    inside = ((B[0] - A[0]) * (p[:, 1] - A[1]) - (B[1] - A[1]) * (p[:, 0] - A[0]) >= -eps) & \
+             ((C[0] - B[0]) * (p[:, 1] - B[1]) - (C[1] - B[1]) * (p[:, 0] - B[0]) >= -eps) & \
+             ((A[0] - C[0]) * (p[:, 1] - C[1]) - (A[1] - C[1]) * (p[:, 0] - C[0]) >= -eps)
+    return not inside.any()
+
+
+def triangulate_polygon(points, outer, holes=(), eps=1e-9):
+    """triangulate a 2D polygon with holes by ear clipping, all holes are bridged
+    into the outer loop first
+
+    points is (N, 2), outer and holes are lists of indices into points. Returns
+    (M, 3) counter-clockwise triangles indexing points.
+    """
+    points = np.asarray(points, dtype=np.float64)
+
+    ring = orient_polygon(list(outer), points)
+    holes = [orient_polygon(list(hole), points)[::-1] for hole in holes]
+
+    # bridge the holes from right to left, so that earlier bridges do not block later ones
+    holes.sort(key=lambda hole: -points[hole, 0].max())
+    hole_starts = np.array([vertex for hole in holes for vertex in hole], dtype=np.int64)
+    hole_ends = np.array([vertex for hole in holes for vertex in hole[1:] + hole[:1]], dtype=np.int64)
+    offset = 0
+    for hole in holes:
+        ring = _bridge(points, ring, hole, (hole_starts[offset:], hole_ends[offset:]))
+        offset += len(hole)
+
+    # the ring as a doubly linked list over its positions
+    ring = np.asarray(ring, dtype=np.int64)
+    coords = points[ring]
+    size = len(ring)
+    prev = [(i - 1) % size for i in range(size)]
+    nxt = [(i + 1) % size for i in range(size)]
+
+    def corner(i):
+        return _cross(coords[prev[i]], coords[i], coords[nxt[i]])
+
+    reflex = {i for i in range(size) if corner(i) <= eps}
+
+    def remove(i):
+        a, c = prev[i], nxt[i]
+        nxt[a], prev[c] = c, a
+        reflex.discard(i)
+        # only the neighbours of a clipped vertex change their angle
+        for j in (a, c):
+            if corner(j) <= eps:
+                reflex.add(j)
+            else:
+                reflex.discard(j)
+        return c
+
+    triangles = []
+    i, failures = 0, 0
+    while size > 3:
+        area = corner(i)
+        # drop collinear or duplicated vertices without a triangle
+        if abs(area) <= eps:
+            i, failures = remove(i), 0
+            size -= 1
+        elif area > eps and _is_ear(coords, ring, prev, nxt, reflex, i, eps):
+            triangles.append([ring[prev[i]], ring[i], ring[nxt[i]]])
+            # resume from the next vertex instead of scanning the ring again
+            i, failures = remove(i), 0
+            size -= 1
+        elif failures < size:
+            i, failures = nxt[i], failures + 1
+        else:
+            # numerically degenerate remainder, clip the most convex vertex
+            vertices = [i]
+            while nxt[vertices[-1]] != i:
+                vertices.append(nxt[vertices[-1]])
+            i = max(vertices, key=corner)
+            triangles.append([ring[prev[i]], ring[i], ring[nxt[i]]])
+            i, failures = remove(i), 0
+            size -= 1
+
+    last = [prev[i], i, nxt[i]]
+    if size == 3 and _cross(*coords[last]) > eps:
+        triangles.append(ring[last].tolist())
+
+    return np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+
+def nest_polygons(points, polygons):
+    """split loops into outer loops and their holes by containment
+
+    Returns a list of (outer, holes). A loop inside an even number of other
+    loops is an outer loop, otherwise it is a hole of the smallest loop
+    containing it.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    areas = [abs(polygon_area(polygon, points)) for polygon in polygons]
+
+    containers = []
+    for i, polygon in enumerate(polygons):
+        inside = points[polygon].mean(axis=0)
+        containers.append([j for j, other in enumerate(polygons)
+                           if j != i and areas[j] > areas[i] and point_in_polygon(inside, points[other])])
+
+    outers = {i: (polygon, []) for i, polygon in enumerate(polygons) if len(containers[i]) % 2 == 0}
+    for i, polygon in enumerate(polygons):
+        if i not in outers:
+            parent = min((j for j in containers[i] if j in outers), key=lambda j: areas[j])
+            outers[parent][1].append(polygon)
+    return [outers[i] for i in sorted(outers)]
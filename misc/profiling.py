@@ -0,0 +1,248 @@
+"""
+Lightweight per-stage timing and counters for the batch tools
+
+Profiling is off by default and costs one flag check per stage. It is turned
+on with --profile in batch mode or with the S3D_PROFILE=1 environment
+variable. Stages nest, their names are joined by '/', e.g.
+plane_meshes/triangulation. The counters (e.g. bytes_read) are summed.
+"""
+import os
+import csv
+import json
+import time
+import threading
+
+
+ENV_VAR = 'S3D_PROFILE'
+
+_enabled = os.environ.get(ENV_VAR, '') not in ('', '0')
+_lock = threading.Lock()
+_local = threading.local()
+_stages = dict()
+_counters = dict()
+_rss_start = None
+_hwm_reset = False
+_process_peak = 0
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True):
+    global _enabled
+    _enabled = flag
+
+
+def reset():
+    """clear the stages and counters, e.g. before the next scene
+    """
+    global _rss_start, _hwm_reset, _process_peak
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+    # the reset also clears the lifetime peak of the kernel, which is kept here
+    _process_peak = max(_process_peak, _hwm() or 0)
+    _hwm_reset = _reset_hwm()
+    _rss_start = current_rss()
+
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        name = '/'.join(stack)
+        stack.pop()
+        with _lock:
+            total = _stages.setdefault(name, [0.0, 0])
+            total[0] += elapsed
+            total[1] += 1
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name):
+    """context manager timing a named stage, a no-op when profiling is off
+    """
+    return _Stage(name) if _enabled else _NULL_STAGE
+
+
+def count(name, value=1):
+    """add to a named counter, a no-op when profiling is off
+    """
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def current_rss():
+    """resident set size of the process in bytes, None where /proc is unavailable
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            resident = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return resident * os.sysconf('SC_PAGE_SIZE')
+
+
+def _reset_hwm():
+    """reset the peak RSS (VmHWM) of the process to its current RSS, linux only
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def _hwm():
+    """peak RSS (VmHWM) of the process since the last reset in bytes, None where unavailable
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+
+def peak_rss():
+    """peak resident set size over the lifetime of the process in bytes, None where unavailable
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    peak = peak if sys.platform == 'darwin' else peak * 1024
+    # the peaks before the resets of the per-scene peak
+    return max(peak, _process_peak, _hwm() or 0)
+
+
+def report(scene=None):
+    """stages (seconds and calls), counters and peak RSS recorded since the last reset
+
+    The peak RSS is the high-water mark of the process since the reset, where
+    it cannot be reset (outside linux) the growth of the RSS since the reset is
+    reported instead as rss_delta_bytes. The lifetime peak of a process spans
+    all the scenes it ran, so it is only reported in the summary of a batch
+    (see aggregate).
+    """
+    with _lock:
+        stages = {name: {'seconds': seconds, 'calls': calls} for name, (seconds, calls) in sorted(_stages.items())}
+        counters = dict(sorted(_counters.items()))
+    peak = _hwm() if _hwm_reset else None
+    rss_delta = None
+    if peak is None:
+        rss = current_rss()
+        rss_delta = rss - _rss_start if rss is not None and _rss_start is not None else None
+    return {'scene': scene, 'stages': stages, 'counters': counters,
+            'peak_rss_bytes': peak, 'rss_delta_bytes': rss_delta}
+
+
+def aggregate(reports, peaks=()):
+    """summary of the reports of a batch: total, mean and max seconds and calls of
+    every stage, summed counters, the largest peak RSS (or RSS growth) of a
+    scene and the largest lifetime peak RSS of the processes that ran them
+    """
+    stages = dict()
+    for scene_report in reports:
+        for name, values in scene_report['stages'].items():
+            summary = stages.setdefault(name, {'seconds': 0.0, 'calls': 0, 'max_seconds': 0.0, 'scenes': 0})
+            summary['seconds'] += values['seconds']
+            summary['calls'] += values['calls']
+            summary['max_seconds'] = max(summary['max_seconds'], values['seconds'])
+            summary['scenes'] += 1
+    for summary in stages.values():
+        summary['mean_seconds'] = summary['seconds'] / summary['scenes']
+
+    counters = dict()
+    for scene_report in reports:
+        for name, value in scene_report['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+
+    def largest(values):
+        values = [value for value in values if value is not None]
+        return max(values) if values else None
+
+    return {'num_scenes': len(reports), 'stages': dict(sorted(stages.items())),
+            'counters': dict(sorted(counters.items())),
+            'max_peak_rss_bytes': largest(scene_report['peak_rss_bytes'] for scene_report in reports),
+            'max_rss_delta_bytes': largest(scene_report['rss_delta_bytes'] for scene_report in reports),
+            'process_peak_rss_bytes': largest(peaks)}
+
+
+def _rows(profile):
+    rows = [{'kind': 'stage', 'name': name, **values} for name, values in profile['stages'].items()]
+    rows += [{'kind': 'counter', 'name': name, 'value': value} for name, value in profile['counters'].items()]
+    for name in ['peak_rss_bytes', 'rss_delta_bytes', 'max_peak_rss_bytes', 'max_rss_delta_bytes',
+                 'process_peak_rss_bytes']:
+        if name in profile:
+            rows.append({'kind': 'memory', 'name': name, 'value': profile[name]})
+    return rows
+
+
+def write_report(path, profile):
+    """write a report or a summary as json, or as csv rows if the path ends with .csv
+    """
+    if not path.endswith('.csv'):
+        with open(path, 'w') as f:
+            json.dump(profile, f, indent=2)
+        return
+
+    rows = _rows(profile)
+    fieldnames = ['kind', 'name']
+    for row in rows:
+        fieldnames += [key for key in row if key not in fieldnames]
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_summary(summary):
+    """print the stages of a summary by decreasing total time
+    """
+    print(f"{summary['num_scenes']} scenes")
+    for name, values in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+        print(f"  {name:40s} {values['seconds']:10.3f} s {values['calls']:8d} calls "
+              f"{values['mean_seconds'] * 1e3:10.2f} ms/scene")
+    for name, value in summary['counters'].items():
+        print(f"  {name:40s} {value}")
+    for name, label in [('max_peak_rss_bytes', 'peak_rss (one scene)'),
+                        ('max_rss_delta_bytes', 'rss_delta (one scene)'),
+                        ('process_peak_rss_bytes', 'peak_rss (process)')]:
+        if summary[name] is not None:
+            print(f"  {label:40s} {summary[name] / 2 ** 20:.1f} MiB")
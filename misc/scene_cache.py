@@ -0,0 +1,236 @@
+"""
+Compact binary cache of annotation_3d.json and bbox_3d.json
+"""
+import os
+import operator
+from collections.abc import Sequence
+
+import numpy as np
+
+from misc import profiling
+from misc.storage import exists, load_json, load_cache, save_cache
+from misc.topology import SceneTopology, build_csr, nonzero_pairs
+
+
+CACHE_NAME = 'annotation_cache.bin'
+SOURCES = ('annotation_3d.json', 'bbox_3d.json')
+# bump when the encoding changes, so that older caches are rebuilt
+CACHE_VERSION = 1
+
+
+def _sources(scene_path):
+    return [os.path.join(scene_path, name) for name in SOURCES]
+
+
+def _string_table(values):
+    table = sorted(set(values))
+    lookup = {value: i for i, value in enumerate(table)}
+    return table, np.array([lookup[value] for value in values], dtype=np.uint16)
+
+
+def _group_csr(groups):
+    rows, cols = [], []
+    for index, group in enumerate(groups):
+        rows.extend([index] * len(group['planeID']))
+        cols.extend(group['planeID'])
+    return build_csr(rows, cols, len(groups))
+
+
+def _vectors(items, key, size=3):
+    return np.array([item[key] for item in items], dtype=np.float32).reshape(-1, size)
+
+
+def _ids(items):
+    return np.array([item['ID'] for item in items], dtype=np.int64)
+
+
+def encode_scene(annos, boxes):
+    """encode the json annotations into flat arrays and metadata
+    """
+    arrays, meta = dict(), dict()
+
+    arrays['junction_id'] = _ids(annos['junctions'])
+    arrays['junction_xyz'] = _vectors(annos['junctions'], 'coordinate')
+
+    arrays['line_id'] = _ids(annos['lines'])
+    arrays['line_point'] = _vectors(annos['lines'], 'point')
+    arrays['line_direction'] = _vectors(annos['lines'], 'direction')
+
+    arrays['plane_id'] = _ids(annos['planes'])
+    meta['plane_types'], arrays['plane_type'] = _string_table([plane['type'] for plane in annos['planes']])
+    arrays['plane_normal'] = _vectors(annos['planes'], 'normal')
+    arrays['plane_offset'] = np.array([plane['offset'] for plane in annos['planes']], dtype=np.float32)
+
+    arrays['semantic_id'] = _ids(annos['semantics'])
+    meta['semantic_types'], arrays['semantic_type'] = _string_table(
+        [semantic['type'] for semantic in annos['semantics']])
+
+    # sparse relationships instead of the dense matrices
+    planes, lines = nonzero_pairs(annos['planeLineMatrix'])
+    arrays['plane_line_indptr'], arrays['plane_line_indices'] = build_csr(planes, lines, len(annos['planes']))
+    lines, junctions = nonzero_pairs(annos['lineJunctionMatrix'])
+    arrays['line_junction_indptr'], arrays['line_junction_indices'] = build_csr(
+        lines, junctions, len(annos['lines']))
+
+    for key in ['semantics', 'cuboids', 'manhattan']:
+        name = key.rstrip('s')
+        if key != 'semantics':
+            arrays[f'{name}_id'] = _ids(annos.get(key, []))
+        arrays[f'{name}_plane_indptr'], arrays[f'{name}_plane_indices'] = _group_csr(annos.get(key, []))
+
+    if boxes is not None:
+        meta['has_bbox'] = True
+        arrays['bbox_id'] = _ids(boxes)
+        arrays['bbox_basis'] = np.array([bbox['basis'] for bbox in boxes], dtype=np.float32).reshape(-1, 3, 3)
+        arrays['bbox_coeffs'] = _vectors(boxes, 'coeffs')
+        arrays['bbox_centroid'] = _vectors(boxes, 'centroid')
+
+    return arrays, meta
+
+
+def convert_scene(scene_path):
+    """convert the json annotations of one scene into the binary cache
+    """
+    annos = load_json(os.path.join(scene_path, 'annotation_3d.json'))
+
+    boxes = None
+    if exists(os.path.join(scene_path, 'bbox_3d.json')):
+        boxes = load_json(os.path.join(scene_path, 'bbox_3d.json'))
+
+    arrays, meta = encode_scene(annos, boxes)
+    os.makedirs(scene_path, exist_ok=True)
+    save_cache(os.path.join(scene_path, CACHE_NAME), _sources(scene_path), CACHE_VERSION, arrays, meta)
+
+
+def open_cache(scene_path):
+    """memory-map the cache of a scene, None if it is missing or out of date
+    """
+    # the json files are the reference, a cache that does not match them is ignored
+    cache = load_cache(os.path.join(scene_path, CACHE_NAME), _sources(scene_path), CACHE_VERSION)
+    if cache is None or cache[1]['stats'][0] is None:
+        return None
+    return cache
+
+
+def _csr(arrays, name):
+    return arrays[f'{name}_indptr'], arrays[f'{name}_indices']
+
+
+class _Records(Sequence):
+    """read-only list of annotation records, each dict is built from the
+    memory-mapped columns when it is accessed
+    """
+
+    def __init__(self, size, record):
+        self._size = size
+        self._record = record
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._record(i) for i in range(*index.indices(self._size))]
+        index = operator.index(index)
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError('record index out of range')
+        return self._record(index)
+
+
+def _groups(arrays, name, types=None):
+    indptr, indices = _csr(arrays, f'{name}_plane')
+    ids = arrays[f'{name}_id']
+
+    def record(i):
+        group = {'ID': int(ids[i])}
+        if types is not None:
+            group['type'] = types[i]
+        group['planeID'] = indices[indptr[i]:indptr[i + 1]].tolist()
+        return group
+    return _Records(len(ids), record)
+
+
+def decode_annotation(arrays, meta):
+    """annotation_3d.json structure backed by the memory-mapped arrays
+
+    junctions, lines, planes, semantics, cuboids and manhattan are read-only
+    sequences whose dicts are built on access, nothing is copied up front. The
+    decoded annos have no planeLineMatrix and lineJunctionMatrix, the
+    relationships are given by the topology index in annos['_topology'] (see
+    misc.topology.get_topology).
+    """
+    annos = dict()
+
+    junction_id, junction_xyz = arrays['junction_id'], arrays['junction_xyz']
+    annos['junctions'] = _Records(len(junction_id), lambda i: {
+        'ID': int(junction_id[i]), 'coordinate': junction_xyz[i].tolist()})
+
+    line_id, line_point, line_direction = arrays['line_id'], arrays['line_point'], arrays['line_direction']
+    annos['lines'] = _Records(len(line_id), lambda i: {
+        'ID': int(line_id[i]), 'point': line_point[i].tolist(), 'direction': line_direction[i].tolist()})
+
+    plane_id, plane_type = arrays['plane_id'], arrays['plane_type']
+    plane_normal, plane_offset = arrays['plane_normal'], arrays['plane_offset']
+    annos['planes'] = _Records(len(plane_id), lambda i: {
+        'ID': int(plane_id[i]), 'type': meta['plane_types'][plane_type[i]],
+        'normal': plane_normal[i].tolist(), 'offset': float(plane_offset[i])})
+
+    semantic_types = [meta['semantic_types'][index] for index in arrays['semantic_type'].tolist()]
+    annos['semantics'] = _groups(arrays, 'semantic', semantic_types)
+    annos['cuboids'] = _groups(arrays, 'cuboid')
+    annos['manhattan'] = _groups(arrays, 'manhattan')
+
+    annos['_topology'] = SceneTopology(
+        _csr(arrays, 'plane_line'), _csr(arrays, 'line_junction'), _csr(arrays, 'semantic_plane'),
+        len(junction_id), semantic_types, arrays['semantic_id'])
+
+    return annos
+
+
+def decode_bbox(arrays):
+    """bbox_3d.json structure backed by the memory-mapped arrays, the dicts are built on access
+    """
+    bbox_id, basis, coeffs, centroid = (arrays['bbox_id'], arrays['bbox_basis'],
+                                        arrays['bbox_coeffs'], arrays['bbox_centroid'])
+    return _Records(len(bbox_id), lambda i: {
+        'ID': int(bbox_id[i]), 'basis': basis[i].tolist(), 'coeffs': coeffs[i].tolist(),
+        'centroid': centroid[i].tolist()})
+
+
+def load_annotation_3d(scene_path):
+    """load annotation_3d.json, from the binary cache when it is up to date
+    """
+    with profiling.stage('load_annotation'):
+        cache = open_cache(scene_path)
+        if cache is not None:
+            return decode_annotation(*cache)
+
+        return load_json(os.path.join(scene_path, 'annotation_3d.json'))
+
+
+def load_bbox_arrays(scene_path):
+    """load bbox_3d.json as arrays (ID, basis, coeffs, centroid), zero-copy from
+    the binary cache when it is up to date
+    """
+    cache = open_cache(scene_path)
+    if cache is not None and cache[1].get('has_bbox'):
+        arrays = cache[0]
+        return arrays['bbox_id'], arrays['bbox_basis'], arrays['bbox_coeffs'], arrays['bbox_centroid']
+
+    boxes = load_json(os.path.join(scene_path, 'bbox_3d.json'))
+    return (np.array([bbox['ID'] for bbox in boxes], dtype=np.int64),
+            np.array([bbox['basis'] for bbox in boxes], dtype=np.float64).reshape(-1, 3, 3),
+            np.array([bbox['coeffs'] for bbox in boxes], dtype=np.float64).reshape(-1, 3),
+            np.array([bbox['centroid'] for bbox in boxes], dtype=np.float64).reshape(-1, 3))
+
+
+def load_bbox_3d(scene_path):
+    """load bbox_3d.json, from the binary cache when it is up to date
+    """
+    cache = open_cache(scene_path)
+    if cache is not None and cache[1].get('has_bbox'):
+        return decode_bbox(cache[0])
+
+    return load_json(os.path.join(scene_path, 'bbox_3d.json'))
@@ -0,0 +1,198 @@
+"""
+Sharded tar packing of the perspective views for sequential-read data loading
+
+Each view becomes one sample whose files are stored next to each other in a
+tar shard as <key>.<file name>, e.g. scene_00000_485142_full_0.depth.png.
+"""
+import io
+import os
+import json
+import random
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+
+from misc.manifest import list_rooms, list_positions
+from misc.storage import read_bytes
+from misc.utils import parse_camera_info
+
+
+VIEW_FILES = ('rgb_rawlight.png', 'semantic.png', 'instance.png', 'albedo.png',
+              'depth.png', 'normal.png', 'layout.json', 'camera_pose.txt')
+
+# images converted from BGR to RGB when decoded, the others are kept unchanged
+COLOR_IMAGES = ('rgb_rawlight.png', 'albedo.png', 'normal.png')
+
+
+def list_views(root, scenes, config='full'):
+    """(key, directory) of every perspective view of the scenes
+    """
+    views = []
+    for scene in scenes:
+        for room_id in list_rooms(root, scene):
+            for position_id in list_positions(root, scene, room_id, config):
+                key = f"scene_{scene:05d}_{room_id}_{config}_{position_id}"
+                path = os.path.join(root, f"scene_{scene:05d}", "2D_rendering", room_id,
+                                    "perspective", config, position_id)
+                views.append((key, path))
+    return views
+
+
+def _read_view(view, files):
+    key, path = view
+    return key, [(name, read_bytes(os.path.join(path, name))) for name in files]
+
+
+def pack_shards(views, output, shard_size=1 << 30, files=VIEW_FILES, workers=8):
+    """pack the views into tar shards of about shard_size bytes, returns the shard names
+
+    If a view cannot be read, the shard being written is removed and the error is raised.
+    """
+    os.makedirs(output, exist_ok=True)
+
+    shards, counts = [], []
+    tar, size = None, 0
+    views = iter(views)
+    with ThreadPoolExecutor(workers) as executor:
+        # the files of at most 2 * workers views are read ahead, the shards are written in order
+        pending = deque(executor.submit(_read_view, view, files) for view in islice(views, 2 * workers))
+        try:
+            while pending:
+                key, members = pending.popleft().result()
+                for view in islice(views, 1):
+                    pending.append(executor.submit(_read_view, view, files))
+
+                if tar is None or size >= shard_size:
+                    if tar is not None:
+                        tar.close()
+                    shards.append(f"shard-{len(shards):06d}.tar")
+                    counts.append(0)
+                    tar = tarfile.open(os.path.join(output, shards[-1]), 'w')
+                    size = 0
+
+                for name, data in members:
+                    info = tarfile.TarInfo(f"{key}.{name}")
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+                    size += len(data)
+                counts[-1] += 1
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            if tar is not None:
+                tar.close()
+                os.remove(os.path.join(output, shards[-1]))
+            raise
+
+    if tar is not None:
+        tar.close()
+
+    with open(os.path.join(output, 'shards.json'), 'w') as f:
+        json.dump({'shards': shards, 'samples': counts, 'files': list(files)}, f)
+    return shards
+
+
+def decode_file(name, data):
+    """decode one file of a view
+    """
+    import cv2
+
+    if name.endswith('.png'):
+        flags = cv2.IMREAD_COLOR if name in COLOR_IMAGES else cv2.IMREAD_UNCHANGED
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+        if name in COLOR_IMAGES:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        return image
+    if name.endswith('.json'):
+        return json.loads(data)
+    if name.endswith('.txt'):
+        return np.loadtxt(io.BytesIO(data))
+    return data
+
+
+def decode_sample(key, files):
+    """decode the files of a view, the camera is parsed with parse_camera_info
+    """
+    sample = {'__key__': key}
+    for name, data in files.items():
+        sample[name] = decode_file(name, data)
+
+    if 'camera_pose.txt' in sample:
+        height, width = next(image.shape[:2] for name, image in sample.items() if name.endswith('.png'))
+        rot, trans, K = parse_camera_info(sample['camera_pose.txt'], height, width)
+        sample['camera'] = {'rot': rot, 'trans': trans, 'K': K}
+    return sample
+
+
+class ShardReader:
+    """stream decoded samples from tar shards
+
+    The shards of each epoch are split across workers (given explicitly, or
+    taken from a torch DataLoader worker if available), read sequentially and
+    the samples are shuffled within a buffer.
+    """
+
+    def __init__(self, shards, shuffle_buffer=1000, seed=0, worker_id=None, num_workers=None):
+        if isinstance(shards, str):
+            # directory written by pack_shards
+            with open(os.path.join(shards, 'shards.json')) as f:
+                shards = [os.path.join(shards, name) for name in json.load(f)['shards']]
+        self.shards = list(shards)
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.epoch = 0
+
+    def _worker(self):
+        if self.worker_id is not None:
+            return self.worker_id, self.num_workers
+        try:
+            from torch.utils.data import get_worker_info
+        except ImportError:
+            return 0, 1
+        info = get_worker_info()
+        if info is None:
+            return 0, 1
+        return info.id, info.num_workers
+
+    def _raw_samples(self, shards):
+        for shard in shards:
+            key, files = None, dict()
+            with tarfile.open(shard, 'r|') as tar:
+                for member in tar:
+                    if not member.isfile():
+                        continue
+                    member_key, name = member.name.split('.', 1)
+                    if member_key != key and files:
+                        yield key, files
+                        files = dict()
+                    key = member_key
+                    files[name] = tar.extractfile(member).read()
+            if files:
+                yield key, files
+
+    def __iter__(self):
+        worker_id, num_workers = self._worker()
+        rng = random.Random(self.seed + self.epoch)
+        self.epoch += 1
+
+        shards = list(self.shards)
+        rng.shuffle(shards)
+        shards = shards[worker_id::num_workers]
+
+        buffer = []
+        for key, files in self._raw_samples(shards):
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append((key, files))
+                continue
+            index = rng.randrange(len(buffer))
+            buffer[index], (key, files) = (key, files), buffer[index]
+            yield decode_sample(key, files)
+
+        rng.shuffle(buffer)
+        for key, files in buffer:
+            yield decode_sample(key, files)
@@ -0,0 +1,148 @@
+"""
+Spatial index of the rooms and objects of a scene
+
+The floor polygons of the rooms (misc.floorplan) and the footprints of the
+objects (bbox_3d.json) are kept in two shapely STRtrees, so that batches of
+point, box and radius queries are answered without testing every pair. The
+geometry and the object-to-room assignment are cached next to the scene.
+"""
+import os
+
+import numpy as np
+import shapely
+from shapely import STRtree
+
+from misc.floorplan import floorplan_polygons
+from misc.scene_cache import load_annotation_3d, load_bbox_arrays
+from misc.storage import load_cache, save_cache
+from misc.utils import get_corners_of_bb3d_batch
+
+
+INDEX_CACHE_NAME = 'spatial_index.bin'
+INDEX_VERSION = 2
+SOURCES = ('annotation_3d.json', 'bbox_3d.json')
+
+
+def scene_geometry(annos, bbox_ids, basis, coeffs, centroid):
+    """arrays of the room floor polygons (flat xy with offsets, types, room IDs) and
+    of the object footprints (ids, (N, 4, 2) xy)
+    """
+    junctions = np.array([junc['coordinate'][:2] for junc in annos['junctions']], dtype=np.float64)
+    rooms, _ = floorplan_polygons(annos)
+    room_types = sorted(set(room_type for _, room_type, _ in rooms))
+
+    footprints = get_corners_of_bb3d_batch(basis, coeffs, centroid)[:, :4, :2] if len(bbox_ids) else \
+        np.zeros((0, 4, 2))
+    return {
+        'room_xy': np.concatenate([junctions[polygon] for polygon, _, _ in rooms] or [np.zeros((0, 2))]),
+        'room_indptr': np.cumsum([0] + [len(polygon) for polygon, _, _ in rooms]).astype(np.int64),
+        'room_type': np.array([room_types.index(room_type) for _, room_type, _ in rooms], dtype=np.uint16),
+        'room_id': np.array([room_id for _, _, room_id in rooms], dtype=np.int64),
+        'object_id': np.asarray(bbox_ids, dtype=np.int64),
+        'object_xy': np.asarray(footprints, dtype=np.float64),
+    }, {'room_types': room_types}
+
+
+class SceneIndex:
+    """STRtrees over the rooms and objects of a scene
+
+    Rooms are referred to by their ID, the ID of their semantic in
+    annotation_3d.json and of their 2D_rendering/<room ID> directory, -1 outside
+    all rooms. Objects are referred to by their index in the scene, object_id
+    maps them to the IDs of bbox_3d.json. rooms[i] is the floor polygon of the
+    room room_id[i].
+    """
+
+    def __init__(self, arrays, meta):
+        indptr = arrays['room_indptr']
+        self.room_types = [meta['room_types'][i] for i in arrays['room_type'].tolist()]
+        self.room_id = np.asarray(arrays['room_id'])
+        self.rooms = np.array([shapely.Polygon(arrays['room_xy'][indptr[i]:indptr[i + 1]])
+                               for i in range(len(indptr) - 1)], dtype=object)
+        self.object_id = np.asarray(arrays['object_id'])
+        self.objects = shapely.polygons(np.asarray(arrays['object_xy'])) if len(self.object_id) else \
+            np.zeros(0, dtype=object)
+
+        self.room_tree = STRtree(self.rooms)
+        self.object_tree = STRtree(self.objects)
+
+        if 'object_room' in arrays:
+            self.object_room = np.asarray(arrays['object_room'])
+        else:
+            self.object_room = self._assign_objects()
+
+    def _assign_objects(self):
+        """ID of the room of largest overlap with the footprint of every object, -1 outside all rooms
+        """
+        object_room = np.full(len(self.objects), -1, dtype=np.int64)
+        objects, rooms = self.room_tree.query(self.objects, predicate='intersects')
+        if len(objects) == 0:
+            return object_room
+
+        area = shapely.area(shapely.intersection(self.objects[objects], self.rooms[rooms]))
+        # the pairs of every object by decreasing area, the first one wins
+        order = np.lexsort((-area, objects))
+        objects, rooms = objects[order], rooms[order]
+        first = np.r_[True, objects[1:] != objects[:-1]]
+        object_room[objects[first]] = self.room_id[rooms[first]]
+        return object_room
+
+    def room_objects(self, room_id):
+        """indices of the objects assigned to the room of the given ID
+        """
+        return np.flatnonzero(self.object_room == room_id)
+
+    def rooms_at(self, points):
+        """room ID of every (N, 2) xy point, -1 outside all rooms
+        """
+        points = shapely.points(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        result = np.full(len(points), -1, dtype=np.int64)
+        index, rooms = self.room_tree.query(points, predicate='intersects')
+        result[index] = self.room_id[rooms]
+        return result
+
+    def objects_in_boxes(self, boxes):
+        """(query, object) index pairs of the objects intersecting (N, 4) xy boxes (x0, y0, x1, y1)
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        return self.object_tree.query(shapely.box(*boxes.T), predicate='intersects')
+
+    def objects_within(self, points, radius):
+        """(query, object) index pairs of the objects closer than radius to (N, 2) xy points
+        """
+        points = shapely.points(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        return self.object_tree.query(points, predicate='dwithin', distance=radius)
+
+    def nearest_objects(self, points):
+        """index of the object nearest to every (N, 2) xy point
+        """
+        points = shapely.points(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        index, objects = self.object_tree.query_nearest(points, all_matches=False)
+        result = np.full(len(points), -1, dtype=np.int64)
+        result[index] = objects
+        return result
+
+
+def load_scene_index(scene_path, annos=None):
+    """spatial index of a scene, from the cache when it matches annotation_3d.json
+    and bbox_3d.json, otherwise built and cached
+    """
+    sources = [os.path.join(scene_path, name) for name in SOURCES]
+    path = os.path.join(scene_path, INDEX_CACHE_NAME)
+
+    cache = load_cache(path, sources, INDEX_VERSION)
+    if cache is not None:
+        return SceneIndex(*cache)
+
+    if annos is None:
+        annos = load_annotation_3d(scene_path)
+    arrays, meta = scene_geometry(annos, *load_bbox_arrays(scene_path))
+    index = SceneIndex(arrays, meta)
+
+    arrays['object_room'] = index.object_room
+    try:
+        save_cache(path, sources, INDEX_VERSION, arrays, meta)
+    except OSError:
+        # read-only dataset, use the index without caching it
+        pass
+    return index
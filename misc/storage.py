@@ -0,0 +1,317 @@
+"""
+File access for the tools, either from the extracted dataset or directly from
+the distributed zip archives without extracting them
+
+If the dataset root contains *.zip files, every path below it is served from
+the archives: the member offsets are indexed once (and saved as
+zip_index.bin next to the archives), then each read seeks to the member and
+decompresses it, using a small pool of file handles shared by threads.
+"""
+import io
+import os
+import json
+import zlib
+import hashlib
+import struct
+import zipfile
+import threading
+import functools
+from collections import defaultdict
+
+import numpy as np
+
+from misc import profiling
+from misc.container import write_container, read_container
+
+
+INDEX_NAME = 'zip_index.bin'
+LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+
+
+def _member_key(name):
+    """member name relative to the dataset root, e.g. Structured3D/scene_00000/... -> scene_00000/...
+    """
+    parts = name.split('/')
+    for i, part in enumerate(parts):
+        if part.startswith('scene_'):
+            return '/'.join(parts[i:])
+    return None
+
+
+class ZipStore:
+    """read-only view of the dataset inside its zip archives
+    """
+
+    def __init__(self, root, max_handles=8):
+        self.root = root
+        self.archives = sorted(os.path.join(root, name) for name in os.listdir(root) if name.endswith('.zip'))
+        self.max_handles = max_handles
+
+        self._condition = threading.Condition()
+        self._free = defaultdict(list)
+        self._num_handles = 0
+
+        self._load_index()
+
+    def _archive_stats(self):
+        return [[os.path.basename(path), os.path.getsize(path), os.stat(path).st_mtime_ns]
+                for path in self.archives]
+
+    def _load_index(self):
+        index_path = os.path.join(self.root, INDEX_NAME)
+        if os.path.exists(index_path):
+            arrays, meta = read_container(index_path)
+            if meta.get('archives') == self._archive_stats():
+                self._set_index(arrays)
+                return
+
+        keys, archive, header_offset, compress_size, file_size, method = [], [], [], [], [], []
+        for i, path in enumerate(self.archives):
+            with zipfile.ZipFile(path) as zf:
+                for info in zf.infolist():
+                    key = _member_key(info.filename)
+                    if key is None or info.is_dir():
+                        continue
+                    keys.append(key)
+                    archive.append(i)
+                    header_offset.append(info.header_offset)
+                    compress_size.append(info.compress_size)
+                    file_size.append(info.file_size)
+                    method.append(info.compress_type)
+
+        names = '\n'.join(keys).encode('utf-8')
+        arrays = {
+            'names': np.frombuffer(names, dtype=np.uint8),
+            'archive': np.array(archive, dtype=np.uint16),
+            'header_offset': np.array(header_offset, dtype=np.int64),
+            'compress_size': np.array(compress_size, dtype=np.int64),
+            'file_size': np.array(file_size, dtype=np.int64),
+            'method': np.array(method, dtype=np.uint8),
+        }
+        write_container(index_path, arrays, {'archives': self._archive_stats()})
+        self._set_index(arrays)
+
+    def _set_index(self, arrays):
+        keys = arrays['names'].tobytes().decode('utf-8').split('\n') if len(arrays['names']) else []
+        self.index = {key: i for i, key in enumerate(keys)}
+        self.archive = arrays['archive']
+        self.header_offset = arrays['header_offset']
+        self.compress_size = arrays['compress_size']
+        self.file_size = arrays['file_size']
+        self.method = arrays['method']
+
+        # directory listing derived from the member names
+        self.children = defaultdict(set)
+        for key in keys:
+            parts = key.split('/')
+            for depth in range(1, len(parts)):
+                self.children['/'.join(parts[:depth])].add(parts[depth])
+
+    def _acquire(self, archive):
+        with self._condition:
+            while True:
+                if self._free[archive]:
+                    return self._free[archive].pop()
+                if self._num_handles < self.max_handles:
+                    self._num_handles += 1
+                    break
+                # close an idle handle of another archive to make room
+                for other, handles in self._free.items():
+                    if handles:
+                        handles.pop().close()
+                        self._num_handles -= 1
+                        break
+                else:
+                    self._condition.wait()
+        return open(self.archives[archive], 'rb')
+
+    def _release(self, archive, handle):
+        with self._condition:
+            self._free[archive].append(handle)
+            self._condition.notify()
+
+    def relpath(self, path):
+        key = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        return key.replace(os.sep, '/')
+
+    def exists(self, path):
+        key = self.relpath(path)
+        return key in self.index or key in self.children
+
+    def listdir(self, path):
+        key = self.relpath(path)
+        if key not in self.children:
+            raise FileNotFoundError(path)
+        return sorted(self.children[key])
+
+    def records(self):
+        """(relative path, size) of every member
+        """
+        return ((key, int(self.file_size[i])) for key, i in self.index.items())
+
+    def stat(self, path):
+        """(size, modification time in ns) of a member, the time is the one of its archive
+        """
+        key = self.relpath(path)
+        if key not in self.index:
+            raise FileNotFoundError(path)
+        i = self.index[key]
+        return int(self.file_size[i]), os.stat(self.archives[int(self.archive[i])]).st_mtime_ns
+
+    def read_bytes(self, path):
+        key = self.relpath(path)
+        if key not in self.index:
+            raise FileNotFoundError(path)
+        i = self.index[key]
+        archive = int(self.archive[i])
+
+        handle = self._acquire(archive)
+        try:
+            handle.seek(int(self.header_offset[i]))
+            header = LOCAL_HEADER.unpack(handle.read(LOCAL_HEADER.size))
+            name_length, extra_length = header[-2:]
+            handle.seek(name_length + extra_length, os.SEEK_CUR)
+            data = handle.read(int(self.compress_size[i]))
+        finally:
+            self._release(archive, handle)
+
+        if self.method[i] == zipfile.ZIP_STORED:
+            return data
+        if self.method[i] == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -15)
+        raise ValueError(f"unsupported compression method {self.method[i]} for {path}")
+
+
+@functools.lru_cache(maxsize=None)
+def _store(root):
+    try:
+        names = os.listdir(root)
+    except OSError:
+        return None
+    if any(name.endswith('.zip') for name in names):
+        return ZipStore(root)
+    return None
+
+
+def find_store(path):
+    """zip store serving the path, None for the extracted dataset
+    """
+    parts = os.path.abspath(path).split(os.sep)
+    for i, part in enumerate(parts):
+        if part.startswith('scene_'):
+            return _store(os.sep.join(parts[:i]) or os.sep)
+    if os.path.isdir(path):
+        return _store(os.path.abspath(path))
+    return None
+
+
+def read_bytes(path):
+    with profiling.stage('read'):
+        store = find_store(path)
+        if store is not None:
+            data = store.read_bytes(path)
+        else:
+            with open(path, 'rb') as f:
+                data = f.read()
+    profiling.count('bytes_read', len(data))
+    return data
+
+
+def exists(path):
+    store = find_store(path)
+    if store is not None:
+        return store.exists(path)
+    return os.path.exists(path)
+
+
+def stat(path):
+    """(size, modification time in ns) of a file of the dataset
+    """
+    store = find_store(path)
+    if store is not None:
+        return store.stat(path)
+    result = os.stat(path)
+    return result.st_size, result.st_mtime_ns
+
+
+def listdir(path):
+    store = find_store(path)
+    if store is not None:
+        return store.listdir(path)
+    return os.listdir(path)
+
+
+def imread(path, flags=1):
+    """cv2.imread from the dataset, flags as in cv2 (1 is cv2.IMREAD_COLOR)
+    """
+    import cv2
+
+    buffer = np.frombuffer(read_bytes(path), dtype=np.uint8)
+    with profiling.stage('image_decode'):
+        return cv2.imdecode(buffer, flags)
+
+
+def loadtxt(path, **kwargs):
+    return np.loadtxt(io.BytesIO(read_bytes(path)), **kwargs)
+
+
+def load_json(path):
+    data = read_bytes(path)
+    with profiling.stage('json_parse'):
+        return json.loads(data)
+
+
+def source_stats(sources):
+    """[size, mtime_ns] of the source files of a cache, None for a missing file
+    """
+    return [list(stat(source)) if exists(source) else None for source in sources]
+
+
+def source_digest(sources):
+    """sha1 of the content of the source files of a cache
+    """
+    digest = hashlib.sha1()
+    for source in sources:
+        if not exists(source):
+            digest.update(b'-')
+            continue
+        data = read_bytes(source)
+        digest.update(f"{len(data)}:".encode())
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def load_cache(path, sources, version):
+    """memory-map a cache written by save_cache, None if it is missing, of another
+    version or out of date with its source files
+
+    The sources are hashed only when their size or time changed. If only the
+    time changed, the stored stats are refreshed so that they are not hashed
+    again by the next run.
+    """
+    if not os.path.exists(path):
+        return None
+    arrays, meta = read_container(path)
+    if meta.get('version') != version:
+        return None
+
+    stats = source_stats(sources)
+    if meta.get('stats') == stats:
+        return arrays, meta
+    if meta.get('sha1') != source_digest(sources):
+        return None
+
+    meta['stats'] = stats
+    try:
+        write_container(path, arrays, meta)
+    except OSError:
+        # read-only dataset, the sources are hashed again next time
+        pass
+    return arrays, meta
+
+
+def save_cache(path, sources, version, arrays, meta=None):
+    """write a cache with its version and the stats and sha1 of its source files
+    """
+    meta = dict(meta or dict(), version=version, stats=source_stats(sources), sha1=source_digest(sources))
+    write_container(path, arrays, meta)
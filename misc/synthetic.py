@@ -0,0 +1,285 @@
+"""
+Synthetic scenes in the layout of the dataset, for benchmarks and tests without the data
+
+A scene is a row of rooms along x. The floor of every room is a rectilinear
+polygon with a straight front wall and a stepped back wall (corners >= 4,
+even), 2800 mm high, with door and window holes cut into random walls, and
+objects standing in the room. The outer wall surrounds all rooms.
+
+write_synthetic_scene writes annotation_3d.json, bbox_3d.json and, for every
+room, a panorama (camera_xyz.txt, layout.txt and ray-cast depth, semantic,
+instance and rgb images) and perspective camera_pose.txt files.
+"""
+import os
+import json
+
+import numpy as np
+
+from misc.panorama import coorx2u, coory2v, u2coorx, v2coory
+
+
+WALL_HEIGHT = 2800
+CAMERA_HEIGHT = 1400
+# gap between neighbouring rooms and between the rooms and the outer wall
+WALL_THICKNESS = 200
+ROOM_TYPES = ('living room', 'kitchen', 'bedroom', 'bathroom', 'study', 'corridor')
+# NYUv2 labels of the panorama pixels
+SEMANTIC_LABELS = {'wall': 1, 'floor': 2, 'ceiling': 22}
+
+
+class _Builder:
+    """junctions, lines and planes with their incidence, in the layout of annotation_3d.json
+    """
+
+    def __init__(self):
+        self.junctions, self.lines, self.planes, self.plane_lines = [], [], [], []
+        self.semantics = []
+
+    def junction(self, xyz):
+        self.junctions.append([float(c) for c in xyz])
+        return len(self.junctions) - 1
+
+    def line(self, start, end):
+        self.lines.append((start, end))
+        return len(self.lines) - 1
+
+    def loop(self, junctions):
+        return [self.line(a, b) for a, b in zip(junctions, np.roll(junctions, -1).tolist())]
+
+    def plane(self, plane_type, normal, point, lines):
+        normal = np.asarray(normal, dtype=np.float64)
+        self.planes.append({'ID': len(self.planes), 'type': plane_type, 'normal': normal.tolist(),
+                            'offset': float(-normal @ np.asarray(point, dtype=np.float64))})
+        self.plane_lines.append(list(lines))
+        return len(self.planes) - 1
+
+    def semantic(self, semantic_type, planes):
+        self.semantics.append({'ID': len(self.semantics), 'type': semantic_type, 'planeID': list(planes)})
+        return len(self.semantics) - 1
+
+    def annotation(self):
+        junctions = np.array(self.junctions)
+        lines = np.array(self.lines, dtype=np.int64).reshape(-1, 2)
+
+        plane_line = np.zeros((len(self.planes), len(lines)), dtype=np.int64)
+        for planeID, lineIDs in enumerate(self.plane_lines):
+            plane_line[planeID, lineIDs] = 1
+        line_junction = np.zeros((len(lines), len(junctions)), dtype=np.int64)
+        line_junction[np.arange(len(lines))[:, None], lines] = 1
+
+        return {
+            'junctions': [{'ID': i, 'coordinate': c} for i, c in enumerate(self.junctions)],
+            'lines': [{'ID': i, 'point': junctions[a].tolist(), 'direction': (junctions[b] - junctions[a]).tolist()}
+                      for i, (a, b) in enumerate(lines.tolist())],
+            'planes': self.planes,
+            'semantics': self.semantics,
+            'planeLineMatrix': plane_line.tolist(),
+            'lineJunctionMatrix': line_junction.tolist(),
+            'cuboids': [],
+            'manhattan': [],
+        }
+
+
+def room_polygon(rng, x0, x1, depth, corners=4):
+    """counter-clockwise floor polygon of a room: a straight front wall at y = 0
+    and a back wall with (corners - 4) / 2 steps
+    """
+    steps = max(corners // 2 - 1, 1)
+    jitter = np.r_[0, rng.uniform(-0.3, 0.3, steps - 1), 0]
+    xs = np.round(x0 + (np.arange(steps + 1) + jitter) * (x1 - x0) / steps)
+    ys = np.round(rng.uniform(0.6, 1.0, steps) * depth)
+
+    polygon = [(x0, 0), (x1, 0)]
+    for i in range(steps - 1, -1, -1):
+        polygon.append((xs[i + 1], ys[i]))
+        polygon.append((xs[i], ys[i]))
+    # merge the vertices of the steps of equal depth
+    return np.array([p for i, p in enumerate(polygon) if p != polygon[i - 1]], dtype=np.float64)
+
+
+def _walls(builder, floor_xy, normal_sign, holes=()):
+    """floor, ceiling and wall junctions and lines of a polygon, holes are
+    (wall index, semantic type, (t0, t1), (z0, z1)), returns the wall planes
+    and the planes of the holes
+    """
+    floor = [builder.junction([x, y, 0]) for x, y in floor_xy]
+    ceiling = [builder.junction([x, y, WALL_HEIGHT]) for x, y in floor_xy]
+    floor_lines, ceiling_lines = builder.loop(floor), builder.loop(ceiling)
+    vertical = [builder.line(f, c) for f, c in zip(floor, ceiling)]
+
+    holes_of_wall = {}
+    for wall, semantic_type, span, zs in holes:
+        holes_of_wall.setdefault(wall, []).append((semantic_type, span, zs))
+
+    walls, hole_planes = [], []
+    for i in range(len(floor_xy)):
+        j = (i + 1) % len(floor_xy)
+        p, q = floor_xy[i], floor_xy[j]
+        direction = (q - p) / np.linalg.norm(q - p)
+        normal = normal_sign * np.array([-direction[1], direction[0], 0])
+        lines = [floor_lines[i], ceiling_lines[i], vertical[i], vertical[j]]
+
+        for semantic_type, (t0, t1), (z0, z1) in holes_of_wall.get(i, []):
+            corners = [np.r_[p + t * direction, z] for t, z in [(t0, z0), (t1, z0), (t1, z1), (t0, z1)]]
+            hole_lines = builder.loop([builder.junction(c) for c in corners])
+            lines += hole_lines
+            hole_planes.append((semantic_type, builder.plane('wall', normal, corners[0], hole_lines)))
+
+        walls.append(builder.plane('wall', normal, np.r_[p, 0], lines))
+
+    return floor_lines, ceiling_lines, walls, hole_planes
+
+
+def _holes(rng, floor_xy, num_holes):
+    holes = []
+    lengths = np.linalg.norm(np.roll(floor_xy, -1, axis=0) - floor_xy, axis=1)
+    candidates = np.flatnonzero(lengths >= 1000)
+    for wall in rng.choice(candidates, min(num_holes, len(candidates)), replace=False) if len(candidates) else []:
+        width = min(900.0, 0.4 * lengths[wall])
+        t0 = np.round(rng.uniform(0.1 * lengths[wall], 0.9 * lengths[wall] - width))
+        semantic_type = 'door' if rng.random() < 0.5 else 'window'
+        zs = (50, 2100) if semantic_type == 'door' else (900, 2100)
+        holes.append((int(wall), semantic_type, (t0, t0 + width), zs))
+    return holes
+
+
+def synthetic_annotations(seed=0, num_rooms=4, corners=4, num_holes=2, num_objects=8):
+    """annotation_3d.json and bbox_3d.json contents of a random scene, and for
+    every room (semantic ID, floor polygon, camera center)
+    """
+    rng = np.random.default_rng(seed)
+    builder = _Builder()
+
+    widths = np.round(rng.uniform(3000, 6000, num_rooms))
+    depths = np.round(rng.uniform(3000, 6000, num_rooms))
+    starts = np.concatenate([[0], np.cumsum(widths + WALL_THICKNESS)[:-1]])
+
+    rooms, boxes = [], []
+    for x0, width, depth in zip(starts, widths, depths):
+        floor_xy = room_polygon(rng, x0, x0 + width, depth, corners)
+        floor_lines, ceiling_lines, walls, hole_planes = _walls(
+            builder, floor_xy, 1, _holes(rng, floor_xy, num_holes))
+
+        floor = builder.plane('floor', [0, 0, 1], [0, 0, 0], floor_lines)
+        ceiling = builder.plane('ceiling', [0, 0, -1], [0, 0, WALL_HEIGHT], ceiling_lines)
+        semanticID = builder.semantic(str(rng.choice(ROOM_TYPES)), [floor, ceiling] + walls)
+        for semantic_type, planeID in hole_planes:
+            builder.semantic(semantic_type, [planeID])
+
+        # the rectangle in front of the steps is inside the room
+        inner = np.array([[x0, 0], [x0 + width, floor_xy[:, 1][floor_xy[:, 1] > 0].min()]])
+        camera = np.r_[inner.mean(axis=0), CAMERA_HEIGHT]
+        rooms.append((semanticID, floor_xy, camera))
+
+        for _ in range(num_objects):
+            coeffs = rng.uniform(150, 500, 3)
+            margin = np.linalg.norm(coeffs[:2])
+            lower, upper = inner[0] + margin, inner[1] - margin
+            if np.any(lower >= upper):
+                continue
+            yaw = rng.uniform(0, np.pi)
+            basis = [[np.cos(yaw), np.sin(yaw), 0], [-np.sin(yaw), np.cos(yaw), 0], [0, 0, 1]]
+            centroid = np.r_[rng.uniform(lower, upper), coeffs[2]]
+            boxes.append({'ID': len(boxes), 'basis': basis, 'coeffs': coeffs.tolist(), 'centroid': centroid.tolist()})
+
+    # outer wall around all rooms, facing outwards
+    x1, y1 = starts[-1] + widths[-1] + WALL_THICKNESS, depths.max() + WALL_THICKNESS
+    outer_xy = np.array([[-WALL_THICKNESS, -WALL_THICKNESS], [x1, -WALL_THICKNESS], [x1, y1], [-WALL_THICKNESS, y1]])
+    _, _, outer_walls, _ = _walls(builder, outer_xy, -1)
+    builder.semantic('outwall', outer_walls)
+
+    return builder.annotation(), boxes, rooms
+
+
+def panorama_layout(floor_xy, camera, height=512, width=1024):
+    """layout.txt corners (ceiling and floor row of every corner, by column) of a room seen from camera
+    """
+    xyz = np.c_[floor_xy - camera[:2], np.zeros(len(floor_xy))]
+    u = np.arctan2(xyz[:, 0], xyz[:, 1])
+    distance = np.linalg.norm(xyz[:, :2], axis=1)
+    x = u2coorx(u, width)
+    y_ceiling = v2coory(-np.arctan((WALL_HEIGHT - camera[2]) / distance), height)
+    y_floor = v2coory(-np.arctan(-camera[2] / distance), height)
+
+    order = np.argsort(x)
+    cor_id = np.stack([np.repeat(x[order], 2), np.stack([y_ceiling[order], y_floor[order]], axis=1).ravel()], axis=1)
+    return cor_id
+
+
+def synthetic_panorama(floor_xy, camera, height=512, width=1024, seed=0):
+    """depth (range, mm), semantic, instance and rgb images of a room ray-cast from camera
+    """
+    u = coorx2u(np.arange(width, dtype=np.float64), width)
+    v = coory2v(np.arange(height, dtype=np.float64), height)
+
+    # horizontal distance to the nearest wall of every column
+    start = floor_xy - camera[:2]
+    edge = np.roll(floor_xy, -1, axis=0) - floor_xy
+    rays = np.stack([np.sin(u), np.cos(u)], axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = rays[:, None, 0] * edge[None, :, 1] - rays[:, None, 1] * edge[None, :, 0]
+        t = (start[None, :, 0] * edge[None, :, 1] - start[None, :, 1] * edge[None, :, 0]) / denominator
+        s = (start[None, :, 0] * rays[:, None, 1] - start[None, :, 1] * rays[:, None, 0]) / denominator
+    t[~((t > 0) & (s >= 0) & (s <= 1))] = np.inf
+    wall = t.min(axis=1)[None, :] / np.cos(v)[:, None]
+
+    up = -np.sin(v)[:, None]
+    with np.errstate(divide='ignore'):
+        plane = np.where(up > 0, (WALL_HEIGHT - camera[2]) / up, -camera[2] / up)
+    plane = np.broadcast_to(plane, wall.shape)
+
+    depth = np.minimum(wall, plane)
+    semantic = np.where(wall <= plane, SEMANTIC_LABELS['wall'],
+                        np.where(up > 0, SEMANTIC_LABELS['ceiling'], SEMANTIC_LABELS['floor'])).astype(np.uint8)
+
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(64, 255, (256, 3), dtype=np.uint8)
+    shade = np.clip(1.5 - depth / 8000, 0.3, 1)[..., None]
+    rgb = (palette[semantic] * shade).astype(np.uint8)
+
+    return {
+        'depth': np.clip(np.round(depth), 0, 65535).astype(np.uint16),
+        'semantic': semantic,
+        'instance': np.full((height, width), 65535, dtype=np.uint16),
+        'rgb': rgb,
+    }
+
+
+def write_synthetic_scene(root, scene, seed=0, num_rooms=4, corners=4, num_holes=2, num_objects=8,
+                          panoramas=True, positions=2, panorama_size=(512, 1024)):
+    """write a random scene as <root>/scene_<id>, see the module docstring
+    """
+    import cv2
+
+    annos, boxes, rooms = synthetic_annotations(seed, num_rooms, corners, num_holes, num_objects)
+    scene_path = os.path.join(root, f"scene_{scene:05d}")
+    os.makedirs(scene_path, exist_ok=True)
+    with open(os.path.join(scene_path, 'annotation_3d.json'), 'w') as f:
+        json.dump(annos, f)
+    with open(os.path.join(scene_path, 'bbox_3d.json'), 'w') as f:
+        json.dump(boxes, f)
+
+    rng = np.random.default_rng(seed)
+    for semanticID, floor_xy, camera in rooms:
+        room_path = os.path.join(scene_path, '2D_rendering', str(semanticID))
+
+        panorama_path = os.path.join(room_path, 'panorama')
+        os.makedirs(os.path.join(panorama_path, 'full'), exist_ok=True)
+        np.savetxt(os.path.join(panorama_path, 'camera_xyz.txt'), camera[None])
+        np.savetxt(os.path.join(panorama_path, 'layout.txt'),
+                   np.round(panorama_layout(floor_xy, camera, *panorama_size)), fmt='%d')
+        if panoramas:
+            images = synthetic_panorama(floor_xy, camera, *panorama_size, seed=seed)
+            for name, filename in [('depth', 'depth.png'), ('semantic', 'semantic.png'),
+                                   ('instance', 'instance.png'), ('rgb', 'rgb_rawlight.png')]:
+                cv2.imwrite(os.path.join(panorama_path, 'full', filename), images[name])
+
+        for position in range(positions):
+            yaw = rng.uniform(0, 2 * np.pi)
+            camera_info = np.r_[camera, np.sin(yaw), np.cos(yaw), rng.uniform(-0.3, 0.1), 0, 0, 1,
+                                0.698132, 0.440992, 1]
+            position_path = os.path.join(room_path, 'perspective', 'full', str(position))
+            os.makedirs(position_path, exist_ok=True)
+            np.savetxt(os.path.join(position_path, 'camera_pose.txt'), camera_info[None])
+
+    return scene_path
@@ -0,0 +1,168 @@
+"""
+Sparse topology index of the structure annotation (annotation_3d.json)
+"""
+import numpy as np
+
+
+def build_csr(rows, cols, num_rows):
+    """build CSR adjacency (indptr, indices) from (row, col) pairs
+    """
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+    cols = np.asarray(cols, dtype=np.int64).reshape(-1)
+    order = np.lexsort((cols, rows))
+    indices = cols[order].astype(np.int32)
+    indptr = np.zeros(num_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+    return indptr, indices
+
+
+def transpose_csr(indptr, indices, num_cols):
+    """transpose CSR adjacency, e.g. line->junctions into junction->lines
+    """
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return build_csr(indices, rows, num_cols)
+
+
+def nonzero_pairs(matrix):
+    """(row, col) pairs of the non-zero entries of a dense relationship matrix
+    """
+    matrix = np.asarray(matrix, dtype=np.uint8)
+    if matrix.ndim != 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.nonzero(matrix)
+
+
+class SceneTopology:
+    """CSR adjacency of planes, lines, junctions and semantics of one scene
+
+    The dense planeLineMatrix / lineJunctionMatrix are converted only once,
+    afterwards every lookup is O(degree) and returns a view of the index array.
+    """
+
+    def __init__(self, plane_line, line_junction, semantic_plane, num_junctions,
+                 semantic_types, semantic_ids):
+        self.plane_line = plane_line
+        self.line_junction = line_junction
+        self.semantic_plane = semantic_plane
+
+        self.num_planes = len(plane_line[0]) - 1
+        self.num_lines = len(line_junction[0]) - 1
+        self.num_junctions = num_junctions
+        self.num_semantics = len(semantic_plane[0]) - 1
+
+        self.line_plane = transpose_csr(*plane_line, self.num_lines)
+        self.junction_line = transpose_csr(*line_junction, num_junctions)
+        self.plane_semantic = transpose_csr(*semantic_plane, self.num_planes)
+
+        self.semantic_types = list(semantic_types)
+        self.semantic_ids = np.asarray(semantic_ids, dtype=np.int64)
+
+    @classmethod
+    def from_annos(cls, annos):
+        """build the topology from the json annotation
+        """
+        num_planes = len(annos['planes'])
+        num_lines = len(annos['lines'])
+        num_junctions = len(annos['junctions'])
+
+        planes, lines = nonzero_pairs(annos['planeLineMatrix'])
+        plane_line = build_csr(planes, lines, num_planes)
+
+        lines, junctions = nonzero_pairs(annos['lineJunctionMatrix'])
+        line_junction = build_csr(lines, junctions, num_lines)
+
+        semantics, planes = [], []
+        for index, semantic in enumerate(annos['semantics']):
+            semantics.extend([index] * len(semantic['planeID']))
+            planes.extend(semantic['planeID'])
+        semantic_plane = build_csr(semantics, planes, len(annos['semantics']))
+
+        return cls(plane_line, line_junction, semantic_plane, num_junctions,
+                   [semantic['type'] for semantic in annos['semantics']],
+                   [semantic['ID'] for semantic in annos['semantics']])
+
+    @staticmethod
+    def _row(csr, index):
+        indptr, indices = csr
+        return indices[indptr[index]:indptr[index + 1]]
+
+    @staticmethod
+    def _rows(csr, index):
+        indptr, indices = csr
+        index = np.asarray(index, dtype=np.int64).reshape(-1)
+        if len(index) == 0:
+            return np.zeros(0, dtype=indices.dtype)
+        return np.concatenate([indices[indptr[i]:indptr[i + 1]] for i in index])
+
+    def lines_of_plane(self, planeID):
+        return self._row(self.plane_line, planeID)
+
+    def planes_of_line(self, lineID):
+        return self._row(self.line_plane, lineID)
+
+    def junctions_of_line(self, lineID):
+        return self._row(self.line_junction, lineID)
+
+    def lines_of_junction(self, junctionID):
+        return self._row(self.junction_line, junctionID)
+
+    def planes_of_semantic(self, index):
+        return self._row(self.semantic_plane, index)
+
+    def semantics_of_plane(self, planeID):
+        return self._row(self.plane_semantic, planeID)
+
+    def lines_of_planes(self, planeIDs):
+        """unique lines on any of the given planes
+        """
+        return np.unique(self._rows(self.plane_line, planeIDs))
+
+    @property
+    def line_junctions(self):
+        """junction pairs of all lines as a (num_lines, 2) array
+        """
+        indptr, indices = self.line_junction
+        if not np.all(np.diff(indptr) == 2):
+            raise ValueError("every line must connect exactly two junctions")
+        return indices.reshape(-1, 2)
+
+    def junction_pairs(self, lineIDs):
+        """junction pairs of the given lines as a (N, 2) array
+        """
+        return self.line_junctions[np.asarray(lineIDs, dtype=np.int64)]
+
+    def plane_junction_pairs(self, planeID, exclude_lines=None):
+        """junction pairs of the boundary lines of a plane
+        """
+        lineIDs = self.lines_of_plane(planeID)
+        if exclude_lines is not None and len(exclude_lines):
+            lineIDs = np.setdiff1d(lineIDs, exclude_lines)
+        return self.junction_pairs(lineIDs)
+
+    def semantic_indices(self, types):
+        """indices of the semantics of the given types, e.g. ['door', 'window']
+        """
+        return [i for i, semantic_type in enumerate(self.semantic_types) if semantic_type in types]
+
+    def planes_of_types(self, types):
+        """unique planes belonging to the semantics of the given types
+        """
+        return np.unique(self._rows(self.semantic_plane, self.semantic_indices(types)))
+
+    def hole_lines(self):
+        """lines of the windows and doors
+        """
+        return self.lines_of_planes(self.planes_of_types(['window', 'door']))
+
+    def hole_junctions(self):
+        """junctions of the windows and doors
+        """
+        return np.unique(self.junction_pairs(self.hole_lines()))
+
+
+def get_topology(annos):
+    """topology of the scene, built once per annotation and shared by all consumers
+    """
+    if '_topology' not in annos:
+        annos['_topology'] = SceneTopology.from_annos(annos)
+    return annos['_topology']
@@ -24,7 +24,7 @@ def parse_camera_info(camera_info, height, width):
     xfov = camera_info[9]
     yfov = camera_info[10]
 
-    K = np.diag([1, 1, 1])
+    K = np.eye(3)
 
     K[0, 2] = width / 2
     K[1, 2] = height / 2
@@ -85,6 +85,35 @@ def get_corners_of_bb3d_no_index(basis, coeffs, centroid):
     return corners
 
 
+# signs of the basis vectors for the 8 corners, same order as get_corners_of_bb3d_no_index
+CORNER_SIGNS = np.array([
+    [-1, 1, 1],
+    [1, 1, 1],
+    [1, -1, 1],
+    [-1, -1, 1],
+    [-1, 1, -1],
+    [1, 1, -1],
+    [1, -1, -1],
+    [-1, -1, -1],
+], dtype=np.float64)
+
+
+def get_corners_of_bb3d_batch(basis, coeffs, centroid):
+    """
+    Batch version of get_corners_of_bb3d_no_index
+    Parameters
+    ----------
+    basis: N x 3 x 3 numpy array
+    coeffs: N x 3 numpy array
+    centroid: N x 3 numpy array
+    Returns
+    -------
+    corners: N x 8 x 3 numpy array
+    """
+    axes = np.asarray(basis) * np.abs(np.asarray(coeffs))[:, :, None]
+    return np.einsum('ki,nij->nkj', CORNER_SIGNS, axes) + np.asarray(centroid)[:, None, :]
+
+
 def project_3d_points_to_2d(points3d, R_ex, K):
     """
     Project 3d points from camera-centered coordinate to 2D image plane
@@ -111,6 +140,27 @@ def project_3d_points_to_2d(points3d, R_ex, K):
     return points2d
 
 
+def project_3d_points_to_2d_batch(points3d, R_ex, K):
+    """
+    Batch version of project_3d_points_to_2d
+    Parameters
+    ----------
+    points3d: ... x 3 numpy array
+        3d location of points in camera-centered coordinate
+    R_ex, K
+    Returns
+    -------
+    points2d: ... x 2 numpy array
+    """
+    points3d = np.asarray(points3d) @ R_ex.T
+    x3 = points3d[..., 0]
+    y3 = -points3d[..., 1]
+    z3 = np.abs(points3d[..., 2])
+    xx = x3 * K[0, 0] / z3 + K[0, 2]
+    yy = y3 * K[1, 1] / z3 + K[1, 2]
+    return np.stack((xx, yy), axis=-1)
+
+
 def project_struct_bdb_to_2d(basis, coeffs, center, R_ex, K):
     """
     Project 3d bounding box to 2d bounding box
@@ -0,0 +1,40 @@
+import argparse
+
+from misc.batch import parse_scenes
+from misc.manifest import open_manifest
+from misc.shards import list_views, pack_shards
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Structured3D Perspective View Shards")
+    parser.add_argument("--path", required=True,
+                        help="dataset path", metavar="DIR")
+    parser.add_argument("--output", required=True,
+                        help="output directory of the shards", metavar="DIR")
+    parser.add_argument("--scenes", default=None,
+                        help="scene ids and ranges, e.g. 0-2999, all scenes if not given", type=parse_scenes)
+    parser.add_argument("--config", choices=["full", "empty"], default="full",
+                        help="furniture configuration", type=str)
+    parser.add_argument("--shard_size", default=1024,
+                        help="approximate size of each shard in MB", type=int)
+    parser.add_argument("--workers", default=8,
+                        help="number of threads reading the views", type=int)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    scenes = args.scenes
+    if scenes is None:
+        manifest = open_manifest(args.path)
+        if manifest is None:
+            raise SystemExit("--scenes is required without a dataset manifest")
+        scenes = manifest.scenes(include_errata=False)
+
+    views = list_views(args.path, scenes, args.config)
+    pack_shards(views, args.output, args.shard_size << 20, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
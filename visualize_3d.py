@@ -1,9 +1,8 @@
 import os
-import json
+import sys
 import argparse
 
 import open3d
-import pymesh
 import numpy as np
 import matplotlib.pyplot as plt
 from shapely.geometry import Polygon
@@ -11,32 +10,29 @@ from descartes.patch import PolygonPatch
 
 from misc.figures import plot_coords
 from misc.colors import colormap_255, semantics_cmap
+from misc.topology import get_topology
+from misc.polygon import convert_lines_to_vertices
+from misc.plane_mesh import load_plane_meshes
+from misc.scene_cache import load_annotation_3d
+from misc.pointcloud import fuse_scene, save_cloud
+from misc.batch import add_batch_args, run_batch, show_figure, show_geometries, output_path
 
 
-def visualize_wireframe(annos):
-    """visualize wireframe
+def wireframe_geometries(annos):
+    """open3d junctions and lines of the wireframe
     """
     colormap = np.array(colormap_255) / 255
+    topology = get_topology(annos)
 
     junctions = np.array([item['coordinate'] for item in annos['junctions']])
-    _, junction_pairs = np.where(np.array(annos['lineJunctionMatrix']))
-    junction_pairs = junction_pairs.reshape(-1, 2)
+    junction_pairs = topology.line_junctions
 
     # extract hole lines
-    lines_holes = []
-    for semantic in annos['semantics']:
-        if semantic['type'] in ['window', 'door']:
-            for planeID in semantic['planeID']:
-                lines_holes.extend(np.where(np.array(annos['planeLineMatrix'][planeID]))[0].tolist())
-    lines_holes = np.unique(lines_holes)
+    lines_holes = topology.hole_lines()
 
     # extract cuboid lines
-    cuboid_lines = []
-    for cuboid in annos['cuboids']:
-        for planeID in cuboid['planeID']:
-            cuboid_lineID = np.where(np.array(annos['planeLineMatrix'][planeID]))[0].tolist()
-            cuboid_lines.extend(cuboid_lineID)
-    cuboid_lines = np.unique(cuboid_lines)
+    cuboid_planes = [planeID for cuboid in annos['cuboids'] for planeID in cuboid['planeID']]
+    cuboid_lines = topology.lines_of_planes(cuboid_planes)
     cuboid_lines = np.setdiff1d(cuboid_lines, lines_holes)
 
     # visualize junctions
@@ -63,143 +59,36 @@ def visualize_wireframe(annos):
     line_set.lines = open3d.utility.Vector2iVector(junction_pairs)
     line_set.colors = open3d.utility.Vector3dVector(line_colors)
 
-    open3d.visualization.draw_geometries([junction_set, line_set])
+    return [junction_set, line_set]
 
 
-def project(x, meta):
-    """ project 3D to 2D for polygon clipping
-    """
-    proj_axis = max(range(3), key=lambda i: abs(meta['normal'][i]))
-
-    return tuple(c for i, c in enumerate(x) if i != proj_axis)
-
-
-def project_inv(x, meta):
-    """ recover 3D points from 2D
-    """
-    # Returns the vector w in the walls' plane such that project(w) equals x.
-    proj_axis = max(range(3), key=lambda i: abs(meta['normal'][i]))
-
-    w = list(x)
-    w[proj_axis:proj_axis] = [0.0]
-    c = -meta['offset']
-    for i in range(3):
-        c -= w[i] * meta['normal'][i]
-    c /= meta['normal'][proj_axis]
-    w[proj_axis] = c
-    return tuple(w)
-
-
-def triangulate(points):
-    """ triangulate the plane for operation and visualization
+def visualize_wireframe(annos, args):
+    """visualize wireframe
     """
+    show_geometries(args, "wireframe", wireframe_geometries(annos))
 
-    num_points = len(points)
-    indices = np.arange(num_points, dtype=np.int)
-    segments = np.vstack((indices, np.roll(indices, -1))).T
-
-    tri = pymesh.triangle()
-    tri.points = np.array(points)
-
-    tri.segments = segments
-    tri.verbosity = 0
-    tri.run()
 
-    return tri.mesh
-
-
-def clip_polygon(polygons, vertices_hole, junctions, meta):
-    """ clip polygon the hole
+def visualize_pointcloud(annos, args):
+    """visualize the fused point cloud of the scene with the wireframe
     """
-    if len(polygons) == 1:
-        junctions = [junctions[vertex] for vertex in polygons[0]]
-        mesh_wall = triangulate(junctions)
-
-        vertices = np.array(mesh_wall.vertices)
-        faces = np.array(mesh_wall.faces)
-
-        return vertices, faces
-
-    else:
-        wall = []
-        holes = []
-        for polygon in polygons:
-            if np.any(np.intersect1d(polygon, vertices_hole)):
-                holes.append(polygon)
-            else:
-                wall.append(polygon)
-
-        # extract junctions on this plane
-        indices = []
-        junctions_wall = []
-        for plane in wall:
-            for vertex in plane:
-                indices.append(vertex)
-                junctions_wall.append(junctions[vertex])
+    grid = fuse_scene(args.path, args.scene, args.voxel_size, perspective=args.perspective,
+                      workers=args.threads)
+    cloud = grid.cloud()
 
-        junctions_holes = []
-        for plane in holes:
-            junctions_hole = []
-            for vertex in plane:
-                indices.append(vertex)
-                junctions_hole.append(junctions[vertex])
-            junctions_holes.append(junctions_hole)
+    if args.out is not None:
+        save_cloud(output_path(args, f"pointcloud.{args.cloud_format}"), cloud)
 
-        junctions_wall = [project(x, meta) for x in junctions_wall]
-        junctions_holes = [[project(x, meta) for x in junctions_hole] for junctions_hole in junctions_holes]
+    point_set = open3d.geometry.PointCloud()
+    point_set.points = open3d.utility.Vector3dVector(cloud['points'].astype(np.float64))
+    point_set.colors = open3d.utility.Vector3dVector(cloud['rgb'] / 255)
 
-        mesh_wall = triangulate(junctions_wall)
-
-        for hole in junctions_holes:
-            mesh_hole = triangulate(hole)
-            mesh_wall = pymesh.boolean(mesh_wall, mesh_hole, 'difference')
-
-        vertices = [project_inv(vertex, meta) for vertex in mesh_wall.vertices]
-
-        return vertices, np.array(mesh_wall.faces)
-
-
-def draw_geometries_with_back_face(geometries):
-    vis = open3d.visualization.Visualizer()
-    vis.create_window()
-    render_option = vis.get_render_option()
-    render_option.mesh_show_back_face = True
-    for geometry in geometries:
-        vis.add_geometry(geometry)
-    vis.run()
-    vis.destroy_window()
-
-
-def convert_lines_to_vertices(lines):
-    """convert line representation to polygon vertices
-    """
-    polygons = []
-    lines = np.array(lines)
-
-    polygon = None
-    while len(lines) != 0:
-        if polygon is None:
-            polygon = lines[0].tolist()
-            lines = np.delete(lines, 0, 0)
-
-        lineID, juncID = np.where(lines == polygon[-1])
-        vertex = lines[lineID[0], 1 - juncID[0]]
-        lines = np.delete(lines, lineID, 0)
-
-        if vertex in polygon:
-            polygons.append(polygon)
-            polygon = None
-        else:
-            polygon.append(vertex)
-
-    return polygons
+    show_geometries(args, "pointcloud", [point_set] + wireframe_geometries(annos))
 
 
 def visualize_plane(annos, args, eps=0.9):
     """visualize plane
     """
     colormap = np.array(colormap_255) / 255
-    junctions = [item['coordinate'] for item in annos['junctions']]
 
     if args.color == 'manhattan':
         manhattan = dict()
@@ -207,30 +96,12 @@ def visualize_plane(annos, args, eps=0.9):
             for planeID in planes['planeID']:
                 manhattan[planeID] = planes['ID']
 
-    # extract hole vertices
-    lines_holes = []
-    for semantic in annos['semantics']:
-        if semantic['type'] in ['window', 'door']:
-            for planeID in semantic['planeID']:
-                lines_holes.extend(np.where(np.array(annos['planeLineMatrix'][planeID]))[0].tolist())
-
-    lines_holes = np.unique(lines_holes)
-    _, vertices_holes = np.where(np.array(annos['lineJunctionMatrix'])[lines_holes])
-    vertices_holes = np.unique(vertices_holes)
-
-    # load polygons
-    polygons = []
-    for semantic in annos['semantics']:
-        for planeID in semantic['planeID']:
-            plane_anno = annos['planes'][planeID]
-            lineIDs = np.where(np.array(annos['planeLineMatrix'][planeID]))[0].tolist()
-            junction_pairs = [np.where(np.array(annos['lineJunctionMatrix'][lineID]))[0].tolist() for lineID in lineIDs]
-            polygon = convert_lines_to_vertices(junction_pairs)
-            vertices, faces = clip_polygon(polygon, vertices_holes, junctions, plane_anno)
-            polygons.append([vertices, faces, planeID, plane_anno['normal'], plane_anno['type'], semantic['type']])
+    # load the triangulated polygons, cached next to the annotations
+    meshes = load_plane_meshes(os.path.join(args.path, f"scene_{args.scene:05d}"), annos)
 
     plane_set = []
-    for i, (vertices, faces, planeID, normal, plane_type, semantic_type) in enumerate(polygons):
+    for vertices, faces, planeID, plane_type, semantic_type in meshes:
+        normal = annos['planes'][planeID]['normal']
         # ignore the room ceiling
         if plane_type == 'ceiling' and semantic_type not in ['door', 'window']:
             continue
@@ -264,10 +135,10 @@ def visualize_plane(annos, args, eps=0.9):
 
         plane_set.append(plane_vis)
 
-    draw_geometries_with_back_face(plane_set)
+    show_geometries(args, f"plane_{args.color}", plane_set, back_face=True)
 
 
-def plot_floorplan(annos, polygons):
+def plot_floorplan(annos, polygons, args):
     """plot floorplan
     """
     fig = plt.figure()
@@ -285,12 +156,14 @@ def plot_floorplan(annos, polygons):
 
     plt.axis('equal')
     plt.axis('off')
-    plt.show()
+    show_figure(args, "floorplan")
 
 
-def visualize_floorplan(annos):
+def visualize_floorplan(annos, args):
     """visualize floorplan
     """
+    topology = get_topology(annos)
+
     # extract the floor in each semantic for floorplan visualization
     planes = []
     for semantic in annos['semantics']:
@@ -302,12 +175,7 @@ def visualize_floorplan(annos):
             outerwall_planes = semantic['planeID']
 
     # extract hole vertices
-    lines_holes = []
-    for semantic in annos['semantics']:
-        if semantic['type'] in ['window', 'door']:
-            for planeID in semantic['planeID']:
-                lines_holes.extend(np.where(np.array(annos['planeLineMatrix'][planeID]))[0].tolist())
-    lines_holes = np.unique(lines_holes)
+    lines_holes = topology.hole_lines()
 
     # junctions on the floor
     junctions = np.array([junc['coordinate'] for junc in annos['junctions']])
@@ -316,16 +184,13 @@ def visualize_floorplan(annos):
     # construct each polygon
     polygons = []
     for plane in planes:
-        lineIDs = np.where(np.array(annos['planeLineMatrix'][plane['planeID']]))[0].tolist()
-        junction_pairs = [np.where(np.array(annos['lineJunctionMatrix'][lineID]))[0].tolist() for lineID in lineIDs]
+        junction_pairs = topology.plane_junction_pairs(plane['planeID'])
         polygon = convert_lines_to_vertices(junction_pairs)
         polygons.append([polygon[0], plane['type']])
 
     outerwall_floor = []
     for planeID in outerwall_planes:
-        lineIDs = np.where(np.array(annos['planeLineMatrix'][planeID]))[0].tolist()
-        lineIDs = np.setdiff1d(lineIDs, lines_holes)
-        junction_pairs = [np.where(np.array(annos['lineJunctionMatrix'][lineID]))[0].tolist() for lineID in lineIDs]
+        junction_pairs = topology.plane_junction_pairs(planeID, exclude_lines=lines_holes)
         for start, end in junction_pairs:
             if start in junction_floor and end in junction_floor:
                 outerwall_floor.append([start, end])
@@ -333,35 +198,49 @@ def visualize_floorplan(annos):
     outerwall_polygon = convert_lines_to_vertices(outerwall_floor)
     polygons.append([outerwall_polygon[0], 'outwall'])
 
-    plot_floorplan(annos, polygons)
+    plot_floorplan(annos, polygons, args)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Structured3D 3D Visualization")
     parser.add_argument("--path", required=True,
                         help="dataset path", metavar="DIR")
-    parser.add_argument("--scene", required=True,
-                        help="scene id", type=int)
-    parser.add_argument("--type", choices=("floorplan", "wireframe", "plane"),
+    parser.add_argument("--type", choices=("floorplan", "wireframe", "plane", "pointcloud"),
                         default="plane", type=str)
     parser.add_argument("--color", choices=["normal", "manhattan"],
                         default="normal", type=str)
+    parser.add_argument("--voxel_size", default=20,
+                        help="voxel size of the point cloud in millimeters", type=float)
+    parser.add_argument("--perspective", action='store_true',
+                        help="also fuse the perspective views into the point cloud")
+    parser.add_argument("--cloud_format", choices=["ply", "npz"], default="ply",
+                        help="format of the point cloud written with --out")
+    parser.add_argument("--threads", default=4,
+                        help="number of views back-projected in parallel", type=int)
+    add_batch_args(parser)
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-
-    # load annotations from json
-    with open(os.path.join(args.path, f"scene_{args.scene:05d}", "annotation_3d.json")) as file:
-        annos = json.load(file)
+def visualize_scene(args):
+    # load annotations from json, or from the binary cache if available
+    annos = load_annotation_3d(os.path.join(args.path, f"scene_{args.scene:05d}"))
 
     if args.type == "wireframe":
-        visualize_wireframe(annos)
+        visualize_wireframe(annos, args)
     elif args.type == "plane":
         visualize_plane(annos, args)
     elif args.type == "floorplan":
-        visualize_floorplan(annos)
+        visualize_floorplan(annos, args)
+    elif args.type == "pointcloud":
+        visualize_pointcloud(annos, args)
+
+
+def main():
+    args = parse_args()
+
+    task = f"plane_{args.color}" if args.type == "plane" else args.type
+    failed = run_batch(visualize_scene, args, task)
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
@@ -1,70 +1,68 @@
 import os
-import json
+import sys
 import argparse
 
 import cv2
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 
-from misc.utils import get_corners_of_bb3d_no_index, project_3d_points_to_2d, parse_camera_info
+from misc.utils import get_corners_of_bb3d_batch, project_3d_points_to_2d_batch, parse_camera_info
+from misc.scene_cache import load_bbox_arrays
+from misc.instances import instance_ids
+from misc.batch import add_batch_args, run_batch, show_figure
+from misc.manifest import list_rooms, list_positions
+from misc.storage import imread, loadtxt
 
 
 def visualize_bbox(args):
-    with open(os.path.join(args.path, f"scene_{args.scene:05d}", "bbox_3d.json")) as file:
-        annos = json.load(file)
+    ids, basis, coeffs, centroid = load_bbox_arrays(os.path.join(args.path, f"scene_{args.scene:05d}"))
 
-    id2index = dict()
-    for index, object in enumerate(annos):
-        id2index[object.get('ID')] = index
+    # corners of all the objects in the scene, computed once and shared by all views
+    corners_scene = get_corners_of_bb3d_batch(basis, coeffs, centroid)
+
+    # the last entry is -1 and catches every instance without a bounding box
+    id2index = np.full(ids.max() + 2 if len(ids) else 1, -1, dtype=np.int64)
+    id2index[ids] = np.arange(len(ids))
 
     scene_path = os.path.join(args.path, f"scene_{args.scene:05d}", "2D_rendering")
 
-    for room_id in np.sort(os.listdir(scene_path)):
+    for room_id in list_rooms(args.path, args.scene):
         room_path = os.path.join(scene_path, room_id, "perspective", "full")
 
-        if not os.path.exists(room_path):
-            continue
-
-        for position_id in np.sort(os.listdir(room_path)):
+        for position_id in list_positions(args.path, args.scene, room_id):
             position_path = os.path.join(room_path, position_id)
 
-            image = cv2.imread(os.path.join(position_path, 'rgb_rawlight.png'))
+            image = imread(os.path.join(position_path, 'rgb_rawlight.png'))
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
             height, width, _ = image.shape
 
-            instance = cv2.imread(os.path.join(position_path, 'instance.png'), cv2.IMREAD_UNCHANGED)
+            instance = imread(os.path.join(position_path, 'instance.png'), cv2.IMREAD_UNCHANGED)
 
-            camera_info = np.loadtxt(os.path.join(position_path, 'camera_pose.txt'))
+            camera_info = loadtxt(os.path.join(position_path, 'camera_pose.txt'))
 
             rot, trans, K = parse_camera_info(camera_info, height, width)
 
             plt.figure()
             plt.imshow(image)
 
-            for index in np.unique(instance)[:-1]:
-                # for each instance in current image
-                bbox = annos[id2index[index]]
-
-                basis = np.array(bbox['basis'])
-                coeffs = np.array(bbox['coeffs'])
-                centroid = np.array(bbox['centroid'])
-
-                corners = get_corners_of_bb3d_no_index(basis, coeffs, centroid)
-                corners = corners - trans
+            # project all the instances in current image at once
+            index = instance_ids(instance)
+            index = id2index[np.minimum(index, len(id2index) - 1)]
+            index = index[index >= 0]
 
-                gt2dcorners = project_3d_points_to_2d(corners, rot, K)
+            gt2dcorners = project_3d_points_to_2d_batch(corners_scene[index] - trans, rot, K)
 
-                num_corner = gt2dcorners.shape[1] // 2
-                plt.plot(np.hstack((gt2dcorners[0, :num_corner], gt2dcorners[0, 0])),
-                         np.hstack((gt2dcorners[1, :num_corner], gt2dcorners[1, 0])), 'r')
-                plt.plot(np.hstack((gt2dcorners[0, num_corner:], gt2dcorners[0, num_corner])),
-                         np.hstack((gt2dcorners[1, num_corner:], gt2dcorners[1, num_corner])), 'b')
-                for i in range(num_corner):
-                    plt.plot(gt2dcorners[0, [i, i + num_corner]], gt2dcorners[1, [i, i + num_corner]], 'y')
+            top, bottom = gt2dcorners[:, :4], gt2dcorners[:, 4:]
+            ax = plt.gca()
+            for start, end, color in [(top, np.roll(top, -1, axis=1), 'r'),
+                                      (bottom, np.roll(bottom, -1, axis=1), 'b'),
+                                      (top, bottom, 'y')]:
+                ax.add_collection(LineCollection(np.stack((start, end), axis=2).reshape(-1, 2, 2), colors=color))
 
             plt.axis('off')
             plt.axis([0, width, height, 0])
-            plt.show()
+            show_figure(args, f"{room_id}_{position_id}_bbox")
 
 
 def parse_args():
@@ -72,15 +70,15 @@ def parse_args():
         description="Structured3D 3D Bounding Box Visualization")
     parser.add_argument("--path", required=True,
                         help="dataset path", metavar="DIR")
-    parser.add_argument("--scene", required=True,
-                        help="scene id", type=int)
+    add_batch_args(parser)
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
 
-    visualize_bbox(args)
+    failed = run_batch(visualize_bbox, args, "bbox")
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":
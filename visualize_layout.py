@@ -1,5 +1,5 @@
 import os
-import json
+import sys
 import argparse
 
 import cv2
@@ -8,8 +8,12 @@ import matplotlib.pyplot as plt
 from shapely.geometry import Polygon
 from descartes.patch import PolygonPatch
 
+from misc import profiling
 from misc.panorama import draw_boundary_from_cor_id
 from misc.colors import colormap_255
+from misc.batch import add_batch_args, run_batch, show_figure
+from misc.manifest import list_rooms, list_positions
+from misc.storage import imread, loadtxt, load_json
 
 
 def visualize_panorama(args):
@@ -17,17 +21,19 @@ def visualize_panorama(args):
     """
     scene_path = os.path.join(args.path, f"scene_{args.scene:05d}", "2D_rendering")
 
-    for room_id in np.sort(os.listdir(scene_path)):
+    for room_id in list_rooms(args.path, args.scene):
         room_path = os.path.join(scene_path, room_id, "panorama")
 
-        cor_id = np.loadtxt(os.path.join(room_path, "layout.txt"))
-        img_src = cv2.imread(os.path.join(room_path, "full", "rgb_rawlight.png"))
+        cor_id = loadtxt(os.path.join(room_path, "layout.txt"))
+        img_src = imread(os.path.join(room_path, "full", "rgb_rawlight.png"))
         img_src = cv2.cvtColor(img_src, cv2.COLOR_BGR2RGB)
-        img_viz = draw_boundary_from_cor_id(cor_id, img_src)
+        with profiling.stage('draw_boundary'):
+            img_viz = draw_boundary_from_cor_id(cor_id, img_src)
 
+        plt.figure()
         plt.axis('off')
         plt.imshow(img_viz)
-        plt.show()
+        show_figure(args, f"{room_id}_panorama_layout")
 
 
 def visualize_perspective(args):
@@ -37,20 +43,16 @@ def visualize_perspective(args):
 
     scene_path = os.path.join(args.path, f"scene_{args.scene:05d}", "2D_rendering")
 
-    for room_id in np.sort(os.listdir(scene_path)):
+    for room_id in list_rooms(args.path, args.scene):
         room_path = os.path.join(scene_path, room_id, "perspective", "full")
 
-        if not os.path.exists(room_path):
-            continue
-
-        for position_id in np.sort(os.listdir(room_path)):
+        for position_id in list_positions(args.path, args.scene, room_id):
             position_path = os.path.join(room_path, position_id)
 
-            image = cv2.imread(os.path.join(position_path, "rgb_rawlight.png"))
+            image = imread(os.path.join(position_path, "rgb_rawlight.png"))
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-            with open(os.path.join(position_path, "layout.json")) as f:
-                annos = json.load(f)
+            annos = load_json(os.path.join(position_path, "layout.json"))
 
             fig = plt.figure()
             for i, key in enumerate(['amodal_mask', 'visible_mask']):
@@ -66,28 +68,32 @@ def visualize_perspective(args):
                             ax.add_patch(patch)
 
                 plt.title(key)
-            plt.show()
+            show_figure(args, f"{room_id}_{position_id}_layout", fig)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Structured3D 2D Layout Visualization")
     parser.add_argument("--path", required=True,
                         help="dataset path", metavar="DIR")
-    parser.add_argument("--scene", required=True,
-                        help="scene id", type=int)
     parser.add_argument("--type", choices=["perspective", "panorama"], required=True,
                         help="type of camera", type=str)
+    add_batch_args(parser)
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-
+def visualize_layout(args):
     if args.type == 'panorama':
         visualize_panorama(args)
     elif args.type == 'perspective':
         visualize_perspective(args)
 
 
+def main():
+    args = parse_args()
+
+    failed = run_batch(visualize_layout, args, f"{args.type}_layout")
+    sys.exit(1 if failed else 0)
+
+
 if __name__ == "__main__":
     main()
@@ -1,44 +1,155 @@
 import os
-import json
+import sys
+import copy
 import argparse
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 import cv2
-import open3d
 import numpy as np
-from panda3d.core import Triangulator
 
+from misc import profiling
 from misc.panorama import xyz_2_coorxy
-from visualize_3d import convert_lines_to_vertices
+from misc.topology import get_topology
+from misc.scene_cache import load_annotation_3d
+from misc.polygon import convert_lines_to_vertices
+from misc.atlas import pack_rectangles
+from misc.batch import add_batch_args, run_batch, show_geometries, output_path
+from misc.meshio import FORMATS, open_writer
+from misc.manifest import list_rooms
+from misc.storage import imread, loadtxt
+
+
+# remap maps of E2P, keyed on the quantized geometry relative to the camera
+E2P_CACHE = OrderedDict()
+E2P_CACHE_SIZE = 1024
+E2P_LOCK = threading.Lock()
+
+
+def E2P_grid(corner_i, corner_j, wall_height, camera_height, resolution=512, is_wall=True,
+             height=512, width=1024):
+    """float32 panorama coordinates sampled for the perspective image,
+    the corners are relative to the camera, resolution is a size or (width, height)
+    """
+    res_w, res_h = (resolution, resolution) if np.isscalar(resolution) else resolution
+    corner_i = np.asarray(corner_i, dtype=np.float32)
+    corner_j = np.asarray(corner_j, dtype=np.float32)
+    camera_height = np.float32(camera_height)
+
+    if is_wall:
+        xs = np.linspace(corner_i[0], corner_j[0], res_w, dtype=np.float32)[None]
+        ys = np.linspace(corner_i[1], corner_j[1], res_w, dtype=np.float32)[None]
+        zs = np.linspace(-camera_height, wall_height - camera_height, res_h, dtype=np.float32)[:, None]
+    else:
+        xs = np.linspace(corner_i[0], corner_j[0], res_w, dtype=np.float32)[None]
+        ys = np.linspace(corner_i[1], corner_j[1], res_h, dtype=np.float32)[:, None]
+        zs = np.float32(wall_height) - camera_height
+
+    coorx, coory = xyz_2_coorxy(xs, ys, zs, H=height, W=width)
+
+    shape = (res_h, res_w)
+    coorx = np.ascontiguousarray(np.broadcast_to(coorx, shape), dtype=np.float32)
+    coory = np.ascontiguousarray(np.broadcast_to(coory, shape), dtype=np.float32)
+    return coorx, coory
+
+
+def E2P_maps(corner_i, corner_j, wall_height, camera, resolution=512, is_wall=True,
+             height=512, width=1024, quantization=1.0):
+    """fixed-point remap maps (cv2.convertMaps) of E2P, cached on the geometry
+    relative to the camera quantized to the given step in millimeters
+    """
+    quantized = np.round(np.concatenate([
+        np.asarray(corner_i[:2]) - camera[:2], np.asarray(corner_j[:2]) - camera[:2],
+        [wall_height, camera[-1]]]) / quantization).astype(np.int64)
+    key = tuple(quantized.tolist()) + (resolution if np.isscalar(resolution) else tuple(resolution),
+                                       is_wall, height, width)
+
+    with E2P_LOCK:
+        if key in E2P_CACHE:
+            E2P_CACHE.move_to_end(key)
+            return E2P_CACHE[key]
+
+    # the maps only depend on the quantized geometry, whatever is cached
+    quantized = quantized * quantization
+    coorx, coory = E2P_grid(quantized[0:2], quantized[2:4], quantized[4], quantized[5],
+                            resolution, is_wall, height, width)
+    maps = cv2.convertMaps(coorx, coory, cv2.CV_16SC2)
+
+    with E2P_LOCK:
+        E2P_CACHE[key] = maps
+        if len(E2P_CACHE) > E2P_CACHE_SIZE:
+            E2P_CACHE.popitem(last=False)
+    return maps
 
 
 def E2P(image, corner_i, corner_j, wall_height, camera, resolution=512, is_wall=True):
     """convert panorama to persepctive image
     """
-    corner_i = corner_i - camera
-    corner_j = corner_j - camera
+    map1, map2 = E2P_maps(corner_i, corner_j, wall_height, camera, resolution, is_wall,
+                          image.shape[0], image.shape[1])
 
-    if is_wall:
-        xs = np.linspace(corner_i[0], corner_j[0], resolution)[None].repeat(resolution, 0)
-        ys = np.linspace(corner_i[1], corner_j[1], resolution)[None].repeat(resolution, 0)
-        zs = np.linspace(-camera[-1], wall_height - camera[-1], resolution)[:, None].repeat(resolution, 1)
-    else:
-        xs = np.linspace(corner_i[0], corner_j[0], resolution)[None].repeat(resolution, 0)
-        ys = np.linspace(corner_i[1], corner_j[1], resolution)[:, None].repeat(resolution, 1)
-        zs = np.zeros_like(xs) + wall_height - camera[-1]
+    persp = cv2.remap(image, map1, map2, cv2.INTER_CUBIC, borderMode=cv2.BORDER_WRAP)
 
-    coorx, coory = xyz_2_coorxy(xs, ys, zs)
+    return persp
 
-    persp = cv2.remap(image, coorx.astype(np.float32), coory.astype(np.float32), 
-                      cv2.INTER_CUBIC, borderMode=cv2.BORDER_WRAP)
 
-    return persp
+def texture_size(length, height, texel_size=10, max_size=4096, padding=2):
+    """(width, height) in pixels of the texture of a plane from its physical size in millimeters
+    """
+    size = np.maximum(np.round(np.array([length, height]) / texel_size), 1)
+    # shrink the planes which do not fit into an atlas
+    scale = min(1, (max_size - padding) / size.max())
+    return tuple(np.maximum(np.floor(size * scale), 1).astype(int).tolist())
 
 
-def create_plane_mesh(vertices, vertices_floor, textures, texture_floor, texture_ceiling,
-    delta_height, ignore_ceiling=False):
-    # create mesh for 3D floorplan visualization
+def E2P_atlas(image, planes, sizes, camera, max_size=4096, padding=2):
+    """convert panorama to the persepctive images of many planes packed into texture atlases,
+    planes is a list of (corner_i, corner_j, wall_height, is_wall) and sizes their (width, height)
+
+    The fixed-point maps of the planes are placed into the maps of each atlas,
+    which is then sampled by a single remap. Returns the atlases and the
+    placement (atlas, x, y, width, height) of every plane.
+    """
+    placements, atlas_sizes = pack_rectangles(sizes, max_size, padding)
+
+    maps = [(np.zeros((atlas_h, atlas_w, 2), dtype=np.int16), np.zeros((atlas_h, atlas_w), dtype=np.uint16))
+            for atlas_w, atlas_h in atlas_sizes]
+    with profiling.stage('E2P_maps'):
+        for (corner_i, corner_j, wall_height, is_wall), size, (index, x, y) in zip(planes, sizes, placements):
+            map1, map2 = E2P_maps(corner_i, corner_j, wall_height, camera, size, is_wall,
+                                  image.shape[0], image.shape[1])
+            # extend the borders into the padding, so that filtering does not bleed
+            map1 = np.pad(map1, ((0, padding), (0, padding), (0, 0)), mode='edge')
+            map2 = np.pad(map2, ((0, padding), (0, padding)), mode='edge')
+            maps[index][0][y:y + map1.shape[0], x:x + map1.shape[1]] = map1
+            maps[index][1][y:y + map2.shape[0], x:x + map2.shape[1]] = map2
+
+    with profiling.stage('E2P_remap'):
+        atlases = [cv2.remap(image, map1, map2, cv2.INTER_CUBIC, borderMode=cv2.BORDER_WRAP) for map1, map2 in maps]
+
+    placements = np.concatenate([placements, np.array(sizes, dtype=np.int64).reshape(-1, 2)], axis=1)
+    return atlases, placements
+
+
+def atlas_uvs(uvs, placement, atlases):
+    """map uvs of a plane texture into the atlas holding it
+    """
+    index, x, y, width, height = placement
+    atlas_h, atlas_w = atlases[index].shape[:2]
+    return np.stack([(x + uvs[:, 0] * width) / atlas_w, (y + uvs[:, 1] * height) / atlas_h], axis=1)
+
+
+def create_plane_arrays(vertices, vertices_floor, atlases, placements, delta_height, ignore_ceiling=False):
+    # create vertices, triangles, per-vertex uvs and per-triangle atlas index for 3D floorplan visualization
+    # placements are those of the walls, the floor and the ceiling in the atlases
+    # panda3d is only needed here, so that E2P and the atlases can be used without it
+    from panda3d.core import Triangulator
+
     triangles = []
     triangle_uvs = []
+    material_ids = []
 
     # the number of vertical walls
     num_walls = len(vertices)
@@ -49,18 +160,11 @@ def create_plane_mesh(vertices, vertices_floor, textures, texture_floor, texture
         # hardcode triangles for each vertical wall
         triangle = np.array([[0, 2, 1], [2, 0, 3]])
         triangles.append(triangle + num_vertices)
+        material_ids.append(np.full(len(triangle), placements[i][0]))
         num_vertices += 4
 
-        triangle_uv = np.array(
-            [
-                [i / (num_walls + 2), 0], 
-                [i / (num_walls + 2), 1], 
-                [(i+1) / (num_walls + 2), 1], 
-                [(i+1) / (num_walls + 2), 0]
-            ],
-            dtype=np.float32
-        )
-        triangle_uvs.append(triangle_uv)
+        triangle_uv = np.array([[0, 0], [0, 1], [1, 1], [1, 0]], dtype=np.float32)
+        triangle_uvs.append(atlas_uvs(triangle_uv, placements[i], atlases))
 
     # 2. floor and ceiling
     # Since the floor and ceiling may not be a rectangle, triangulate the polygon first.
@@ -81,9 +185,11 @@ def create_plane_mesh(vertices, vertices_floor, textures, texture_floor, texture
 
     # add triangles for floor and ceiling
     triangles.append(triangle + num_vertices)
+    material_ids.append(np.full(len(triangle), placements[num_walls][0]))
     num_vertices += len(np.unique(triangle))
     if not ignore_ceiling:
         triangles.append(triangle + num_vertices)
+        material_ids.append(np.full(len(triangle), placements[num_walls + 1][0]))
 
     # texture for floor and ceiling
     vertices_floor_min = np.min(vertices_floor[:, :2], axis=0)
@@ -91,15 +197,9 @@ def create_plane_mesh(vertices, vertices_floor, textures, texture_floor, texture
     
     # normalize to [0, 1]
     triangle_uv = (vertices_floor[:, :2] - vertices_floor_min) / (vertices_floor_max - vertices_floor_min)
-    triangle_uv[:, 0] = (triangle_uv[:, 0] + num_walls) / (num_walls + 2) 
-
-    triangle_uvs.append(triangle_uv)
-
-    # normalize to [0, 1]
-    triangle_uv = (vertices_floor[:, :2] - vertices_floor_min) / (vertices_floor_max - vertices_floor_min)
-    triangle_uv[:, 0] = (triangle_uv[:, 0] + num_walls + 1) / (num_walls + 2)
 
-    triangle_uvs.append(triangle_uv)
+    triangle_uvs.append(atlas_uvs(triangle_uv, placements[num_walls], atlases))
+    triangle_uvs.append(atlas_uvs(triangle_uv, placements[num_walls + 1], atlases))
 
     # 3. Merge wall, floor, and ceiling
     vertices.append(vertices_floor)
@@ -107,24 +207,36 @@ def create_plane_mesh(vertices, vertices_floor, textures, texture_floor, texture
     vertices = np.concatenate(vertices, axis=0)
 
     triangles = np.concatenate(triangles, axis=0)
-
-    textures.append(texture_floor)
-    textures.append(texture_ceiling)
-    textures = np.concatenate(textures, axis=1)
+    material_ids = np.concatenate(material_ids, axis=0).astype(np.int32)
 
     triangle_uvs = np.concatenate(triangle_uvs, axis=0)
 
+    return vertices, triangles, triangle_uvs, material_ids
+
+
+def create_open3d_mesh(vertices, triangles, triangle_uvs, atlases, material_ids):
+    # create open3d mesh from the arrays of create_plane_arrays
+    import open3d
+
     mesh = open3d.geometry.TriangleMesh(
         vertices=open3d.utility.Vector3dVector(vertices),
         triangles=open3d.utility.Vector3iVector(triangles)
     )
     mesh.compute_vertex_normals()
 
-    mesh.texture = open3d.geometry.Image(textures)
-    mesh.triangle_uvs = np.array(triangle_uvs[triangles.reshape(-1), :], dtype=np.float64)
+    mesh.textures = [open3d.geometry.Image(atlas) for atlas in atlases]
+    mesh.triangle_material_ids = open3d.utility.IntVector(material_ids.tolist())
+    mesh.triangle_uvs = open3d.utility.Vector2dVector(triangle_uvs[triangles.reshape(-1), :].astype(np.float64))
     return mesh
 
 
+def create_plane_mesh(vertices, vertices_floor, atlases, placements, delta_height, ignore_ceiling=False):
+    # create mesh for 3D floorplan visualization
+    vertices, triangles, triangle_uvs, material_ids = create_plane_arrays(
+        vertices, vertices_floor, atlases, placements, delta_height, ignore_ceiling)
+    return create_open3d_mesh(vertices, triangles, triangle_uvs, atlases, material_ids)
+
+
 def verify_normal(corner_i, corner_j, delta_height, plane_normal):
     edge_a = corner_j + delta_height - corner_i
     edge_b = delta_height
@@ -140,39 +252,35 @@ def verify_normal(corner_i, corner_j, delta_height, plane_normal):
         return True
     
 
-def visualize_mesh(args):
-    """visualize as water-tight mesh
+def load_room(path, scene, room):
+    """panorama (RGB) and camera center of a room
     """
-
-    image = cv2.imread(os.path.join(args.path, f"scene_{args.scene:05d}", "2D_rendering", 
-                                    str(args.room), "panorama/full/rgb_rawlight.png"))
+    image = imread(os.path.join(path, f"scene_{scene:05d}", "2D_rendering", 
+                                    str(room), "panorama/full/rgb_rawlight.png"))
     image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
 
-    # load room annotations
-    with open(os.path.join(args.path, f"scene_{args.scene:05d}" , "annotation_3d.json")) as f:
-        annos = json.load(f)
-
     # load camera info
-    camera_center = np.loadtxt(os.path.join(args.path, f"scene_{args.scene:05d}", "2D_rendering", 
-                                            str(args.room), "panorama", "camera_xyz.txt"))
+    camera_center = loadtxt(os.path.join(path, f"scene_{scene:05d}", "2D_rendering", 
+                                            str(room), "panorama", "camera_xyz.txt"))
+
+    return image, camera_center
+
+
+def room_mesh_arrays(annos, image, camera_center, room, ignore_ceiling=False, texel_size=10, atlas_size=4096):
+    """vertices, triangles, per-vertex uvs, texture atlases and per-triangle atlas index
+    of the water-tight mesh of a room
+    """
+    topology = get_topology(annos)
 
     # parse corners
     junctions = np.array([item['coordinate'] for item in annos['junctions']])
-    lines_holes = []
-    for semantic in annos['semantics']:
-        if semantic['type'] in ['window', 'door']:
-            for planeID in semantic['planeID']:
-                lines_holes.extend(np.where(np.array(annos['planeLineMatrix'][planeID]))[0].tolist())
-
-    lines_holes = np.unique(lines_holes)
-    _, vertices_holes = np.where(np.array(annos['lineJunctionMatrix'])[lines_holes])
-    vertices_holes = np.unique(vertices_holes)
+    lines_holes = topology.hole_lines()
 
     # parse annotations
     walls = dict()
     walls_normal = dict()
     for semantic in annos['semantics']:
-        if semantic['ID'] != int(args.room):
+        if semantic['ID'] != int(room):
             continue
 
         # find junctions of ceiling and floor 
@@ -180,9 +288,7 @@ def visualize_mesh(args):
             plane_anno = annos['planes'][planeID]
 
             if plane_anno['type'] != 'wall':
-                lineIDs = np.where(np.array(annos['planeLineMatrix'][planeID]))[0]
-                lineIDs = np.setdiff1d(lineIDs, lines_holes)
-                junction_pairs = [np.where(np.array(annos['lineJunctionMatrix'][lineID]))[0].tolist() for lineID in lineIDs]
+                junction_pairs = topology.plane_junction_pairs(planeID, exclude_lines=lines_holes)
                 wall = convert_lines_to_vertices(junction_pairs)
                 walls[plane_anno['type']] = wall[0]
         
@@ -191,9 +297,7 @@ def visualize_mesh(args):
             plane_anno = annos['planes'][planeID]
 
             if plane_anno['type'] == 'wall':
-                lineIDs = np.where(np.array(annos['planeLineMatrix'][planeID]))[0]
-                lineIDs = np.setdiff1d(lineIDs, lines_holes)
-                junction_pairs = [np.where(np.array(annos['lineJunctionMatrix'][lineID]))[0].tolist() for lineID in lineIDs]
+                junction_pairs = topology.plane_junction_pairs(planeID, exclude_lines=lines_holes)
                 wall = convert_lines_to_vertices(junction_pairs)
                 walls_normal[tuple(np.intersect1d(wall, walls['floor']))] = plane_anno['normal']
 
@@ -205,7 +309,8 @@ def visualize_mesh(args):
     wall_floor = walls['floor']
 
     corners = []    # 3D coordinate for each wall
-    textures = []   # texture for each wall
+    planes = []     # geometry of the texture of each wall
+    sizes = []      # texture size of each wall
 
     # wall
     for i, j in zip(wall_floor, np.roll(wall_floor, shift=-1)):
@@ -216,46 +321,127 @@ def visualize_mesh(args):
         if flip:
             corner_j, corner_i = corner_i, corner_j
 
-        texture = E2P(image, corner_i, corner_j, wall_height, camera_center)
+        planes.append((corner_i, corner_j, wall_height, True))
+        sizes.append(texture_size(np.linalg.norm(corner_j - corner_i), wall_height, texel_size, atlas_size))
 
         corner = np.array([corner_i, corner_i + delta_height, corner_j + delta_height, corner_j])
 
         corners.append(corner)
-        textures.append(texture)
 
     # floor and ceiling
     # the floor/ceiling texture is cropped by the maximum bounding box
     corner_floor = junctions[wall_floor]
     corner_min = np.min(corner_floor, axis=0)
     corner_max = np.max(corner_floor, axis=0)
-    texture_floor = E2P(image, corner_min, corner_max, 0, camera_center, is_wall=False)
-    texture_ceiling = E2P(image, corner_min, corner_max, wall_height, camera_center, is_wall=False)
+    planes.append((corner_min, corner_max, 0, False))
+    planes.append((corner_min, corner_max, wall_height, False))
+    sizes += [texture_size(*(corner_max - corner_min)[:2], texel_size, atlas_size)] * 2
+
+    # texture of all walls, floor and ceiling packed into atlases
+    atlases, placements = E2P_atlas(image, planes, sizes, camera_center, atlas_size)
+
+    with profiling.stage('mesh'):
+        vertices, triangles, triangle_uvs, material_ids = create_plane_arrays(
+            corners, corner_floor, atlases, placements, delta_height, ignore_ceiling=ignore_ceiling)
+
+    return vertices, triangles, triangle_uvs, atlases, material_ids
+
+
+def visualize_mesh(args):
+    """visualize as water-tight mesh
+    """
+    image, camera_center = load_room(args.path, args.scene, args.room)
+
+    # load room annotations
+    annos = load_annotation_3d(os.path.join(args.path, f"scene_{args.scene:05d}"))
 
     # create mesh
-    mesh = create_plane_mesh(corners, corner_floor, textures, texture_floor, texture_ceiling,
-        delta_height, ignore_ceiling=args.ignore_ceiling)
+    mesh = create_open3d_mesh(*room_mesh_arrays(
+        annos, image, camera_center, args.room, args.ignore_ceiling, args.texel_size, args.atlas_size))
 
     # visualize mesh
-    open3d.visualization.draw_geometries([mesh])
+    show_geometries(args, f"{args.room}_mesh", [mesh])
+
+
+def scene_rooms(args):
+    if args.room is not None:
+        return [args.room]
+    return [int(room_id) for room_id in list_rooms(args.path, args.scene)]
+
+
+def export_scene(args):
+    """write the textured meshes of the rooms into one mesh file per scene,
+    the rooms are built on a thread pool and streamed to the writer in order
+    """
+    annos = load_annotation_3d(os.path.join(args.path, f"scene_{args.scene:05d}"))
+
+    def build(room):
+        image, camera_center = load_room(args.path, args.scene, room)
+        return room, room_mesh_arrays(annos, image, camera_center, room, args.ignore_ceiling,
+                                      args.texel_size, args.atlas_size)
+
+    path = output_path(args, f"mesh.{args.export}")
+    rooms = iter(scene_rooms(args))
+    with ThreadPoolExecutor(args.threads) as executor, open_writer(path, args.texture) as writer:
+        # at most one room per thread is built ahead of the writer, so that the
+        # atlases of the finished rooms are not all held at once
+        pending = deque(executor.submit(build, room) for room in islice(rooms, args.threads))
+        try:
+            while pending:
+                room, (vertices, triangles, triangle_uvs, atlases, material_ids) = pending.popleft().result()
+                for next_room in islice(rooms, 1):
+                    pending.append(executor.submit(build, next_room))
+                with profiling.stage('write'):
+                    writer.add(f"room_{room}", vertices, triangles, triangle_uvs, atlases, material_ids)
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+
+
+def visualize_rooms(args):
+    """visualize the given room, or every room of the scene
+    """
+    for room in scene_rooms(args):
+        room_args = copy.copy(args)
+        room_args.room = room
+        visualize_mesh(room_args)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Structured3D 3D Textured Mesh Visualization")
     parser.add_argument("--path", required=True,
                         help="dataset path", metavar="DIR")
-    parser.add_argument("--scene", required=True,
-                        help="scene id", type=int)
-    parser.add_argument("--room", required=True,
-                        help="room id", type=int)
+    parser.add_argument("--room", default=None,
+                        help="room id, all rooms of the scene if not given", type=int)
     parser.add_argument("--ignore_ceiling", action='store_true',
                         help="ignore ceiling for better visualization")
-    return parser.parse_args()
+    parser.add_argument("--texel_size", default=10,
+                        help="texture resolution in millimeters per pixel", type=float)
+    parser.add_argument("--atlas_size", default=4096,
+                        help="maximum width and height of a texture atlas", type=int)
+    parser.add_argument("--export", default=None, choices=FORMATS,
+                        help="write the meshes of all rooms into <out>/scene_<id>/mesh.<format> instead")
+    parser.add_argument("--texture", default="jpg", choices=["jpg", "png"],
+                        help="image format of the exported textures")
+    parser.add_argument("--threads", default=4,
+                        help="number of rooms built in parallel when exporting", type=int)
+    add_batch_args(parser)
+    args = parser.parse_args()
+    if args.export is not None and args.out is None:
+        parser.error("--export requires --out")
+    return args
 
 
 def main():
     args = parse_args()
 
-    visualize_mesh(args)
+    task = "mesh" if args.room is None else f"{args.room}_mesh"
+    if args.export is not None:
+        failed = run_batch(export_scene, args, f"{task}_{args.export}")
+    else:
+        failed = run_batch(visualize_rooms, args, task)
+    sys.exit(1 if failed else 0)
 
 
 if __name__ == "__main__":